@@ -1,19 +1,33 @@
 # UI/chat.py
 import os
-import json
+import logging
 from PyQt5.QtWidgets import (
-    QWidget, QVBoxLayout, QHBoxLayout, QTextEdit, QLineEdit, QPushButton, 
-    QLabel, QFrame, QScrollBar
+    QWidget, QVBoxLayout, QHBoxLayout, QLineEdit, QPushButton, 
+    QLabel, QFrame, QListView, QAbstractItemView
 )
-from PyQt5.QtCore import Qt, QSize
-from PyQt5.QtGui import QIcon, QTextBlockFormat, QTextCursor, QTextCharFormat
+from PyQt5.QtCore import Qt, QSize, QPoint, QPersistentModelIndex
+from PyQt5.QtGui import QIcon
 
 from services import api_client, crypto_client
+from .message_list import MessageListModel, MessageDelegate
+
+logger = logging.getLogger(__name__)
+
+# Trang đầu nhỏ để hiện nhanh, các trang cũ hơn tải lớn hơn (tối đa 200, xem routes/messages.py)
+NEWEST_PAGE_SIZE = 50
+HISTORY_PAGE_SIZE = 200
+# Số tin tối đa giữ trong view; phần ngoài cửa sổ được tải lại khi cuộn tới
+MAX_LOADED_MESSAGES = 1000
+# Cách mép trên / dưới bao nhiêu px thì tải trang tiếp theo
+LOAD_MORE_THRESHOLD = 300
 
 class ChatPage(QWidget):
     def __init__(self, parent):
         super().__init__()
         self.parent = parent # HomePage
+        self._history_ready = False # Đã tải xong trang mới nhất + delta
+        self._loading = set()       # "older" / "newer" đang tải
+        self._pending_live = []     # Tin realtime đến trong lúc đang tải lịch sử
         current_dir = os.path.dirname(os.path.abspath(__file__))
         self.assets_path = os.path.join(current_dir, "assets")
         self.init_ui()
@@ -46,10 +60,8 @@ class ChatPage(QWidget):
             }
             QPushButton.action_btn:hover { background-color: #F0F4F8; }
             
-            QTextEdit#messages {
-                border: none; background-color: #FFFFFF; padding: 25px;
-                font-size: 18px; /* Tin nhắn to */
-                color: #37474F;
+            QListView#messages {
+                border: none; background-color: #FFFFFF; padding: 10px 0px;
             }
             
             QFrame#input_frame {
@@ -123,10 +135,18 @@ class ChatPage(QWidget):
         header.addWidget(self.info_button)
         main_layout.addWidget(header_frame)
 
-        # Message Area
-        self.messages = QTextEdit()
+        # Message Area: model/view, chỉ các tin đang hiện trên màn hình được vẽ
+        self.message_model = MessageListModel(MAX_LOADED_MESSAGES, self)
+        self.messages = QListView()
         self.messages.setObjectName("messages")
-        self.messages.setReadOnly(True)
+        self.messages.setModel(self.message_model)
+        self.messages.setItemDelegate(MessageDelegate(self.messages))
+        self.messages.setSelectionMode(QAbstractItemView.NoSelection)
+        self.messages.setFocusPolicy(Qt.NoFocus)
+        self.messages.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.messages.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.messages.setResizeMode(QListView.Adjust)
+        self.messages.verticalScrollBar().valueChanged.connect(self.maybe_load_more)
         main_layout.addWidget(self.messages, 1)
 
         # Input Area
@@ -168,7 +188,10 @@ class ChatPage(QWidget):
         self.input.returnPressed.connect(self.send)
 
     def clear_chat(self):
-        self.messages.clear()
+        self._history_ready = False
+        self._loading.clear()
+        self._pending_live = []
+        self.message_model.clear()
         self.input.clear()
         self.title_label.setText("Chat")
         self.status_label.setText("...")
@@ -176,9 +199,9 @@ class ChatPage(QWidget):
     def load_chat(self, chat_id):
         from .home import sio 
         
-        token = self.parent.parent.token
-        user_id = self.parent.parent.user_id
-        private_key = self.parent.parent.private_key
+        app = self.parent.parent
+        token = app.token
+        user_id = app.user_id
         
         if not sio.connected: 
             try: self.parent.connect_socket() 
@@ -186,8 +209,46 @@ class ChatPage(QWidget):
         else:
             sio.emit("join_chat", {"chat_id": chat_id, "user_id": user_id})
 
-        status, chat = api_client.get_chat_detail(token, chat_id)
-        if status == 200:
+        # Huỷ kết quả của lần mở chat trước (người dùng đã chuyển chat)
+        app.task_runner.cancel("chat")
+        self._history_ready = False
+        self._loading.clear()
+        self._pending_live = []
+        self.message_model.clear()
+        self.title_label.setText("Đang tải...")
+        # Trang mới nhất hiện ngay khi giải mã xong; trang cũ hơn chỉ tải khi cuộn lên
+        app.task_runner.submit(
+            fetch_chat_history, token, chat_id, app.decryptor, app.local_store,
+            on_progress=lambda update: self.on_history_progress(chat_id, update),
+            on_done=lambda _: self.on_history_ready(chat_id),
+            on_error=lambda e: self.on_history_ready(chat_id),
+            key=("load_chat", chat_id), group="chat"
+        )
+
+    def on_history_progress(self, chat_id, update):
+        if self.parent.current_chat_id != chat_id: return
+        user_id = self.parent.parent.user_id
+        kind, payload = update
+
+        if kind == "chat":
+            if payload: self.parent.chat_details[chat_id] = payload
+            self.show_chat_header(payload, user_id)
+            return
+
+        # "newest" / "newer": nối xuống cuối
+        self.add_page(payload, prepend=False)
+
+    def on_history_ready(self, chat_id):
+        if self.parent.current_chat_id != chat_id: return
+        self._history_ready = True
+        # Tin realtime đến trong lúc tải: nối sau lịch sử (trùng id với trang delta thì bỏ qua)
+        pending, self._pending_live = self._pending_live, []
+        for row in pending:
+            self.add_message(row["sender_id"], row["text"], row["is_me"], row["id"])
+        self.maybe_load_more()
+
+    def show_chat_header(self, chat, user_id):
+        if chat:
             self.title_label.setText(chat.get('name', 'Hội thoại'))
             if not chat.get('is_group'):
                 members = chat.get('members', [])
@@ -195,97 +256,276 @@ class ChatPage(QWidget):
                 self.parent.current_other_user_id = other_id 
             else:
                 self.parent.current_other_user_id = None
-
-        status, msgs = api_client.get_messages(token, chat_id)
-        self.messages.clear()
-        if status == 200:
-            for msg in msgs:
-                is_me = msg['sender_id'] == user_id
-                try:
-                    key_dict = json.loads(msg['aes_key_encrypted'])
-                    wrapped = key_dict.get(str(user_id))
-                    if wrapped:
-                        aes_key = crypto_client.unwrap_aes_key(wrapped, private_key)
-                        text = crypto_client.decrypt_aes_gcm(msg['content'], aes_key, msg['iv'], msg['tag'])
-                    else: text = "[Không có khóa]"
-                except Exception as e: text = f"[Lỗi giải mã: {e}]"
-                self.add_message(msg['sender_id'], text, is_me)
+        else:
+            self.title_label.setText("Hội thoại")
 
     def send(self):
-        from .home import sio 
         text = self.input.text().strip()
         if not text: return
 
-        token = self.parent.parent.token
-        user_id = self.parent.parent.user_id
+        app = self.parent.parent
         chat_id = self.parent.current_chat_id
-        
         if not chat_id: return
-        
+
+        # Đang xem lịch sử xa: quay về trang mới nhất để thấy tin vừa gửi
+        if self.message_model.has_newer:
+            self.load_chat(chat_id)
+
+        # Mã hoá + gửi chạy ở worker, GUI không bị khựng khi nhóm đông thành viên
+        self.input.clear()
+        def on_error(e):
+            # Có thể do thành viên/khóa đã đổi: lần gửi sau lấy lại chi tiết chat
+            self.parent.chat_details.pop(chat_id, None)
+            if not self.input.text(): self.input.setText(text)
+        # outgoing_runner chỉ có 1 thread: tin gửi sau không thể tới server trước tin gửi trước
+        self.parent.outgoing_runner.submit(
+            encrypt_and_send, app.token, app.user_id, chat_id, text, app.key_cache, app.decryptor.sender_keys,
+            self.parent.chat_details, on_error=on_error
+        )
+
+    def add_message(self, sender_id, text, is_me, message_id=None):
+        """Thêm 1 tin (tin realtime hoặc "System") vào cuối, cuộn xuống nếu đang ở cuối."""
+        if not self._history_ready:
+            self._pending_live.append(MessageListModel.make_row(sender_id, text, is_me, message_id))
+            return
+        bar = self.messages.verticalScrollBar()
+        at_bottom = bar.value() >= bar.maximum() - 4
+        if self.message_model.has_newer or (self.message_model.is_full() and not at_bottom):
+            # Đang xem lịch sử: không đẩy cửa sổ đi, tin mới được tải khi cuộn xuống
+            self.message_model.has_newer = True
+            return
+        self.message_model.append([MessageListModel.make_row(sender_id, text, is_me, message_id)])
+        if at_bottom:
+            self.messages.scrollToBottom()
+
+    def add_page(self, pairs, prepend):
+        """Thêm 1 trang [(msg, text)] tăng dần theo id, giữ nguyên tin đang xem trên màn hình."""
+        user_id = self.parent.parent.user_id
+        rows = [
+            MessageListModel.make_row(msg['sender_id'], text, msg['sender_id'] == user_id, msg['id'])
+            for msg, text in pairs
+        ]
+        bar = self.messages.verticalScrollBar()
+        at_bottom = not prepend and bar.value() >= bar.maximum() - 4
+
+        # Mốc: tin trên cùng đang hiện và vị trí của nó, để bù lại khi chèn / bỏ dòng phía trên
+        anchor = QPersistentModelIndex(self.messages.indexAt(QPoint(1, 1)))
+        anchor_top = self.messages.visualRect(anchor).top() if anchor.isValid() else 0
+
+        if prepend: self.message_model.prepend(rows)
+        else: self.message_model.append(rows)
+
+        self.messages.doItemsLayout()
+        if at_bottom:
+            self.messages.scrollToBottom()
+        elif anchor.isValid():
+            bar.setValue(bar.value() + self.messages.visualRect(anchor).top() - anchor_top)
+
+    def maybe_load_more(self, *_):
+        """Gần mép trên -> tải trang cũ hơn; gần mép dưới mà còn tin mới hơn -> tải trang mới hơn."""
+        chat_id = self.parent.current_chat_id
+        if not chat_id or not self._history_ready: return
+        bar = self.messages.verticalScrollBar()
+        model = self.message_model
+        if model.has_older and bar.value() <= LOAD_MORE_THRESHOLD:
+            self.load_page(chat_id, "older", before_id=model.first_id())
+        if model.has_newer and bar.value() >= bar.maximum() - LOAD_MORE_THRESHOLD:
+            self.load_page(chat_id, "newer", after_id=model.last_id())
+
+    def load_page(self, chat_id, direction, before_id=None, after_id=None):
+        if direction in self._loading or (before_id is None and after_id is None): return
+        self._loading.add(direction)
+        app = self.parent.parent
+
+        def on_done(result):
+            if self.parent.current_chat_id == chat_id and result is not None:
+                pairs, exhausted = result
+                if exhausted:
+                    # Server báo hết tin theo hướng này
+                    if direction == "older": self.message_model.has_older = False
+                    else: self.message_model.has_newer = False
+                self.add_page(pairs, prepend=direction == "older")
+            self._loading.discard(direction)
+            self.maybe_load_more()
+
+        app.task_runner.submit(
+            fetch_page, app.token, chat_id, app.decryptor, app.local_store, before_id, after_id,
+            on_done=on_done, on_error=lambda e: self._loading.discard(direction),
+            key=("chat_page", chat_id, direction), group="chat"
+        )
+
+
+# -----------------------------
+# Công việc chạy trong worker (không chạm vào widget)
+# -----------------------------
+def fetch_chat_history(token, chat_id, decryptor, store, progress):
+    """
+    Tải chi tiết chat + trang tin mới nhất và giải mã, báo dần về GUI qua progress:
+      ("chat", chat | None), ("newest", [(msg, text)]), rồi ("newer", ...) cho phần đồng bộ delta.
+    Có local store: trang mới nhất đọc từ máy, server chỉ trả các tin sau tin mới nhất đã lưu.
+    Các trang cũ hơn được tải theo yêu cầu bằng fetch_page khi người dùng cuộn lên.
+    """
+    status, chat = api_client.get_chat_detail(token, chat_id)
+    if not progress(("chat", chat if status == 200 else None)): return
+
+    local = retry_failed(decryptor, store, chat_id, store.get_messages(chat_id, limit=NEWEST_PAGE_SIZE)) if store else []
+    if not local:
+        status, msgs = api_client.get_messages(token, chat_id, limit=NEWEST_PAGE_SIZE)
+        if status != 200 or not msgs: return
+        pairs = list(zip(msgs, decryptor.map(msgs)))
+        if store: store.put_messages(chat_id, pairs)
+        progress(("newest", pairs))
+        return
+
+    if not progress(("newest", local)): return
+    # Delta: chỉ tải các tin mới hơn bản local
+    after_id = local[-1][0]['id']
+    while True:
+        status, msgs = api_client.get_messages(token, chat_id, after_id=after_id, limit=HISTORY_PAGE_SIZE)
+        if status != 200 or not msgs: break
+        pairs = list(zip(msgs, decryptor.map(msgs)))
+        store.put_messages(chat_id, pairs)
+        if not progress(("newer", pairs)): return
+        if len(msgs) < HISTORY_PAGE_SIZE: break
+        after_id = msgs[-1]['id']
+
+    if decryptor.message_keys is not None:
+        logger.debug("Chat %s: message key cache %s", chat_id, decryptor.message_keys.stats())
+
+def fetch_page(token, chat_id, decryptor, store, before_id=None, after_id=None):
+    """
+    1 trang HISTORY_PAGE_SIZE tin cũ hơn before_id / mới hơn after_id, tăng dần theo id.
+    Trả về ([(msg, text)], exhausted), None nếu server lỗi. exhausted chỉ dựa trên
+    câu trả lời của server (local store có thể chỉ giữ 1 phần lịch sử).
+    Mốc nằm trong dải đã lưu: đọc local trước, thiếu bao nhiêu thì tải tiếp từ server
+    ngay sau mép dải và lưu thêm (giữ dải liên tục).
+    """
+    older = before_id is not None
+    first_id, last_id = store.message_range(chat_id) if store else (None, None)
+    mark = before_id if older else after_id
+    in_range = first_id is not None and first_id <= mark <= last_id
+
+    local = []
+    if in_range:
+        local = store.get_messages(chat_id, before_id=before_id, after_id=after_id, limit=HISTORY_PAGE_SIZE)
+        local = retry_failed(decryptor, store, chat_id, local)
+        if len(local) == HISTORY_PAGE_SIZE:
+            return local, False
+        # Trang local bị ngắn: đã tới mép dải đã lưu, phần còn lại lấy từ server
+        if local:
+            if older: before_id = local[0][0]['id']
+            else: after_id = local[-1][0]['id']
+
+    limit = HISTORY_PAGE_SIZE - len(local)
+    status, msgs = api_client.get_messages(token, chat_id, before_id=before_id, after_id=after_id, limit=limit)
+    if status != 200: return None
+    pairs = list(zip(msgs, decryptor.map(msgs)))
+    # Trang kề ngay mép dải đã lưu -> lưu thêm
+    if in_range and pairs: store.put_messages(chat_id, pairs)
+    exhausted = len(msgs) < limit
+    return (pairs + local if older else local + pairs), exhausted
+
+def retry_failed(decryptor, store, chat_id, pairs):
+    """
+    Tin local chưa giải mã được lần trước (text None, vd. sender key chưa tải được):
+    giải mã lại, tin giải được thì ghi đè trong store. Trả về pairs đã có text để hiển thị.
+    """
+    failed = [msg for msg, text in pairs if text is None]
+    if not failed: return pairs
+    texts = dict(zip((msg['id'] for msg in failed), decryptor.map(failed)))
+    store.put_messages(chat_id, [(msg, texts[msg['id']]) for msg in failed])
+    return [(msg, texts[msg['id']] if text is None else text) for msg, text in pairs]
+
+def decrypt_incoming(decryptor, store, msg):
+    """Giải mã 1 tin realtime và đưa vào index tìm kiếm của local store."""
+    text = decryptor.decrypt(msg)
+    if store and msg.get("id") is not None:
+        store.put_loose_messages(msg["chat_id"], [(msg, text)])
+    return text
+
+def sync_changes(token, cursor, decryptor, store, progress):
+    """
+    Kéo mọi thay đổi từ cursor (GET /sync) khi kết nối lại, báo về GUI qua progress:
+      ("messages", chat_id, [(msg, text)]), ("event", event), ("chat", summary).
+    Tin được giải mã theo từng chat và đưa vào index tìm kiếm.
+    Trả về (cursor mới, đầy đủ); cursor hết hạn / không hợp lệ -> (cursor hiện tại, False):
+    người gọi phải tải lại danh sách chat. None nếu lỗi khác.
+    """
+    def flush(pending):
+        for chat_id, msgs in pending.items():
+            pairs = list(zip(msgs, decryptor.map(msgs)))
+            if store: store.put_loose_messages(chat_id, pairs)
+            if not progress(("messages", chat_id, pairs)): return False
+        pending.clear()
+        return True
+
+    while True:
+        status, items = api_client.sync(token, cursor)
+        if status in (400, 410) and cursor:
+            # Server đã xóa event cũ hơn cursor: bắt đầu lại từ cursor hiện tại
+            status, items = api_client.sync(token)
+            if status != 200: return None
+            head = next((item["cursor"] for item in items if item.get("type") == "cursor"), None)
+            return (head, False) if head else None
+        if status != 200: return None
+        pending, buffered, has_more = {}, 0, False
+        for item in items:
+            kind = item.pop("type", None)
+            if kind == "message":
+                pending.setdefault(item["chat_id"], []).append(item)
+                buffered += 1
+                if buffered >= HISTORY_PAGE_SIZE:
+                    if not flush(pending): return None
+                    buffered = 0
+            elif kind == "event":
+                if not progress(("event", item)): return None
+            elif kind == "chat":
+                if not flush(pending) or not progress(("chat", item)): return None
+            elif kind == "cursor":
+                cursor, has_more = item["cursor"], item["has_more"]
+        if not flush(pending): return None
+        if not has_more: return cursor, True
+
+def encrypt_and_send(token, user_id, chat_id, text, key_cache, sender_keys=None, chat_details=None):
+    """
+    chat_details: cache chat_id -> chi tiết chat (nạp khi mở chat, xoá khi có
+    chat_members_changed); chỉ gọi GET /chats/<id> khi chưa có.
+    """
+    from .home import emit_message
+
+    chat = chat_details.get(chat_id) if chat_details is not None else None
+    if chat is None:
         status, chat = api_client.get_chat_detail(token, chat_id)
-        if status != 200: return
-        
+        if status != 200:
+            raise RuntimeError(f"Không lấy được thông tin chat {chat_id}")
+        if chat_details is not None: chat_details[chat_id] = chat
+
+    # Public key lấy từ cache local, chỉ tải lại khi fingerprint thay đổi
+    fingerprints = chat.get("member_key_fingerprints", {})
+    def load_public_keys():
+        return key_cache.get_keys(
+            token, {mid: fingerprints.get(str(mid)) for mid in chat["members"]}
+        )
+
+    if sender_keys is not None and sender_keys.enabled_for(chat):
+        # Sender key: RSA chỉ khi tạo key mới, mỗi tin chỉ mang {"sk", "n"}
+        key_id, n, message_key = sender_keys.next_message_key(chat, load_public_keys)
+        enc = crypto_client.encrypt_aes_gcm(text, message_key)
+        aes_key_encrypted = {"sk": key_id, "n": n}
+    else:
+        public_keys = load_public_keys()
         aes_key = crypto_client.generate_aes_key()
         enc = crypto_client.encrypt_aes_gcm(text, aes_key)
-        wrapped_keys = {}
+        aes_key_encrypted = {}
         for mid in chat["members"]:
-            s, info = api_client.get_user_info(token, mid)
-            if s == 200:
-                wrapped = crypto_client.wrap_aes_key(aes_key, info["public_key"])
-                wrapped_keys[str(mid)] = wrapped
-        
-        payload = {
-            "chat_id": chat_id, "sender_id": user_id,
-            "content": enc["ciphertext"], "aes_key_encrypted": wrapped_keys,
-            "iv": enc["iv"], "tag": enc["tag"]
-        }
-        try:
-            sio.emit("send_message", payload)
-            self.input.clear()
-        except Exception as e: print(e)
-
-    def add_message(self, sender_id, text, is_me):
-        """
-        SỬA LỖI CĂN LỀ: Dùng QTextCursor và QTextBlockFormat để ép buộc căn lề.
-        """
-        text = text.replace('<', '&lt;').replace('>', '&gt;').replace('\n', '<br>')
-        
-        # 1. Lấy con trỏ văn bản hiện tại
-        cursor = self.messages.textCursor()
-        cursor.movePosition(QTextCursor.End)
-        
-        # 2. Tạo định dạng Block (đoạn văn)
-        block_format = QTextBlockFormat()
-        if sender_id == "System":
-            block_format.setAlignment(Qt.AlignCenter)
-            block_format.setTopMargin(10)
-            block_format.setBottomMargin(10)
-        elif is_me:
-            block_format.setAlignment(Qt.AlignRight) # Căn phải tuyệt đối
-            block_format.setTopMargin(5)
-            block_format.setBottomMargin(5)
-            block_format.setLeftMargin(50) # Thụt lề để không quá dài
-        else:
-            block_format.setAlignment(Qt.AlignLeft) # Căn trái tuyệt đối
-            block_format.setTopMargin(5)
-            block_format.setBottomMargin(5)
-            block_format.setRightMargin(50)
-
-        # 3. Chèn Block mới với định dạng trên
-        cursor.insertBlock(block_format)
-
-        # 4. Chèn nội dung HTML (Chỉ chứa màu sắc và font, không chứa thẻ div align)
-        if sender_id == "System":
-            html = f"<span style='color: #90A4AE; font-size: 14px;'>{text}</span>"
-        elif is_me:
-            # CHỮ MÀU XANH, ĐẬM, KHÔNG NỀN
-            html = f"<span style='color: #1565C0; font-weight: bold; font-size: 18px;'>{text}</span>"
-        else:
-            # CHỮ MÀU ĐEN/XÁM, KHÔNG NỀN
-            html = f"<span style='color: #37474F; font-size: 18px;'>{text}</span>"
-            
-        cursor.insertHtml(html)
-        
-        # 5. Cuộn xuống dưới cùng
-        self.messages.setTextCursor(cursor)
-        self.messages.verticalScrollBar().setValue(self.messages.verticalScrollBar().maximum())
\ No newline at end of file
+            pub = public_keys.get(mid)
+            if pub is not None:
+                wrapped = crypto_client.wrap_aes_key(aes_key, pub)
+                aes_key_encrypted[str(mid)] = wrapped
+
+    payload = {
+        "chat_id": chat_id, "sender_id": user_id,
+        "content": enc["ciphertext"], "aes_key_encrypted": aes_key_encrypted,
+        "iv": enc["iv"], "tag": enc["tag"]
+    }
+    emit_message(payload)
@@ -0,0 +1,127 @@
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex
+from PyQt5.QtGui import QColor, QFont
+
+ChatIdRole = Qt.UserRole
+NameRole = Qt.UserRole + 1
+UnreadRole = Qt.UserRole + 2
+
+_UNREAD_COLOR = QColor("#1E88E5")
+_READ_COLOR = QColor("#37474F")
+
+
+class ChatListModel(QAbstractListModel):
+    """
+    Danh sách chat của sidebar, sắp theo hoạt động gần nhất (tin mới nhất ở trên).
+    - self._chats: list dict theo thứ tự hiển thị; self._rows: chat_id -> row (tra cứu O(1)).
+    - Cập nhật 1 chat chỉ phát dataChanged cho đúng dòng đó; có tin mới -> rowsMoved lên đầu,
+      view giữ nguyên selection / scroll, không dựng lại item nào.
+    """
+
+    def __init__(self, icon=None, parent=None):
+        super().__init__(parent)
+        self.icon = icon
+        self._chats = []
+        self._rows = {}
+        self._bold_font = QFont()
+        self._bold_font.setBold(True)
+
+    # -----------------------------
+    # Qt model API
+    # -----------------------------
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._chats)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self._chats):
+            return None
+        chat = self._chats[index.row()]
+        unread = chat["unread"]
+        if role == Qt.DisplayRole:
+            return f"{chat['name']}   ({unread})" if unread > 0 else chat["name"]
+        if role == Qt.DecorationRole:
+            return self.icon
+        if role == Qt.FontRole:
+            return self._bold_font if unread > 0 else None
+        if role == Qt.ForegroundRole:
+            return _UNREAD_COLOR if unread > 0 else _READ_COLOR
+        if role == ChatIdRole:
+            return chat["chat_id"]
+        if role == NameRole:
+            return chat["name"]
+        if role == UnreadRole:
+            return unread
+        return None
+
+    # -----------------------------
+    # Cập nhật
+    # -----------------------------
+    @staticmethod
+    def _activity(chat):
+        # id tin tăng dần nên dùng làm mốc hoạt động; chat chưa có tin xếp theo id chat
+        return (chat.get("last_message_id") or 0, chat["chat_id"])
+
+    def reset(self, chats):
+        """Nạp lại toàn bộ từ GET /chats (1 lần beginResetModel, không tạo widget nào)."""
+        self.beginResetModel()
+        self._chats = [
+            {
+                "chat_id": c["chat_id"],
+                "name": c.get("name") or "Chat",
+                "unread": c.get("unread_count", 0),
+                "last_message_id": c.get("last_message_id")
+            }
+            for c in sorted(chats, key=self._activity, reverse=True)
+        ]
+        self._rows = {chat["chat_id"]: row for row, chat in enumerate(self._chats)}
+        self.endResetModel()
+
+    def clear(self):
+        self.reset([])
+
+    def contains(self, chat_id):
+        return chat_id in self._rows
+
+    def index_of(self, chat_id):
+        row = self._rows.get(chat_id)
+        return QModelIndex() if row is None else self.index(row)
+
+    def name(self, chat_id):
+        row = self._rows.get(chat_id)
+        return None if row is None else self._chats[row]["name"]
+
+    def upsert(self, chat_id, name=None, unread=None, last_message_id=None, move_to_top=True):
+        """
+        Thêm hoặc cập nhật 1 chat. Chỉ các trường khác None được ghi đè.
+        move_to_top: có hoạt động mới -> chuyển dòng lên đầu.
+        """
+        row = self._rows.get(chat_id)
+        if row is None:
+            chat = {"chat_id": chat_id, "name": name or "Chat", "unread": unread or 0,
+                    "last_message_id": last_message_id}
+            self.beginInsertRows(QModelIndex(), 0, 0)
+            self._chats.insert(0, chat)
+            self._reindex(0, len(self._chats))
+            self.endInsertRows()
+            return
+
+        chat = self._chats[row]
+        if name:
+            chat["name"] = name
+        if unread is not None:
+            chat["unread"] = unread
+        if last_message_id is not None:
+            chat["last_message_id"] = max(last_message_id, chat.get("last_message_id") or 0)
+
+        if move_to_top and row > 0:
+            self.beginMoveRows(QModelIndex(), row, row, QModelIndex(), 0)
+            self._chats.insert(0, self._chats.pop(row))
+            self._reindex(0, row + 1)
+            self.endMoveRows()
+            row = 0
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    def _reindex(self, start, stop):
+        # Chỉ các dòng trong [start, stop) bị dời chỗ
+        for row in range(start, stop):
+            self._rows[self._chats[row]["chat_id"]] = row
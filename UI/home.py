@@ -1,52 +1,90 @@
 import os
-import threading
 import socketio
 from PyQt5.QtWidgets import (
-    QWidget, QHBoxLayout, QVBoxLayout, QListWidget, 
+    QWidget, QHBoxLayout, QVBoxLayout, QListWidget, QListView,
     QPushButton, QLabel, QFrame, QListWidgetItem, QLineEdit,
     QStackedLayout, QGraphicsDropShadowEffect, QAbstractItemView
 )
-from PyQt5.QtCore import Qt, QObject, pyqtSignal, QSize
+from PyQt5.QtCore import Qt, QObject, pyqtSignal, QSize, QSortFilterProxyModel, QTimer
 from PyQt5.QtGui import QFont, QColor, QIcon, QPixmap, QPainter, QBrush
-from services import api_client, crypto_client
+from services import api_client, crypto_client, wire_format
+from services.profile_cache import profile_cache
 
-from .chat import ChatPage 
+from .chat import ChatPage, decrypt_incoming, sync_changes
+from .chat_list_model import ChatListModel, ChatIdRole, NameRole
+from .task_runner import TaskRunner
 from .profile import ProfilePage
 from .info_panel import InfoPanel 
 
 SOCKET_URL = "http://127.0.0.1:5001"
+SEARCH_DEBOUNCE_MS = 150
+# Khi đang kết nối và có tin realtime: gọi /sync định kỳ để dời cursor, nên lần kết nối lại
+# chỉ phải bù phần thay đổi từ lần sync gần nhất (tối đa chu kỳ này), không phải từ lúc kết nối.
+SYNC_INTERVAL_MS = 60_000
+SEARCH_RESULT_LIMIT = 50
 sio = socketio.Client(reconnection=True)
+# Định dạng tin nhắn server đã xác nhận cho kết nối hiện tại (sự kiện "wire_format")
+wire = {"binary": False}
+
+def connect_auth(token):
+    """Auth gửi lúc connect; đề nghị envelope msgpack nếu client có cài msgpack."""
+    auth = {"token": token}
+    if wire_format.AVAILABLE:
+        auth["wire"] = wire_format.BINARY
+    return auth
+
+def emit_message(payload):
+    """Gửi send_message theo định dạng đã thoả thuận."""
+    if wire["binary"]:
+        sio.emit("send_message", wire_format.pack_message(payload))
+    else:
+        sio.emit("send_message", payload)
 
 class SocketSignals(QObject):
     connected = pyqtSignal()
     disconnected = pyqtSignal()
-    online_users_received = pyqtSignal(list)
+    online_users_received = pyqtSignal(dict)
+    presence_joined = pyqtSignal(dict)
+    presence_left = pyqtSignal(dict)
+    profile_updated = pyqtSignal(dict)
+    chat_members_changed = pyqtSignal(dict)
     new_message_received = pyqtSignal(dict)
-    # Signal mới: Dùng để cập nhật 1 item chat cụ thể (Thêm mới hoặc đẩy lên đầu)
-    chat_updated = pyqtSignal(dict) 
+    chat_summary = pyqtSignal(dict)
 
 class HomePage(QWidget):
     def __init__(self, parent):
         super().__init__()
         self.parent = parent
         self.online_users = {}
+        self.presence_seq = 0
         self.socket_connected = False
+        self.sync_cursor = None # Cursor của GET /sync: mốc để bù thay đổi khi kết nối lại
+        self.live_since_sync = False # Có tin realtime kể từ lần /sync gần nhất
         self._socket_initialized = False
         self.current_chat_id = None 
         self.current_other_user_id = None 
+        self.chat_details = {} # chat_id -> GET /chats/<id> (members + fingerprint), dùng lại khi gửi tin
         
         current_dir = os.path.dirname(os.path.abspath(__file__))
         self.assets_path = os.path.join(current_dir, "assets")
 
         self.socket_signals = SocketSignals()
+        # Worker 1 thread: giải mã tin đến theo đúng thứ tự nhận
+        self.incoming_runner = TaskRunner(max_threads=1)
+        # Worker 1 thread: mã hoá + gửi theo đúng thứ tự người dùng bấm gửi
+        self.outgoing_runner = TaskRunner(max_threads=1)
         self.init_ui()
         
         # Kết nối các tín hiệu
         self.socket_signals.connected.connect(self.on_socket_connected)
         self.socket_signals.disconnected.connect(self.on_socket_disconnected)
         self.socket_signals.online_users_received.connect(self.handle_online_users)
+        self.socket_signals.presence_joined.connect(self.handle_presence_joined)
+        self.socket_signals.presence_left.connect(self.handle_presence_left)
+        self.socket_signals.profile_updated.connect(self.handle_profile_updated)
+        self.socket_signals.chat_members_changed.connect(self.handle_chat_members_changed)
         self.socket_signals.new_message_received.connect(self.handle_new_message)
-        self.socket_signals.chat_updated.connect(self.upsert_chat_item) # <--- Kết nối signal mới
+        self.socket_signals.chat_summary.connect(self.handle_chat_summary)
 
     def get_icon(self, name):
         path = os.path.join(self.assets_path, name)
@@ -97,12 +135,12 @@ class HomePage(QWidget):
                 margin-top: 25px;
                 padding-left: 20px;
             }
-            QListWidget {
+            QListView {
                 background-color: transparent;
                 border: none;
                 outline: none;
             }
-            QListWidget::item {
+            QListView::item {
                 padding: 16px; 
                 border-radius: 12px;
                 margin: 5px 12px;
@@ -110,8 +148,8 @@ class HomePage(QWidget):
                 font-weight: 500;
                 font-size: 18px;
             }
-            QListWidget::item:hover { background-color: #F5F7FA; }
-            QListWidget::item:selected {
+            QListView::item:hover { background-color: #F5F7FA; }
+            QListView::item:selected {
                 background-color: #E3F2FD;
                 color: #1565C0;
             }
@@ -177,11 +215,33 @@ class HomePage(QWidget):
         lbl_chat.setProperty("class", "section_title")
         list_layout.addWidget(lbl_chat)
 
-        self.chat_list = QListWidget()
+        # Model + proxy lọc theo tên: cập nhật từng dòng, không dựng lại widget
+        self.chat_model = ChatListModel(self.get_icon("logo.png"), self)
+        self.chat_proxy = QSortFilterProxyModel(self)
+        self.chat_proxy.setSourceModel(self.chat_model)
+        self.chat_proxy.setFilterRole(NameRole)
+        self.chat_proxy.setFilterCaseSensitivity(Qt.CaseInsensitive)
+
+        self.chat_list = QListView()
+        self.chat_list.setModel(self.chat_proxy)
+        self.chat_list.setUniformItemSizes(True)
+        self.chat_list.setEditTriggers(QAbstractItemView.NoEditTriggers)
         self.chat_list.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
-        self.chat_list.itemClicked.connect(self.on_chat_clicked)
+        self.chat_list.clicked.connect(self.on_chat_clicked)
         list_layout.addWidget(self.chat_list, 2)
 
+        # Kết quả tìm trong nội dung tin nhắn (index trên máy), chỉ hiện khi đang tìm
+        self.search_label = QLabel("  Trong tin nhắn")
+        self.search_label.setProperty("class", "section_title")
+        self.search_label.hide()
+        list_layout.addWidget(self.search_label)
+
+        self.search_results = QListWidget()
+        self.search_results.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.search_results.itemClicked.connect(lambda item: self.open_chat(item.data(Qt.UserRole)))
+        self.search_results.hide()
+        list_layout.addWidget(self.search_results, 2)
+
         lbl_online = QLabel("  Đang hoạt động")
         lbl_online.setProperty("class", "section_title")
         list_layout.addWidget(lbl_online)
@@ -257,187 +317,309 @@ class HomePage(QWidget):
         self.info_panel.hide()
         main_layout.addWidget(self.info_panel)
 
-        self.search_bar.textChanged.connect(self.filter_lists)
+        # Lọc sau khi ngừng gõ SEARCH_DEBOUNCE_MS, không lọc lại ở mỗi phím
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.filter_lists)
+        self.search_bar.textChanged.connect(self.search_timer.start)
+        self.sync_timer = QTimer(self)
+        self.sync_timer.setInterval(SYNC_INTERVAL_MS)
+        self.sync_timer.timeout.connect(self.on_sync_timer)
         self.profile_btn.clicked.connect(self.show_profile)
         self.logout_btn.clicked.connect(self.logout)
         self.chat_page.info_button.clicked.connect(self.toggle_info_panel)
 
     # --- LOGIC MỚI: CẬP NHẬT CHAT NÓNG (HOT UPDATE) ---
     
-    def upsert_chat_item(self, chat_data):
+    def upsert_chat_item(self, chat_data, move_to_top=True):
         """
         Hàm này chạy trên GUI Thread thông qua Signal.
-        Nó sẽ tìm chat trong list:
-        - Nếu có: Đẩy lên đầu, in đậm, đổi màu.
-        - Nếu chưa: Tạo mới, chèn vào đầu, in đậm, đổi màu.
+        Thêm / cập nhật 1 chat trong model (tra theo chat_id, O(1)):
+        - unread > 0: in đậm, màu xanh; unread = 0: bình thường.
+        - move_to_top: đẩy lên đầu (khi có tin mới), view tự giữ nguyên chat đang chọn.
         """
-        chat_id = chat_data["chat_id"]
-        name = chat_data.get("name", "Chat")
-        unread = chat_data.get("unread_count", 1) # Mặc định là 1 nếu tin mới đến
-
-        # 1. Tìm xem item đã tồn tại chưa
-        existing_item = None
-        row = -1
-        for i in range(self.chat_list.count()):
-            item = self.chat_list.item(i)
-            if item.data(Qt.UserRole) == chat_id:
-                existing_item = item
-                row = i
-                break
-        
-        # 2. Xóa item cũ nếu có (để lát chèn lên đầu)
-        if existing_item:
-            self.chat_list.takeItem(row)
-        
-        # 3. Tạo item mới (hoặc tái sử dụng)
-        display_text = f"{name}"
-        if unread > 0:
-             display_text += f"   ({unread})" # Thêm số lượng tin nhắn
-
-        new_item = QListWidgetItem(display_text)
-        new_item.setIcon(self.get_icon("logo.png"))
-        new_item.setData(Qt.UserRole, chat_id)
-        
-        # 4. Style: In đậm và Màu xanh
-        font = new_item.font()
-        font.setBold(True)
-        new_item.setFont(font)
-        new_item.setForeground(QColor("#1E88E5"))
-        
-        # 5. Chèn vào đầu danh sách (Index 0)
-        self.chat_list.insertItem(0, new_item)
+        self.chat_model.upsert(
+            chat_data["chat_id"],
+            name=chat_data.get("name"),
+            unread=chat_data.get("unread_count", 0),
+            last_message_id=chat_data.get("last_message_id"),
+            move_to_top=move_to_top
+        )
+
+    def handle_chat_summary(self, summary):
+        """
+        chat_summary từ server: số chưa đọc chính xác của 1 chat (tin mới hoặc đã đọc ở thiết bị khác).
+        Thay cho việc tự +1 / gọi lại REST.
+        """
+        chat_id = summary["chat_id"]
+        unread = summary.get("unread", 0)
+        if self.content_stack.currentWidget() == self.chat_page and self.current_chat_id == chat_id:
+            unread = 0 # Đang mở chat: tin vừa tới đã được đánh dấu đọc
+        chat_data = {"chat_id": chat_id, "name": summary.get("name"), "unread_count": unread,
+                     "last_message_id": summary.get("last_message_id")}
 
-    def fetch_specific_chat(self, chat_id):
-        """Hàm chạy trong thread phụ để lấy thông tin chat"""
-        status, chat = api_client.get_chat_detail(self.parent.token, chat_id)
-        if status == 200:
-            # Giả lập unread = 1 để kích hoạt in đậm (vì tin mới vừa tới)
-            chat["unread_count"] = 1 
-            self.socket_signals.chat_updated.emit(chat)
+        if not self.chat_model.contains(chat_id) and not chat_data["name"]:
+            self.fetch_specific_chat(chat_id, unread)
+            return
+        self.upsert_chat_item(chat_data, move_to_top=summary.get("last_message_id") is not None)
+
+    def fetch_specific_chat(self, chat_id, unread=0):
+        """Lấy thông tin chat ở worker rồi thêm vào list"""
+        def on_done(result):
+            status, chat = result
+            if status == 200:
+                chat["unread_count"] = unread
+                self.upsert_chat_item(chat)
+        self.parent.task_runner.submit(
+            api_client.get_chat_detail, self.parent.token, chat_id,
+            on_done=on_done, key=("chat_detail", chat_id)
+        )
+
+    def mark_read(self, chat_id, up_to_message_id=None):
+        """Đánh dấu đã đọc qua socket (server đẩy lại chat_summary); mất kết nối -> REST."""
+        if self.socket_connected:
+            sio.emit("mark_read", {"chat_id": chat_id, "up_to_message_id": up_to_message_id})
+        else:
+            self.parent.task_runner.submit(api_client.mark_chat_read, self.parent.token, chat_id, up_to_message_id)
 
     # --------------------------------------------------
 
     def update_online_list(self):
+        # 1 request batch (ở worker) cho toàn bộ user online chưa có trong cache
+        self.parent.task_runner.submit(
+            profile_cache.get_many, self.parent.token, list(self.online_users.keys()),
+            on_done=self.render_online_list, key="online_list"
+        )
+
+    def render_online_list(self, profiles):
         self.online_list.clear()
         for uid in self.online_users.keys():
-            status, data = api_client.get_user_info(self.parent.token, uid)
-            name = f"User {uid}" 
-            if status == 200:
-                name = data.get("full_name") or data.get("username")
-            
-            item = QListWidgetItem(name)
-            item.setIcon(self.get_status_icon(True)) 
-            item.setData(Qt.UserRole, uid)
-            self.online_list.addItem(item)
-            self.filter_lists()
+            self.add_online_item(uid, profiles.get(uid))
+        self.filter_lists()
+
+    def add_online_item(self, uid, profile=None):
+        if profile is None:
+            profile = profile_cache.peek(uid)
+        if profile is None:
+            # Chưa có trong cache: hiện tạm "User X", cập nhật tên khi tải xong
+            self.parent.task_runner.submit(
+                profile_cache.get, self.parent.token, uid,
+                on_done=lambda p: self.update_online_item_name(uid, p), key=("profile", uid)
+            )
+        
+        item = QListWidgetItem(self.display_name(uid, profile))
+        item.setIcon(self.get_status_icon(True)) 
+        item.setData(Qt.UserRole, uid)
+        self.online_list.addItem(item)
+        return item
+
+    def display_name(self, uid, profile):
+        if profile:
+            return profile.get("full_name") or profile.get("username")
+        return f"User {uid}"
+
+    def update_online_item_name(self, uid, profile):
+        for i in range(self.online_list.count()):
+            item = self.online_list.item(i)
+            if item.data(Qt.UserRole) == uid:
+                item.setText(self.display_name(uid, profile))
+                search_text = self.search_bar.text().lower().strip()
+                item.setHidden(search_text not in item.text().lower())
+                break
+
+    def remove_online_item(self, uid):
+        for i in range(self.online_list.count()):
+            if self.online_list.item(i).data(Qt.UserRole) == uid:
+                self.online_list.takeItem(i)
+                break
 
     def refresh_chats(self):
-        status, chats = api_client.get_chats(self.parent.token)
-        self.chat_list.clear()
-        if status == 200:
-            chats_sorted = sorted(chats, key=lambda c: c.get('unread_count', 0), reverse=True)
-            for c in chats_sorted:
-                name = c['name']
-                unread = c.get('unread_count', 0)
-                
-                if unread > 0:
-                    display_text = f"{name}   ({unread})"
-                else:
-                    display_text = name
-
-                item = QListWidgetItem(display_text)
-                item.setIcon(self.get_icon("logo.png"))
-                item.setData(Qt.UserRole, c["chat_id"])
-                
-                font = item.font()
-                if unread > 0:
-                    font.setBold(True)
-                    item.setForeground(QColor("#1E88E5"))
-                else:
-                    font.setBold(False)
-                    item.setForeground(QColor("#37474F"))
-                
-                item.setFont(font)
-                self.chat_list.addItem(item)
-                
-                if c["chat_id"] == self.current_chat_id:
-                    self.chat_list.setCurrentItem(item)
-            self.filter_lists()
+        self.parent.task_runner.submit(
+            api_client.get_chats, self.parent.token,
+            on_done=self.render_chats, key="refresh_chats"
+        )
+
+    def render_chats(self, result):
+        status, chats = result
+        if status != 200:
+            return
+        self.chat_model.reset(chats)
+        if self.current_chat_id is not None:
+            self.chat_list.setCurrentIndex(
+                self.chat_proxy.mapFromSource(self.chat_model.index_of(self.current_chat_id))
+            )
 
     def set_current_user_label(self):
-        if self.parent.user_id:
-            status, data = api_client.get_user_info(self.parent.token, self.parent.user_id)
-            if status == 200:
-                name = data.get("full_name") or self.parent.user_id
+        user_id = self.parent.user_id
+        if not user_id: return
+        def on_done(data):
+            if self.parent.user_id != user_id: return
+            if data:
+                name = data.get("full_name") or user_id
                 self.profile_btn.setText(f"  {name}")
             else:
-                self.profile_btn.setText(f"  User {self.parent.user_id}")
+                self.profile_btn.setText(f"  User {user_id}")
+        self.parent.task_runner.submit(
+            profile_cache.get, self.parent.token, user_id,
+            on_done=on_done, key=("profile", user_id)
+        )
 
     def on_socket_connected(self):
         self.socket_connected = True
         print("[Socket] Kết nối thành công")
+        # Lần đầu: lấy cursor hiện tại; kết nối lại: bù mọi thay đổi từ cursor cũ
+        self.sync_changes()
+        self.sync_timer.start()
+
+    def on_sync_timer(self):
+        if self.socket_connected and self.live_since_sync:
+            self.sync_changes()
+
+    def sync_changes(self):
+        if not self.parent.token: return
+        self.live_since_sync = False
+        def on_done(result):
+            if result is None:
+                self.refresh_chats() # Sync lỗi: tải lại danh sách chat
+                return
+            self.sync_cursor, complete = result
+            if not complete:
+                self.refresh_chats() # Cursor hết hạn: bù bằng cách tải lại, lần sau sync từ cursor mới
+        self.parent.task_runner.submit(
+            sync_changes, self.parent.token, self.sync_cursor, self.parent.decryptor, self.parent.local_store,
+            on_progress=self.on_sync_progress, on_done=on_done, key="sync", group="sync"
+        )
+
+    def on_sync_progress(self, update):
+        kind = update[0]
+        if kind == "messages":
+            _, chat_id, pairs = update
+            if self.content_stack.currentWidget() == self.chat_page and self.current_chat_id == chat_id:
+                for msg, text in pairs:
+                    sender = msg["sender_id"]
+                    self.chat_page.add_message(sender, text, sender == self.parent.user_id, msg["id"])
+                self.mark_read(chat_id, pairs[-1][0]["id"])
+        elif kind == "event":
+            event = update[1]
+            if event["kind"] == "chat_joined" and not self.chat_model.contains(event["chat_id"]):
+                self.fetch_specific_chat(event["chat_id"])
+        elif kind == "chat":
+            self.handle_chat_summary(update[1])
 
     def on_socket_disconnected(self):
         self.socket_connected = False
+        self.sync_timer.stop()
         print("[Socket] Mất kết nối")
 
-    def handle_online_users(self, users):
+    def handle_online_users(self, snapshot):
+        """Snapshot đầy đủ: nhận 1 lần khi connect hoặc sau khi yêu cầu resync."""
+        users = snapshot.get("users", [])
+        self.presence_seq = snapshot.get("seq", 0)
         self.online_users = {uid: True for uid in users if uid != self.parent.user_id}
         self.update_online_list()
 
+    def check_presence_seq(self, event):
+        """Trả về False (và yêu cầu resync) nếu phát hiện mất sự kiện presence."""
+        seq = event.get("seq", 0)
+        if seq <= self.presence_seq:
+            return False # Sự kiện cũ, đã có trong snapshot
+        if seq != self.presence_seq + 1:
+            print(f"[Socket] Presence gap ({self.presence_seq} -> {seq}), resync")
+            sio.emit("presence_sync", {})
+            return False
+        self.presence_seq = seq
+        return True
+
+    def handle_presence_joined(self, event):
+        if not self.check_presence_seq(event): return
+        uid = event["user_id"]
+        if uid == self.parent.user_id or uid in self.online_users: return
+        self.online_users[uid] = True
+        item = self.add_online_item(uid)
+        search_text = self.search_bar.text().lower().strip()
+        item.setHidden(search_text not in item.text().lower())
+
+    def handle_profile_updated(self, event):
+        uid = event.get("user_id")
+        profile_cache.invalidate(uid)
+        if uid == self.parent.user_id:
+            self.set_current_user_label()
+        elif uid in self.online_users:
+            self.remove_online_item(uid)
+            self.add_online_item(uid)
+
+    def handle_chat_members_changed(self, event):
+        self.chat_details.pop(event.get("chat_id"), None)
+
+    def handle_presence_left(self, event):
+        if not self.check_presence_seq(event): return
+        uid = event["user_id"]
+        if self.online_users.pop(uid, None):
+            self.remove_online_item(uid)
+
     def handle_new_message(self, msg):
         chat_id = msg["chat_id"]
         sender = msg["sender_id"]
+        self.live_since_sync = True
         
         # TRƯỜNG HỢP 1: Đang mở chat này -> Hiện tin nhắn
         if self.content_stack.currentWidget() == self.chat_page and self.current_chat_id == chat_id:
-            try:
-                key_dict = msg["aes_key_encrypted"]
-                wrapped = key_dict.get(str(self.parent.user_id))
-                if wrapped:
-                    aes_key = crypto_client.unwrap_aes_key(wrapped, self.parent.private_key)
-                    text = crypto_client.decrypt_aes_gcm(msg["content"], aes_key, msg["iv"], msg["tag"])
-                else:
-                    text = "[Không có khóa giải mã]"
-            except Exception as e:
-                text = f"[Lỗi: {e}]"
-            self.chat_page.add_message(sender, text, sender == self.parent.user_id)
+            # Giải mã (RSA) ở worker, hiển thị khi xong nếu vẫn đang mở chat này
+            def on_decrypted(text):
+                if self.current_chat_id != chat_id: return
+                self.chat_page.add_message(sender, text, sender == self.parent.user_id, msg.get("id"))
+            self.incoming_runner.submit(
+                decrypt_incoming, self.parent.decryptor, self.parent.local_store, msg, on_done=on_decrypted
+            )
             
-            # Vẫn đánh dấu đã đọc
-            token = self.parent.token
-            threading.Thread(target=api_client.mark_chat_read, args=(token, chat_id), daemon=True).start()
-        
-        # TRƯỜNG HỢP 2: Chat khác / Chat mới -> CẬP NHẬT LIST NGAY LẬP TỨC
-        else:
-            # Kiểm tra xem chat đã có trong list chưa
-            found = False
-            for i in range(self.chat_list.count()):
-                item = self.chat_list.item(i)
-                if item.data(Qt.UserRole) == chat_id:
-                    # Nếu có rồi -> Lấy thông tin hiện tại để đẩy lên
-                    chat_name = item.text().split("   (")[0] # Lấy tên gốc
-                    # Giả lập dữ liệu để đẩy lên đầu
-                    chat_data = {"chat_id": chat_id, "name": chat_name, "unread_count": 1} # Tạm thời +1
-                    self.upsert_chat_item(chat_data)
-                    found = True
-                    break
-            
-            # Nếu chưa có -> Phải gọi API lấy tên chat rồi mới add vào
-            if not found:
-                threading.Thread(target=self.fetch_specific_chat, args=(chat_id,), daemon=True).start()
+            # Vẫn đánh dấu đã đọc (tới đúng tin vừa nhận)
+            self.mark_read(chat_id, msg.get("id"))
+        # Chat khác / chat mới: danh sách được cập nhật qua chat_summary
 
     def filter_lists(self):
         search_text = self.search_bar.text().lower().strip()
-        for i in range(self.chat_list.count()):
-            item = self.chat_list.item(i)
-            item.setHidden(search_text not in item.text().lower())
+        self.chat_proxy.setFilterFixedString(search_text)
         for i in range(self.online_list.count()):
             item = self.online_list.item(i)
             item.setHidden(search_text not in item.text().lower())
+        self.search_messages(search_text)
+
+    def search_messages(self, query):
+        """Tìm trong nội dung tin nhắn đã giải mã (LocalStore.search, chạy ở worker)."""
+        store = self.parent.local_store
+        if len(query) < 2 or not store or not store.search_available:
+            self.search_results.clear()
+            self.search_results.hide()
+            self.search_label.hide()
+            return
+
+        def on_done(results):
+            if self.search_bar.text().lower().strip() != query: return # Đã gõ tiếp
+            self.render_search_results(results)
+        self.parent.task_runner.submit(
+            store.search, query, SEARCH_RESULT_LIMIT, on_done=on_done, key=("search", query)
+        )
+
+    def render_search_results(self, results):
+        self.search_results.clear()
+        for msg, text in results:
+            chat_name = self.chat_model.name(msg["chat_id"]) or "Chat"
+            snippet = " ".join(text.split())
+            if len(snippet) > 60: snippet = snippet[:57] + "..."
+            item = QListWidgetItem(f"{chat_name}: {snippet}")
+            item.setData(Qt.UserRole, msg["chat_id"])
+            item.setToolTip(text)
+            self.search_results.addItem(item)
+        self.search_label.setVisible(True)
+        self.search_results.setVisible(True)
+        if not results:
+            self.search_results.addItem(QListWidgetItem("Không tìm thấy"))
 
     def show_profile(self):
         profile_dialog = ProfilePage(self.parent)
-        profile_dialog.exec_()
+        if profile_dialog.exec_():
+            self.set_current_user_label()
 
     def toggle_info_panel(self):
         if self.info_panel.isVisible():
@@ -449,22 +631,19 @@ class HomePage(QWidget):
             else:
                 print("Không có thông tin user để hiển thị")
 
-    def on_chat_clicked(self, item):
-        chat_id = item.data(Qt.UserRole)
+    def on_chat_clicked(self, index):
+        self.open_chat(index.data(ChatIdRole))
+
+    def open_chat(self, chat_id):
+        if not chat_id: return
         self.current_chat_id = chat_id
         self.info_panel.hide()
         
         # Reset hiển thị về bình thường (bỏ bold, bỏ số)
-        font = item.font()
-        font.setBold(False)
-        item.setFont(font)
-        item.setForeground(QColor("#37474F"))
-        txt = item.text().split("   (")[0]
-        item.setText(txt)
+        self.chat_model.upsert(chat_id, unread=0, move_to_top=False)
         
-        token = self.parent.token
-        if token and chat_id:
-            threading.Thread(target=api_client.mark_chat_read, args=(token, chat_id), daemon=True).start()
+        if self.parent.token and chat_id:
+            self.mark_read(chat_id)
 
         self.chat_page.load_chat(chat_id)
         self.content_stack.setCurrentWidget(self.chat_page)
@@ -472,7 +651,13 @@ class HomePage(QWidget):
     def start_chat_with_user(self, item):
         uid = item.data(Qt.UserRole)
         if uid == self.parent.user_id: return
-        status, chat = api_client.create_chat(self.parent.token, name=f"Chat {uid}", is_group=False, members=[uid])
+        self.parent.task_runner.submit(
+            api_client.create_chat, self.parent.token, name=f"Chat {uid}", is_group=False, members=[uid],
+            on_done=self.on_chat_created, key=("create_chat", uid)
+        )
+
+    def on_chat_created(self, result):
+        status, chat = result
         if status in (200, 201):
             chat_id = chat["chat_id"]
             self.current_chat_id = chat_id
@@ -488,31 +673,67 @@ class HomePage(QWidget):
             self._socket_initialized = False 
             self.socket_connected = False
         except: pass
-        api_client.logout(self.parent.token)
+        self.parent.task_runner.submit(api_client.logout, self.parent.token)
+        self.parent.task_runner.cancel("chat")
+        self.parent.task_runner.cancel("sync")
+        self.sync_timer.stop()
+        self.sync_cursor = None
+        self.live_since_sync = False
         self.parent.token = None
         self.parent.user_id = None
         self.parent.private_key = None
+        if self.parent.decryptor: self.parent.decryptor.shutdown()
+        self.parent.decryptor = None
+        if self.parent.local_store: self.parent.local_store.close()
+        self.parent.local_store = None
+        self.parent.key_cache = None
+        self.chat_details.clear()
+        profile_cache.clear()
+        self.chat_model.clear()
+        self.search_bar.clear()
+        self.current_chat_id = None
         self.current_other_user_id = None
         self.chat_page.clear_chat()
         self.parent.layout.setCurrentWidget(self.parent.login_page)
 
     def connect_socket(self):
+        # Kết nối chạy trong task_runner (ngoài GUI thread); key gộp các lần gọi trùng nhau
+        def on_error(e): print(f"Socket connect err: {e}")
         if self._socket_initialized:
-            try: 
-                if not self.socket_connected: sio.connect(SOCKET_URL, auth={"token": self.parent.token}, wait_timeout=5)
-            except: pass
+            if not self.socket_connected:
+                self.parent.task_runner.submit(
+                    sio.connect, SOCKET_URL, auth=connect_auth(self.parent.token), wait_timeout=5,
+                    on_error=on_error, key="socket_connect"
+                )
             return
         self._socket_initialized = True
-        def _connect():
-            try: sio.connect(SOCKET_URL, auth={"token": self.parent.token}, wait_timeout=10)
-            except Exception as e: print(f"Socket connect err: {e}")
-        threading.Thread(target=_connect, daemon=True).start()
-
         @sio.on("connect")
         def on_connect(): self.socket_signals.connected.emit()
         @sio.on("disconnect")
-        def on_disconnect(): self.socket_signals.disconnected.emit()
+        def on_disconnect():
+            wire["binary"] = False
+            self.socket_signals.disconnected.emit()
+        @sio.on("wire_format")
+        def on_wire_format(info): wire["binary"] = info.get("format") == wire_format.BINARY
         @sio.on("online_users")
-        def on_online(users): self.socket_signals.online_users_received.emit(users)
+        def on_online(snapshot): self.socket_signals.online_users_received.emit(snapshot)
+        @sio.on("presence_joined")
+        def on_presence_joined(event): self.socket_signals.presence_joined.emit(event)
+        @sio.on("presence_left")
+        def on_presence_left(event): self.socket_signals.presence_left.emit(event)
+        @sio.on("profile_updated")
+        def on_profile_updated(event): self.socket_signals.profile_updated.emit(event)
+        @sio.on("chat_members_changed")
+        def on_chat_members_changed(event): self.socket_signals.chat_members_changed.emit(event)
+        @sio.on("chat_summary")
+        def on_chat_summary(summary): self.socket_signals.chat_summary.emit(summary)
         @sio.on("receive_message")
-        def on_receive(msg): self.socket_signals.new_message_received.emit(msg)
\ No newline at end of file
+        def on_receive(msg):
+            if isinstance(msg, (bytes, bytearray)): msg = wire_format.unpack_message(msg)
+            self.socket_signals.new_message_received.emit(msg)
+
+        # Đăng ký handler xong mới kết nối, không bỏ lỡ sự kiện đầu tiên
+        self.parent.task_runner.submit(
+            sio.connect, SOCKET_URL, auth=connect_auth(self.parent.token), wait_timeout=10,
+            on_error=on_error, key="socket_connect"
+        )
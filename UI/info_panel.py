@@ -6,6 +6,7 @@ from PyQt5.QtWidgets import (
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QIcon
 from services import api_client
+from services.profile_cache import profile_cache
 
 class InfoPanel(QWidget):
     def __init__(self, parent_app):
@@ -105,8 +106,15 @@ class InfoPanel(QWidget):
         if not user_id: return
         self.current_user_id = user_id
         token = self.parent_app.token
-        status, data = api_client.get_user_info(token, user_id)
-        if status == 200:
+        self.full_name_label.setText("Đang tải...")
+        self.parent_app.task_runner.submit(
+            profile_cache.get, token, user_id,
+            on_done=lambda data: self.show_user_info(user_id, data), key=("profile", user_id)
+        )
+
+    def show_user_info(self, user_id, data):
+        if self.current_user_id != user_id: return
+        if data:
             self.full_name_label.setText(data.get("full_name", "Không có tên"))
             self.username_label.setText(f"@{data.get('username')}")
             self.bio_label.setText(data.get("bio", "Chưa có giới thiệu."))
@@ -1,5 +1,4 @@
 import os
-import threading
 from PyQt5.QtWidgets import (
     QWidget, QVBoxLayout, QLabel, QLineEdit, QPushButton,
     QFrame, QGraphicsDropShadowEffect
@@ -7,6 +6,10 @@ from PyQt5.QtWidgets import (
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QColor, QPixmap, QIcon
 from services import api_client, crypto_client 
+from services.key_cache import PublicKeyCache
+from services.local_store import LocalStore
+from services.message_key_cache import MessageKeyCache, derive_storage_key
+from services.sender_keys import SenderKeyStore
 
 class LoginPage(QWidget):
     def __init__(self, parent):
@@ -204,37 +207,79 @@ class LoginPage(QWidget):
         self.show_message("Đang xác thực...", error=False)
         self.login_btn.setText("Đang tải...")
 
-        def login_thread():
-            token, user_id, status, data = api_client.login(username, password)
-            if status == 200:
-                try:
-                    private_key = crypto_client.load_private_key(username, password)
-                except Exception as e:
-                    self.show_message(f"Lỗi khóa bảo mật: {str(e)}", error=True)
-                    self.reset_ui()
-                    return
-
-                self.parent.token = token
-                self.parent.user_id = user_id
-                self.parent.private_key = private_key
-                
-                self.username_input.clear()
-                self.password_input.clear()
-                self.show_message("", error=False)
-
-                self.parent.home_page.connect_socket()
-                self.parent.home_page.refresh_chats()
-                self.parent.home_page.set_current_user_label()
-                self.parent.layout.setCurrentWidget(self.parent.home_page)
-            else:
-                error_msg = data.get("msg", "Đăng nhập thất bại")
-                self.show_message(f"Lỗi: {error_msg}", error=True)
-            
+        # Phần blocking (HTTP, PBKDF2 giải mã khóa, tải public key) chạy ở worker
+        self.parent.task_runner.submit(
+            login_task, username, password,
+            on_done=self.on_login_done, on_error=self.on_login_error, key="login"
+        )
+
+    def on_login_error(self, error):
+        # Lỗi ngoài dự kiến trong login_task (mở kho local, khởi động engine giải mã, mạng...)
+        self.show_message(f"Đăng nhập thất bại: {error}", error=True)
+        self.reset_ui()
+
+    def on_login_done(self, result):
+        if result.get("error"):
+            self.show_message(result["error"], error=True)
             self.reset_ui()
+            return
+
+        self.parent.token = result["token"]
+        self.parent.user_id = result["user_id"]
+        self.parent.private_key = result["private_key"]
+        self.parent.decryptor = result["decryptor"]
+        self.parent.local_store = result["local_store"]
+        self.parent.key_cache = result["key_cache"]
+        
+        self.username_input.clear()
+        self.password_input.clear()
+        self.show_message("", error=False)
 
-        threading.Thread(target=login_thread, daemon=True).start()
+        self.parent.home_page.connect_socket()
+        self.parent.home_page.refresh_chats()
+        self.parent.home_page.set_current_user_label()
+        self.parent.layout.setCurrentWidget(self.parent.home_page)
+        self.reset_ui()
 
     def reset_ui(self):
         self.login_btn.setEnabled(True)
         self.register_btn.setEnabled(True)
-        self.login_btn.setText("ĐĂNG NHẬP")
\ No newline at end of file
+        self.login_btn.setText("ĐĂNG NHẬP")
+
+
+def login_task(username, password):
+    """Chạy trong worker: không chạm vào widget, trả kết quả về cho on_login_done."""
+    token, user_id, status, data = api_client.login(username, password)
+    if status != 200:
+        error_msg = data.get("msg", "Đăng nhập thất bại")
+        return {"error": f"Lỗi: {error_msg}"}
+
+    try:
+        private_key = crypto_client.load_private_key(username, password)
+    except Exception as e:
+        return {"error": f"Lỗi khóa bảo mật: {str(e)}"}
+
+    key_cache = PublicKeyCache(f"keys/{username}_public_keys.json")
+    # Xác nhận lại các khóa đã cache (1 request, 304 nếu không đổi)
+    key_cache.refresh(token)
+
+    # Parse private key 1 lần, khởi động trước pool giải mã cho lần mở chat đầu tiên
+    # Khóa AES đã unwrap được lưu lại (mã hóa bằng khóa dẫn xuất từ private key)
+    message_keys = MessageKeyCache(
+        path=f"keys/{username}_message_keys.enc.json",
+        storage_key=derive_storage_key(private_key)
+    )
+    decryptor = crypto_client.DecryptionEngine(private_key, user_id, message_keys=message_keys)
+    decryptor.sender_keys = SenderKeyStore(token, user_id, decryptor.private_key)
+    decryptor.warm_up()
+
+    # Lịch sử đã giải mã lưu trên máy, mã hóa bằng khóa dẫn xuất từ mật khẩu
+    local_store = LocalStore(f"data/{username}_messages.db", password)
+    return {
+        "token": token,
+        "user_id": user_id,
+        "private_key": private_key,
+        "decryptor": decryptor,
+        "local_store": local_store,
+        "key_cache": key_cache
+    }
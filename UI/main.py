@@ -1,10 +1,12 @@
 import sys
 import os
+import logging
 from PyQt5.QtWidgets import QApplication, QWidget, QStackedLayout
 from PyQt5.QtGui import QIcon, QFont
 from .login import LoginPage
 from .home import HomePage
 from .register import RegisterPage
+from .task_runner import TaskRunner
 
 class ChatApp(QWidget):
     def __init__(self):
@@ -23,6 +25,11 @@ class ChatApp(QWidget):
         self.token = None
         self.user_id = None
         self.private_key = None
+        self.decryptor = None # crypto_client.DecryptionEngine, tạo khi đăng nhập
+        self.local_store = None # local_store.LocalStore, lịch sử đã giải mã trên máy
+        self.key_cache = None
+        # Pool chạy HTTP / crypto ngoài GUI thread
+        self.task_runner = TaskRunner()
         
         self.layout = QStackedLayout()
         self.setLayout(self.layout)
@@ -38,7 +45,20 @@ class ChatApp(QWidget):
 
         self.layout.setCurrentWidget(self.login_page)
 
+    def closeEvent(self, event):
+        # Lưu cache khóa tin nhắn, dừng pool giải mã, đóng local store khi đóng app mà chưa đăng xuất
+        if self.decryptor:
+            self.decryptor.shutdown()
+        if self.local_store:
+            self.local_store.close()
+        super().closeEvent(event)
+
 if __name__ == "__main__":
+    # SECURECHAT_LOG_LEVEL=DEBUG để xem thời gian từng request HTTP
+    logging.basicConfig(
+        level=os.getenv("SECURECHAT_LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
     app = QApplication(sys.argv)
     
     # --- CÀI ĐẶT FONT CHỮ TO VÀ RÕ RÀNG ---
@@ -0,0 +1,178 @@
+# UI/message_list.py
+# Danh sách tin nhắn dạng model/view: chỉ giữ 1 cửa sổ tin quanh vị trí đang xem,
+# delegate tự vẽ bubble và cache kích thước theo bề rộng viewport.
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QRect, QSize
+from PyQt5.QtGui import QColor, QFont, QFontMetrics, QPainter
+from PyQt5.QtWidgets import QStyledItemDelegate
+
+MessageRole = Qt.UserRole
+
+
+class MessageListModel(QAbstractListModel):
+    """
+    Các tin đang hiển thị, tăng dần theo id. Tối đa max_rows dòng:
+    - append (tin mới / trang mới hơn) vượt giới hạn -> bỏ bớt tin cũ nhất, has_older = True.
+    - prepend (trang cũ hơn) vượt giới hạn -> bỏ bớt tin mới nhất, has_newer = True.
+    Phần bị bỏ được tải lại (local store / server) khi người dùng cuộn tới.
+    """
+
+    def __init__(self, max_rows=1000, parent=None):
+        super().__init__(parent)
+        self.max_rows = max_rows
+        self._rows = []
+        self._ids = set()
+        self.has_older = True
+        self.has_newer = False
+
+    # -----------------------------
+    # Qt model API
+    # -----------------------------
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self._rows):
+            return None
+        row = self._rows[index.row()]
+        if role == Qt.DisplayRole:
+            return row["text"]
+        if role == MessageRole:
+            return row
+        return None
+
+    # -----------------------------
+    # Cập nhật
+    # -----------------------------
+    @staticmethod
+    def make_row(sender_id, text, is_me, message_id=None):
+        # "layout": (bề rộng, kích thước) do MessageDelegate tính và cache
+        return {"id": message_id, "sender_id": sender_id, "text": text, "is_me": is_me, "layout": None}
+
+    def clear(self):
+        self.beginResetModel()
+        self._rows = []
+        self._ids = set()
+        self.has_older = True
+        self.has_newer = False
+        self.endResetModel()
+
+    def is_full(self):
+        return len(self._rows) >= self.max_rows
+
+    def first_id(self):
+        return next((row["id"] for row in self._rows if row["id"] is not None), None)
+
+    def last_id(self):
+        return next((row["id"] for row in reversed(self._rows) if row["id"] is not None), None)
+
+    def _new_rows(self, rows):
+        fresh = [row for row in rows if row["id"] is None or row["id"] not in self._ids]
+        self._ids.update(row["id"] for row in fresh if row["id"] is not None)
+        return fresh
+
+    def append(self, rows):
+        rows = self._new_rows(rows)
+        if not rows: return
+        start = len(self._rows)
+        self.beginInsertRows(QModelIndex(), start, start + len(rows) - 1)
+        self._rows.extend(rows)
+        self.endInsertRows()
+
+        overflow = len(self._rows) - self.max_rows
+        if overflow > 0:
+            self._remove(0, overflow)
+            self.has_older = True
+
+    def prepend(self, rows):
+        rows = self._new_rows(rows)
+        if not rows: return
+        self.beginInsertRows(QModelIndex(), 0, len(rows) - 1)
+        self._rows[:0] = rows
+        self.endInsertRows()
+
+        overflow = len(self._rows) - self.max_rows
+        if overflow > 0:
+            self._remove(len(self._rows) - overflow, len(self._rows))
+            self.has_newer = True
+
+    def _remove(self, start, stop):
+        self.beginRemoveRows(QModelIndex(), start, stop - 1)
+        for row in self._rows[start:stop]:
+            self._ids.discard(row["id"])
+        del self._rows[start:stop]
+        self.endRemoveRows()
+
+
+class MessageDelegate(QStyledItemDelegate):
+    """
+    Vẽ bubble tin nhắn: của mình căn phải (nền xanh), người khác căn trái, "System" ở giữa.
+    Kích thước mỗi tin được tính 1 lần cho mỗi bề rộng viewport (cache trong dòng của model),
+    nên cuộn / vẽ lại không phải đo lại chữ.
+    """
+    H_MARGIN = 25   # Lề trái/phải của danh sách
+    V_MARGIN = 5    # Khoảng cách giữa các tin
+    SIDE_GAP = 50   # Bubble không chiếm hết bề rộng
+    PADDING = 12
+    RADIUS = 14
+
+    def __init__(self, view):
+        super().__init__(view)
+        self.view = view
+        self.text_font = QFont("Segoe UI")
+        self.text_font.setPixelSize(18)
+        self.me_font = QFont(self.text_font)
+        self.me_font.setBold(True)
+        self.system_font = QFont(self.text_font)
+        self.system_font.setPixelSize(14)
+
+    def _font(self, row):
+        if row["sender_id"] == "System": return self.system_font
+        return self.me_font if row["is_me"] else self.text_font
+
+    def _text_size(self, row):
+        width = self.view.viewport().width()
+        cached = row["layout"]
+        if cached is not None and cached[0] == width:
+            return cached[1]
+        max_text_width = max(width - 2 * self.H_MARGIN - self.SIDE_GAP - 2 * self.PADDING, 50)
+        rect = QFontMetrics(self._font(row)).boundingRect(
+            QRect(0, 0, max_text_width, 1_000_000), Qt.TextWordWrap, row["text"]
+        )
+        size = rect.size()
+        row["layout"] = (width, size)
+        return size
+
+    def sizeHint(self, option, index):
+        row = index.data(MessageRole)
+        text = self._text_size(row)
+        return QSize(self.view.viewport().width(), text.height() + 2 * self.PADDING + 2 * self.V_MARGIN)
+
+    def paint(self, painter, option, index):
+        row = index.data(MessageRole)
+        text = self._text_size(row)
+        bubble_width = text.width() + 2 * self.PADDING
+        bubble_height = text.height() + 2 * self.PADDING
+        top = option.rect.top() + self.V_MARGIN
+
+        if row["sender_id"] == "System":
+            left = option.rect.left() + (option.rect.width() - bubble_width) // 2
+        elif row["is_me"]:
+            left = option.rect.right() - self.H_MARGIN - bubble_width
+        else:
+            left = option.rect.left() + self.H_MARGIN
+        bubble = QRect(left, top, bubble_width, bubble_height)
+
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        if row["sender_id"] != "System":
+            painter.setPen(Qt.NoPen)
+            painter.setBrush(QColor("#E3F2FD") if row["is_me"] else QColor("#F0F4F8"))
+            painter.drawRoundedRect(bubble, self.RADIUS, self.RADIUS)
+
+        if row["sender_id"] == "System": painter.setPen(QColor("#90A4AE"))
+        elif row["is_me"]: painter.setPen(QColor("#1565C0"))
+        else: painter.setPen(QColor("#37474F"))
+        painter.setFont(self._font(row))
+        painter.drawText(bubble.adjusted(self.PADDING, self.PADDING, -self.PADDING, -self.PADDING),
+                         Qt.TextWordWrap, row["text"])
+        painter.restore()
@@ -4,6 +4,7 @@ from PyQt5.QtWidgets import (
 )
 from PyQt5.QtCore import Qt, QDate
 from services import api_client
+from services.profile_cache import profile_cache
 
 class ProfilePage(QDialog):
     def __init__(self, parent):
@@ -77,8 +78,13 @@ class ProfilePage(QDialog):
     def load_profile_data(self):
         token = self.parent_app.token
         user_id = self.parent_app.user_id
-        status, data = api_client.get_user_info(token, user_id)
-        if status == 200:
+        self.parent_app.task_runner.submit(
+            profile_cache.get, token, user_id,
+            on_done=self.show_profile_data, key=("profile", user_id)
+        )
+
+    def show_profile_data(self, data):
+        if data:
             self.username_label.setText(data.get("username", ""))
             self.full_name_input.setText(data.get("full_name", ""))
             self.bio_input.setPlainText(data.get("bio", ""))
@@ -97,14 +103,22 @@ class ProfilePage(QDialog):
         gender_map_rev = {"Nam": "male", "Nữ": "female", "Khác": "other"}
         gender = gender_map_rev.get(self.gender_input.currentText(), "other")
         
-        status, data = api_client.update_profile(
+        self.setEnabled(False)
+        self.parent_app.task_runner.submit(
+            api_client.update_profile,
             token,
             full_name=self.full_name_input.text().strip(),
             gender=gender,
             date_of_birth=self.dob_input.date().toString("yyyy-MM-dd"),
-            bio=self.bio_input.toPlainText().strip()
+            bio=self.bio_input.toPlainText().strip(),
+            on_done=self.on_profile_saved
         )
+
+    def on_profile_saved(self, result):
+        self.setEnabled(True)
+        status, data = result
         if status == 200:
+            profile_cache.invalidate(self.parent_app.user_id)
             QMessageBox.information(self, "Thành công", "Đã cập nhật hồ sơ.")
             self.accept()
         else:
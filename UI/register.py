@@ -1,5 +1,4 @@
 import os
-import threading
 from PyQt5.QtWidgets import (
     QWidget, QVBoxLayout, QLabel, QLineEdit, QPushButton,
     QHBoxLayout, QFrame, QGraphicsDropShadowEffect, QComboBox, QDateEdit
@@ -170,19 +169,21 @@ class RegisterPage(QWidget):
         self.register_btn.setEnabled(False)
         self.show_message("Đang tạo tài khoản...", error=False)
 
-        def register_thread():
-            try:
-                crypto_client.register_and_save_key(
-                    username, password, full_name=full_name, gender=gender, date_of_birth=dob
-                )
-                self.show_message("Đăng ký thành công!", error=False)
-                self.username_input.clear()
-                self.password_input.clear()
-                self.confirm_password_input.clear()
-                self.full_name_input.clear()
-            except Exception as e:
-                self.show_message(f"Lỗi đăng ký: {str(e)}", error=True)
-            finally:
-                self.register_btn.setEnabled(True)
-        
-        threading.Thread(target=register_thread, daemon=True).start()
\ No newline at end of file
+        # Sinh khóa RSA + gọi API ở worker, cập nhật giao diện trong callback
+        self.parent.task_runner.submit(
+            crypto_client.register_and_save_key,
+            username, password, full_name=full_name, gender=gender, date_of_birth=dob,
+            on_done=self.on_register_done, on_error=self.on_register_error, key="register"
+        )
+
+    def on_register_done(self, result):
+        self.show_message("Đăng ký thành công!", error=False)
+        self.username_input.clear()
+        self.password_input.clear()
+        self.confirm_password_input.clear()
+        self.full_name_input.clear()
+        self.register_btn.setEnabled(True)
+
+    def on_register_error(self, e):
+        self.show_message(f"Lỗi đăng ký: {str(e)}", error=True)
+        self.register_btn.setEnabled(True)
\ No newline at end of file
@@ -0,0 +1,109 @@
+# UI/task_runner.py
+# Chạy công việc blocking (HTTP, RSA, PBKDF2) ngoài GUI thread bằng QThreadPool.
+# Kết quả được đưa về GUI thread qua signal, nên callback được phép chạm vào widget.
+import traceback
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class _TaskSignals(QObject):
+    finished = pyqtSignal(object, object, object) # task, result, error
+    progress = pyqtSignal(object, object)         # task, value
+
+
+class _Task(QRunnable):
+    def __init__(self, fn, args, kwargs, signals, key, group, generations, with_progress):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = signals
+        self.key = key
+        self.group = group
+        self.generations = generations
+        self.generation = generations.get(group, 0)
+        self.callbacks = []
+        if with_progress:
+            self.kwargs["progress"] = self._report
+
+    def is_cancelled(self):
+        return self.generation != self.generations.get(self.group, 0)
+
+    def _report(self, value):
+        """Gửi tiến độ về GUI thread; trả về False nếu task đã bị huỷ (fn nên dừng sớm)."""
+        self.signals.progress.emit(self, value)
+        return not self.is_cancelled()
+
+    def run(self):
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            traceback.print_exc()
+            self.signals.finished.emit(self, None, e)
+            return
+        self.signals.finished.emit(self, result, None)
+
+
+class TaskRunner(QObject):
+    """
+    - submit(): chạy fn trong pool, gọi on_done(result) / on_error(exc) trên GUI thread.
+    - on_progress: fn nhận thêm tham số `progress`; mỗi lần fn gọi progress(value),
+      on_progress(value) được gọi trên GUI thread (vd. đổ dần lịch sử chat đã giải mã).
+    - key: các task cùng key đang chạy được gộp lại (chỉ chạy 1 lần, mọi callback đều nhận kết quả).
+    - group + cancel(group): bỏ kết quả của các task cũ trong nhóm (vd. khi người dùng đổi chat).
+    Phải được tạo trên GUI thread.
+    """
+
+    def __init__(self, max_threads=4):
+        super().__init__()
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max_threads)
+        self._signals = _TaskSignals()
+        self._signals.finished.connect(self._on_finished)
+        self._signals.progress.connect(self._on_progress)
+        self._inflight = {}    # key -> _Task
+        # QThreadPool không giữ tham chiếu Python tới task (setAutoDelete(False)): giữ mọi task
+        # đã submit tới khi _on_finished, kể cả task không có key, để không bị GC khi còn trong hàng đợi
+        self._running = set()
+        self._generations = {} # group -> số thế hệ hiện tại
+
+    def submit(self, fn, *args, on_done=None, on_error=None, on_progress=None, key=None, group=None, **kwargs):
+        if key is not None:
+            task = self._inflight.get(key)
+            if task is not None and not task.is_cancelled():
+                task.callbacks.append((on_done, on_error, on_progress))
+                return task
+
+        task = _Task(fn, args, kwargs, self._signals, key, group, self._generations, on_progress is not None)
+        task.setAutoDelete(False)
+        task.callbacks.append((on_done, on_error, on_progress))
+        if key is not None:
+            self._inflight[key] = task
+        self._running.add(task)
+        self.pool.start(task)
+        return task
+
+    def cancel(self, group):
+        """Mọi task đã submit trong group sẽ bị bỏ qua kết quả."""
+        self._generations[group] = self._generations.get(group, 0) + 1
+
+    def _on_progress(self, task, value):
+        if task.is_cancelled():
+            return
+        for _, _, on_progress in task.callbacks:
+            if on_progress: on_progress(value)
+
+    def _on_finished(self, task, result, error):
+        self._running.discard(task)
+        if task.key is not None and self._inflight.get(task.key) is task:
+            del self._inflight[task.key]
+        if task.is_cancelled():
+            return # Đã bị huỷ
+
+        for on_done, on_error, _ in task.callbacks:
+            if error is None:
+                if on_done: on_done(result)
+            elif on_error:
+                on_error(error)
+            else:
+                print(f"[Task] Lỗi: {error}")
@@ -1,9 +1,15 @@
 # app.py
-from flask import Flask
+# Async backend (threading | eventlet | gevent) theo SOCKET_ASYNC_MODE, dùng chung với socket server;
+# monkey patch phải chạy trước khi import Flask (idempotent nếu socket server đã patch).
+from services.async_backend import ASYNC_MODE, monkey_patch
+monkey_patch()
+
+from flask import Flask, request
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
 from flask_socketio import SocketIO
 from flask_cors import CORS
+import gzip
 import os
 
 from .config import Config
@@ -13,7 +19,7 @@ from .config import Config
 # ============================
 db = SQLAlchemy()
 jwt = JWTManager()
-socketio = SocketIO(cors_allowed_origins="*", async_mode="threading")
+socketio = SocketIO(cors_allowed_origins="*", async_mode=ASYNC_MODE)
 
 # ============================
 # Factory
@@ -21,11 +27,15 @@ socketio = SocketIO(cors_allowed_origins="*", async_mode="threading")
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
+    if app.config.get("MESSAGE_ENVELOPE_STORAGE"):
+        from services import wire_format
+        if not wire_format.AVAILABLE:
+            raise RuntimeError("MESSAGE_ENVELOPE_STORAGE requires msgpack (pip install msgpack)")
     CORS(app)
 
     db.init_app(app)
     jwt.init_app(app)
-    socketio.init_app(app)
+    socketio.init_app(app, message_queue=app.config.get("SOCKET_MESSAGE_QUEUE"))
 
     # Register blueprints
     from routes.accounts import auth_bp
@@ -33,12 +43,17 @@ def create_app():
     from routes.chats import chats_bp
     from routes.messages import messages_bp
     from routes.status import status_bp
+    from routes.sync import sync_bp
 
     app.register_blueprint(auth_bp, url_prefix="/auth")
     app.register_blueprint(users_bp, url_prefix="/users")
     app.register_blueprint(chats_bp, url_prefix="/chats")
     app.register_blueprint(messages_bp)
     app.register_blueprint(status_bp, url_prefix="/status")
+    app.register_blueprint(sync_bp, url_prefix="/sync")
+
+    if app.config.get("RESPONSE_GZIP"):
+        app.after_request(_gzip_response)
 
     # Create tables
     with app.app_context():
@@ -46,6 +61,30 @@ def create_app():
 
     return app
 
+# ============================
+# Gzip
+# ============================
+def _gzip_response(response):
+    from flask import current_app
+
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or "Content-Encoding" in response.headers
+            or response.mimetype != "application/json"
+            or "gzip" not in request.headers.get("Accept-Encoding", "").lower()):
+        return response
+
+    data = response.get_data()
+    if len(data) < current_app.config["RESPONSE_GZIP_MIN_SIZE"]:
+        return response
+
+    response.set_data(gzip.compress(data, compresslevel=5))
+    response.headers["Content-Encoding"] = "gzip"
+    response.headers["Content-Length"] = str(len(response.get_data()))
+    response.vary.add("Accept-Encoding")
+    return response
+
 # ============================
 # Run with SocketIO
 # ============================
@@ -8,3 +8,35 @@ class Config:
         "mysql+pymysql://root:@localhost/secure_chat"
     )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Ghi thêm 1 dòng MessageRecipient cho mỗi thành viên khi gửi tin (O(members)).
+    # Mặc định tắt: trạng thái đọc dùng watermark ChatMember.last_read_message_id.
+    MESSAGE_RECIPIENT_FANOUT = os.getenv("MESSAGE_RECIPIENT_FANOUT", "0") == "1"
+    # Socket server: broadcast ngay, ghi DB theo lô ở thread nền (log append-only để phục hồi).
+    # Khi bật, socket server là nơi duy nhất ghi tin nhắn (REST send bị từ chối).
+    SOCKET_WRITE_BEHIND = os.getenv("SOCKET_WRITE_BEHIND", "0") == "1"
+    WRITE_BEHIND_LOG = os.getenv("WRITE_BEHIND_LOG", "data/message_wal.log")
+    # Tin không thể ghi DB (lỗi dữ liệu, không phải mất kết nối) được chuyển vào đây thay vì chặn hàng đợi
+    WRITE_BEHIND_DEAD_LETTER = os.getenv("WRITE_BEHIND_DEAD_LETTER", "data/message_dead_letter.log")
+    # Async backend của socket server: threading | eventlet | gevent
+    SOCKET_ASYNC_MODE = os.getenv("SOCKET_ASYNC_MODE", "threading")
+    SOCKET_MAX_CONNECTIONS = int(os.getenv("SOCKET_MAX_CONNECTIONS", "20000"))
+    SOCKET_PORT = int(os.getenv("SOCKET_PORT", "5001"))
+    # REST server báo thay đổi (thành viên chat, profile) cho socket server qua endpoint nội bộ
+    # khi không có message queue Redis (xem services/socket_notify.py)
+    SOCKET_INTERNAL_URL = os.getenv("SOCKET_INTERNAL_URL", f"http://127.0.0.1:{SOCKET_PORT}")
+    # Chạy nhiều socket worker: message queue cho emit giữa các process
+    # (vd. redis://localhost:6379/0) và nơi lưu presence (mặc định dùng chung URL).
+    SOCKET_MESSAGE_QUEUE = os.getenv("SOCKET_MESSAGE_QUEUE") or None
+    SOCKET_PRESENCE_URL = os.getenv("SOCKET_PRESENCE_URL") or SOCKET_MESSAGE_QUEUE
+    # Id cố định của worker (bắt buộc với presence Redis): dùng để dọn sid còn sót sau crash
+    SOCKET_WORKER_ID = os.getenv("SOCKET_WORKER_ID") or None
+    # Số ngày giữ user_events (GET /sync); cursor cũ hơn bị từ chối (410). 0 = giữ mãi.
+    # Socket server xóa event hết hạn mỗi USER_EVENT_PRUNE_INTERVAL giây.
+    USER_EVENT_RETENTION_DAYS = int(os.getenv("USER_EVENT_RETENTION_DAYS", "30"))
+    USER_EVENT_PRUNE_INTERVAL = int(os.getenv("USER_EVENT_PRUNE_INTERVAL", "3600"))
+    # Lưu nội dung mã hóa của tin mới dạng envelope msgpack (LONGBLOB) thay vì base64/JSON text.
+    # Cần cài msgpack.
+    MESSAGE_ENVELOPE_STORAGE = os.getenv("MESSAGE_ENVELOPE_STORAGE", "0") == "1"
+    # Nén gzip response JSON lớn khi client gửi Accept-Encoding: gzip (danh sách chat, lịch sử tin).
+    RESPONSE_GZIP = os.getenv("RESPONSE_GZIP", "0") == "1"
+    RESPONSE_GZIP_MIN_SIZE = int(os.getenv("RESPONSE_GZIP_MIN_SIZE", "1024"))
@@ -32,6 +32,7 @@ CREATE TABLE `accounts` (
   `username` varchar(80) NOT NULL,
   `password_hash` varchar(200) NOT NULL,
   `public_key` text NOT NULL,
+  `key_fingerprint` char(64) DEFAULT NULL,
   `status` enum('online','offline') DEFAULT 'offline',
   `last_seen` datetime DEFAULT NULL,
   `created_at` datetime DEFAULT current_timestamp()
@@ -41,9 +42,9 @@ CREATE TABLE `accounts` (
 -- Dumping data for table `accounts`
 --
 
-INSERT INTO `accounts` (`id`, `username`, `password_hash`, `public_key`, `status`, `last_seen`, `created_at`) VALUES
-(14, 'admin', 'scrypt:32768:8:1$nqWqDlOerDcxkz9t$13f075ba7525633c067f725f3d65f08f0c4db0987ce05ff6d85cddae81ea2e66ceeb6a77fa22608ab66d701a89a0296613ba695361e5b1eb4ff3f274ef47a9a7', '-----BEGIN PUBLIC KEY-----\nMIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEAnk6C/jQKWClAN7PIs9m9\nKlYsPdOXRyvVRUidCjM2TzzZJdqFvHVj8cEwHolfxjq6DlcUKkAuQF/Q5wQoBByw\nHIjzoL4bvmo0friuy+4Ks9ReaMgd4Ex4OENDYZbHMjr6QqryK9651qV8rFZwJq/n\nTpuryP0DB9/TEkSGv2IVSMTgHIoqibAJsECMD4pdm8KsYAGrpCLHHrI7Sj5t+U+9\nnlwNiZcF/fjr9vRAWdg993lxjlP/pj0SaKuoPgxrbybUH+64TnoxJJFSp79UL1Fb\nCsS8dowybIdO1vPopjocBRwLOOwnbMA8cevuNAwBRYJlXRIrqRL/K48OFTPAqI2R\nQwIDAQAB\n-----END PUBLIC KEY-----', 'online', '2026-01-17 16:07:58', '2026-01-17 16:07:53'),
-(15, 'admin1', 'scrypt:32768:8:1$JZJrG2DGbXgK9SZG$be6f4d69606815b6cd6f52d185902d9b668b60893e761cce526b6db9008f24167a6c07a784f25bb45927a34b4e5976197898fccb1ed96e9761e4bdbfe610f606', '-----BEGIN PUBLIC KEY-----\nMIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEAr18kgd/ZHzvYzJ8Gsbrj\nxCnflu6rubzG8F+wpxiPVoH6C/B1KcuQRxk5exLuwX3GFDfgkufh5/6JWlxJv1in\ng+BxTSB38yTmksWVOd+34+QxcR04gJnLbHncwlBc9aaA+YH9sorvbTRhuIMUdSdH\nTGx/w+fiMFY1sMed+/81qa9yKt1uKVcxCLHhbIpNXojtQIEhc0M44l9o7eP1s7nX\n4r3wvJ9XVnKjX0AYoq1n8sdGP1ciIu1ezPWVlmQjwLY9kbJOHdlvQeH6mfpGgKvp\nw/PswV8oSB6ytj/v81dEo8HHyZTFJbYkRu4zLwPevcgSYrjswF1pmKR3c9mEV/UE\nvwIDAQAB\n-----END PUBLIC KEY-----', 'online', '2026-01-17 16:10:53', '2026-01-17 16:10:49');
+INSERT INTO `accounts` (`id`, `username`, `password_hash`, `public_key`, `key_fingerprint`, `status`, `last_seen`, `created_at`) VALUES
+(14, 'admin', 'scrypt:32768:8:1$nqWqDlOerDcxkz9t$13f075ba7525633c067f725f3d65f08f0c4db0987ce05ff6d85cddae81ea2e66ceeb6a77fa22608ab66d701a89a0296613ba695361e5b1eb4ff3f274ef47a9a7', '-----BEGIN PUBLIC KEY-----\nMIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEAnk6C/jQKWClAN7PIs9m9\nKlYsPdOXRyvVRUidCjM2TzzZJdqFvHVj8cEwHolfxjq6DlcUKkAuQF/Q5wQoBByw\nHIjzoL4bvmo0friuy+4Ks9ReaMgd4Ex4OENDYZbHMjr6QqryK9651qV8rFZwJq/n\nTpuryP0DB9/TEkSGv2IVSMTgHIoqibAJsECMD4pdm8KsYAGrpCLHHrI7Sj5t+U+9\nnlwNiZcF/fjr9vRAWdg993lxjlP/pj0SaKuoPgxrbybUH+64TnoxJJFSp79UL1Fb\nCsS8dowybIdO1vPopjocBRwLOOwnbMA8cevuNAwBRYJlXRIrqRL/K48OFTPAqI2R\nQwIDAQAB\n-----END PUBLIC KEY-----', '022a1b79430821255ce829865640da4d850d459b2548a305206bb35ee1486546', 'online', '2026-01-17 16:07:58', '2026-01-17 16:07:53'),
+(15, 'admin1', 'scrypt:32768:8:1$JZJrG2DGbXgK9SZG$be6f4d69606815b6cd6f52d185902d9b668b60893e761cce526b6db9008f24167a6c07a784f25bb45927a34b4e5976197898fccb1ed96e9761e4bdbfe610f606', '-----BEGIN PUBLIC KEY-----\nMIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEAr18kgd/ZHzvYzJ8Gsbrj\nxCnflu6rubzG8F+wpxiPVoH6C/B1KcuQRxk5exLuwX3GFDfgkufh5/6JWlxJv1in\ng+BxTSB38yTmksWVOd+34+QxcR04gJnLbHncwlBc9aaA+YH9sorvbTRhuIMUdSdH\nTGx/w+fiMFY1sMed+/81qa9yKt1uKVcxCLHhbIpNXojtQIEhc0M44l9o7eP1s7nX\n4r3wvJ9XVnKjX0AYoq1n8sdGP1ciIu1ezPWVlmQjwLY9kbJOHdlvQeH6mfpGgKvp\nw/PswV8oSB6ytj/v81dEo8HHyZTFJbYkRu4zLwPevcgSYrjswF1pmKR3c9mEV/UE\nvwIDAQAB\n-----END PUBLIC KEY-----', '96ab434260fb17252c1845e605b4ec8990144daf20a129242ad84ecbd8e28070', 'online', '2026-01-17 16:10:53', '2026-01-17 16:10:49');
 
 -- --------------------------------------------------------
 
@@ -75,16 +76,17 @@ CREATE TABLE `chat_members` (
   `id` int(11) NOT NULL,
   `chat_id` int(11) NOT NULL,
   `account_id` int(11) NOT NULL,
-  `joined_at` datetime DEFAULT current_timestamp()
+  `joined_at` datetime DEFAULT current_timestamp(),
+  `last_read_message_id` int(11) NOT NULL DEFAULT 0
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 --
 -- Dumping data for table `chat_members`
 --
 
-INSERT INTO `chat_members` (`id`, `chat_id`, `account_id`, `joined_at`) VALUES
-(17, 9, 15, '2026-01-17 16:10:54'),
-(18, 9, 14, '2026-01-17 16:10:54');
+INSERT INTO `chat_members` (`id`, `chat_id`, `account_id`, `joined_at`, `last_read_message_id`) VALUES
+(17, 9, 15, '2026-01-17 16:10:54', 61),
+(18, 9, 14, '2026-01-17 16:10:54', 63);
 
 -- --------------------------------------------------------
 
@@ -100,6 +102,7 @@ CREATE TABLE `messages` (
   `aes_key_encrypted` text NOT NULL,
   `iv` text NOT NULL,
   `tag` text NOT NULL,
+  `envelope` longblob DEFAULT NULL,
   `timestamp` datetime DEFAULT current_timestamp()
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
@@ -142,6 +145,35 @@ INSERT INTO `message_recipients` (`id`, `message_id`, `receiver_id`, `read_at`)
 
 -- --------------------------------------------------------
 
+--
+-- Table structure for table `sender_keys`
+--
+
+CREATE TABLE `sender_keys` (
+  `id` int(11) NOT NULL,
+  `chat_id` int(11) NOT NULL,
+  `owner_id` int(11) NOT NULL,
+  `wrapped_keys` text NOT NULL,
+  `created_at` datetime DEFAULT current_timestamp()
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `user_events`
+--
+
+CREATE TABLE `user_events` (
+  `id` int(11) NOT NULL,
+  `account_id` int(11) NOT NULL,
+  `chat_id` int(11) NOT NULL,
+  `kind` varchar(32) NOT NULL,
+  `data` text DEFAULT NULL,
+  `created_at` datetime DEFAULT current_timestamp()
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- --------------------------------------------------------
+
 --
 -- Table structure for table `users`
 --
@@ -195,6 +227,7 @@ ALTER TABLE `chat_members`
 ALTER TABLE `messages`
   ADD PRIMARY KEY (`id`),
   ADD KEY `chat_id` (`chat_id`),
+  ADD KEY `ix_messages_chat_id_id` (`chat_id`,`id`),
   ADD KEY `sender_id` (`sender_id`);
 
 --
@@ -205,6 +238,22 @@ ALTER TABLE `message_recipients`
   ADD UNIQUE KEY `message_id` (`message_id`,`receiver_id`),
   ADD KEY `receiver_id` (`receiver_id`);
 
+--
+-- Indexes for table `sender_keys`
+--
+ALTER TABLE `sender_keys`
+  ADD PRIMARY KEY (`id`),
+  ADD KEY `ix_sender_keys_chat_id_owner_id` (`chat_id`,`owner_id`),
+  ADD KEY `owner_id` (`owner_id`);
+
+--
+-- Indexes for table `user_events`
+--
+ALTER TABLE `user_events`
+  ADD PRIMARY KEY (`id`),
+  ADD KEY `ix_user_events_account_id_id` (`account_id`,`id`),
+  ADD KEY `chat_id` (`chat_id`);
+
 --
 -- Indexes for table `users`
 --
@@ -246,6 +295,18 @@ ALTER TABLE `messages`
 ALTER TABLE `message_recipients`
   MODIFY `id` int(11) NOT NULL AUTO_INCREMENT, AUTO_INCREMENT=9;
 
+--
+-- AUTO_INCREMENT for table `sender_keys`
+--
+ALTER TABLE `sender_keys`
+  MODIFY `id` int(11) NOT NULL AUTO_INCREMENT;
+
+--
+-- AUTO_INCREMENT for table `user_events`
+--
+ALTER TABLE `user_events`
+  MODIFY `id` int(11) NOT NULL AUTO_INCREMENT;
+
 --
 -- AUTO_INCREMENT for table `users`
 --
@@ -277,6 +338,20 @@ ALTER TABLE `message_recipients`
   ADD CONSTRAINT `message_recipients_ibfk_1` FOREIGN KEY (`message_id`) REFERENCES `messages` (`id`) ON DELETE CASCADE,
   ADD CONSTRAINT `message_recipients_ibfk_2` FOREIGN KEY (`receiver_id`) REFERENCES `accounts` (`id`) ON DELETE CASCADE;
 
+--
+-- Constraints for table `sender_keys`
+--
+ALTER TABLE `sender_keys`
+  ADD CONSTRAINT `sender_keys_ibfk_1` FOREIGN KEY (`chat_id`) REFERENCES `chats` (`id`) ON DELETE CASCADE,
+  ADD CONSTRAINT `sender_keys_ibfk_2` FOREIGN KEY (`owner_id`) REFERENCES `accounts` (`id`) ON DELETE CASCADE;
+
+--
+-- Constraints for table `user_events`
+--
+ALTER TABLE `user_events`
+  ADD CONSTRAINT `user_events_ibfk_1` FOREIGN KEY (`account_id`) REFERENCES `accounts` (`id`) ON DELETE CASCADE,
+  ADD CONSTRAINT `user_events_ibfk_2` FOREIGN KEY (`chat_id`) REFERENCES `chats` (`id`) ON DELETE CASCADE;
+
 --
 -- Constraints for table `users`
 --
@@ -0,0 +1,10 @@
+-- Nâng cấp CSDL cũ: cột accounts.key_fingerprint (SHA-256 hex của public key PEM)
+-- GET /chats và GET /users/keys đọc cột này thay vì hash PEM của mọi thành viên mỗi lần gọi.
+-- Chạy lại được: nếu cột đã có, ALTER báo lỗi "Duplicate column" (--force để chạy tiếp),
+-- UPDATE chỉ điền các dòng còn NULL. Dòng còn NULL cũng được server tự điền khi đọc lần đầu.
+--
+--   mysql --force -u root secure_chat < database/upgrade_key_fingerprint.sql
+
+ALTER TABLE `accounts` ADD `key_fingerprint` char(64) DEFAULT NULL AFTER `public_key`;
+
+UPDATE `accounts` SET `key_fingerprint` = SHA2(`public_key`, 256) WHERE `key_fingerprint` IS NULL;
@@ -0,0 +1,18 @@
+-- Nâng cấp CSDL cũ: watermark đã đọc chat_members.last_read_message_id
+-- Khởi tạo từ MessageRecipient.read_at hiện có, để tin đã đọc không bị tính là chưa đọc.
+-- Chạy lại được: nếu cột đã có, ALTER báo lỗi "Duplicate column" (--force để chạy tiếp),
+-- UPDATE chỉ dời watermark tiến lên (GREATEST).
+--
+--   mysql --force -u root secure_chat < database/upgrade_read_watermark.sql
+
+ALTER TABLE `chat_members` ADD `last_read_message_id` int(11) NOT NULL DEFAULT 0;
+
+UPDATE `chat_members` cm
+JOIN (
+    SELECT m.chat_id, mr.receiver_id, MAX(mr.message_id) AS last_read
+    FROM `message_recipients` mr
+    JOIN `messages` m ON m.id = mr.message_id
+    WHERE mr.read_at IS NOT NULL
+    GROUP BY m.chat_id, mr.receiver_id
+) r ON r.chat_id = cm.chat_id AND r.receiver_id = cm.account_id
+SET cm.last_read_message_id = GREATEST(cm.last_read_message_id, r.last_read);
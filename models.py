@@ -1,6 +1,33 @@
 # models.py
 from app import db
+from sqlalchemy.dialects.mysql import LONGBLOB
 from datetime import datetime
+import hashlib
+
+
+def public_key_fingerprint(public_key_pem):
+    """SHA-256 (hex) của public key PEM, client dùng để biết khóa đã đổi hay chưa."""
+    return hashlib.sha256(public_key_pem.encode("utf-8")).hexdigest()
+
+def key_fingerprints(account_ids):
+    """
+    {account_id: fingerprint} đọc từ cột accounts.key_fingerprint (không đọc / hash PEM).
+    Dòng cũ chưa có giá trị (CSDL chưa nâng cấp) được tính từ public_key và lưu lại.
+    """
+    fingerprints, missing = {}, []
+    for account_id, fingerprint in db.session.query(Account.id, Account.key_fingerprint).filter(
+        Account.id.in_(account_ids)
+    ):
+        if fingerprint:
+            fingerprints[account_id] = fingerprint
+        else:
+            missing.append(account_id)
+    if missing:
+        for account in Account.query.filter(Account.id.in_(missing)):
+            account.key_fingerprint = public_key_fingerprint(account.public_key)
+            fingerprints[account.id] = account.key_fingerprint
+        db.session.commit()
+    return fingerprints
 
 # ======================================================
 # Account model (tương đương User)
@@ -12,6 +39,11 @@ class Account(db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False)
     password_hash = db.Column(db.String(200), nullable=False)
     public_key = db.Column(db.Text, nullable=False)
+    # SHA-256 của public_key, tính 1 lần khi tạo account (khóa không đổi sau đó) thay vì ở mỗi request
+    key_fingerprint = db.Column(
+        db.String(64),
+        default=lambda ctx: public_key_fingerprint(ctx.get_current_parameters()["public_key"])
+    )
     status = db.Column(db.Enum('online', 'offline'), default='offline')
     last_seen = db.Column(db.DateTime, default=None)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -65,6 +97,8 @@ class ChatMember(db.Model):
     chat_id = db.Column(db.Integer, db.ForeignKey("chats.id", ondelete="CASCADE"), nullable=False)
     account_id = db.Column(db.Integer, db.ForeignKey("accounts.id", ondelete="CASCADE"), nullable=False)
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Watermark đã đọc: mọi tin có id <= giá trị này coi như đã đọc
+    last_read_message_id = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     chat = db.relationship("Chat", back_populates="members")
     account = db.relationship("Account", back_populates="chat_memberships")
@@ -85,12 +119,18 @@ class Message(db.Model):
     aes_key_encrypted = db.Column(db.Text, nullable=False)
     iv = db.Column(db.Text, default=None)
     tag = db.Column(db.Text, default=None)
+    # Envelope msgpack (content/iv/tag/khóa ở dạng bytes) khi bật MESSAGE_ENVELOPE_STORAGE;
+    # khi đó các cột text ở trên để rỗng, đọc qua services.wire_format.message_fields()
+    envelope = db.Column(db.LargeBinary().with_variant(LONGBLOB, "mysql"), nullable=True, default=None)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
     chat = db.relationship("Chat", back_populates="messages")
     sender = db.relationship("Account", back_populates="sent_messages")
     recipients = db.relationship("MessageRecipient", back_populates="message", cascade="all, delete-orphan")
 
+    # Index phục vụ phân trang keyset theo (chat_id, id)
+    __table_args__ = (db.Index("ix_messages_chat_id_id", "chat_id", "id"),)
+
 
 # ======================================================
 # MessageRecipient model
@@ -108,4 +148,43 @@ class MessageRecipient(db.Model):
     message = db.relationship("Message", back_populates="recipients")
     receiver = db.relationship("Account", back_populates="received_messages")
 
-    __table_args__ = (db.UniqueConstraint("message_id", "receiver_id", name="message_id_receiver_id_unique"),)
\ No newline at end of file
+    __table_args__ = (db.UniqueConstraint("message_id", "receiver_id", name="message_id_receiver_id_unique"),)
+
+
+# ======================================================
+# SenderKey model (chế độ sender key)
+# ======================================================
+class SenderKey(db.Model):
+    """
+    Chain key của 1 người gửi trong 1 chat, RSA-wrap 1 lần cho từng thành viên.
+    Tin nhắn dùng sender key chỉ lưu {"sk": id, "n": chỉ số} trong aes_key_encrypted.
+    """
+    __tablename__ = "sender_keys"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    chat_id = db.Column(db.Integer, db.ForeignKey("chats.id", ondelete="CASCADE"), nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey("accounts.id", ondelete="CASCADE"), nullable=False)
+    wrapped_keys = db.Column(db.Text, nullable=False) # JSON {member_id: chain key RSA-wrapped}
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index("ix_sender_keys_chat_id_owner_id", "chat_id", "owner_id"),)
+
+
+# ======================================================
+# UserEvent model (đồng bộ delta: GET /sync)
+# ======================================================
+class UserEvent(db.Model):
+    """
+    Thay đổi không phải tin nhắn của 1 user (vào chat, dời watermark đã đọc...).
+    id tăng dần: GET /sync trả các event có id > phần event trong cursor.
+    """
+    __tablename__ = "user_events"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    account_id = db.Column(db.Integer, db.ForeignKey("accounts.id", ondelete="CASCADE"), nullable=False)
+    chat_id = db.Column(db.Integer, db.ForeignKey("chats.id", ondelete="CASCADE"), nullable=False)
+    kind = db.Column(db.String(32), nullable=False) # chat_joined | read
+    data = db.Column(db.Text, default=None)         # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index("ix_user_events_account_id_id", "account_id", "id"),)
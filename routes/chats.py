@@ -1,51 +1,99 @@
 # routes/chats_bp.py
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app import db
-from models import Chat, ChatMember, Account, UserProfile, MessageRecipient, Message
+from app import db, socketio
+from models import Chat, ChatMember, Account, Message, UserProfile, SenderKey, key_fingerprints
+from services import socket_notify
+from services.message_service import advance_read_watermark, parse_message_id, record_user_events, unread_counts
 from sqlalchemy import and_, func
-from datetime import datetime
+import json
+import uuid
 
 chats_bp = Blueprint("chats", __name__)
 
-def _serialize_chat_for_user(chat, user_id):
+MAX_SENDER_KEY_IDS = 500
+
+def _serialize_chats_for_user(chats, user_id, include_key_fingerprints=False):
+    """
+    Helper: Serialize nhiều chat cùng lúc cho người dùng (user_id) đang xem.
+    Số query cố định (members, tên người còn lại, unread) bất kể số chat.
+    include_key_fingerprints: thêm fingerprint public key của từng thành viên
+    (client dùng để kiểm tra cache khóa trước khi gửi tin).
+    """
+    if not chats:
+        return []
+    chat_ids = [c.id for c in chats]
+
+    # 1. Tất cả thành viên của các chat
+    members_by_chat = {cid: [] for cid in chat_ids}
+    member_rows = db.session.query(ChatMember.chat_id, ChatMember.account_id).filter(
+        ChatMember.chat_id.in_(chat_ids)
+    ).order_by(ChatMember.id.asc()).all()
+    for chat_id, account_id in member_rows:
+        members_by_chat[chat_id].append(account_id)
+
+    # 2. Tên hiển thị của người còn lại trong các chat 1-1
+    other_ids = {
+        c.id: next((mid for mid in members_by_chat[c.id] if mid != user_id), None)
+        for c in chats if not c.is_group
+    }
+    peer_ids = {mid for mid in other_ids.values() if mid is not None}
+    peer_names = {}
+    if peer_ids:
+        peer_rows = db.session.query(Account.id, Account.username, UserProfile.full_name).outerjoin(
+            UserProfile, UserProfile.account_id == Account.id
+        ).filter(Account.id.in_(peer_ids)).all()
+        for account_id, username, full_name in peer_rows:
+            peer_names[account_id] = full_name or username
+
+    # 3. Đếm tin chưa đọc theo watermark của user (chỉ đếm tin của người khác)
+    unread = unread_counts(user_id, chat_ids)
+
+    # 4. Id tin mới nhất của mỗi chat (client sắp danh sách theo hoạt động gần nhất)
+    last_message_ids = dict(db.session.query(Message.chat_id, func.max(Message.id)).filter(
+        Message.chat_id.in_(chat_ids)
+    ).group_by(Message.chat_id).all())
+
+    # 5. (Tuỳ chọn) fingerprint public key của thành viên (cột lưu sẵn, không hash PEM mỗi lần)
+    fingerprints = {}
+    if include_key_fingerprints:
+        all_member_ids = {mid for mids in members_by_chat.values() for mid in mids}
+        if all_member_ids:
+            fingerprints = key_fingerprints(all_member_ids)
+
+    result = []
+    for chat in chats:
+        chat_name = chat.name
+        if not chat.is_group:
+            other_member_id = other_ids[chat.id]
+            if other_member_id:
+                chat_name = peer_names.get(other_member_id, chat_name)
+            else:
+                chat_name = "My Notes"
+
+        chat_data = {
+            "chat_id": chat.id,
+            "name": chat_name,
+            "is_group": chat.is_group,
+            "members": members_by_chat[chat.id],
+            "created_at": chat.created_at.isoformat(),
+            "unread_count": unread.get(chat.id, 0),
+            "last_message_id": last_message_ids.get(chat.id)
+        }
+        if include_key_fingerprints:
+            chat_data["member_key_fingerprints"] = {
+                str(mid): fingerprints[mid] for mid in members_by_chat[chat.id] if mid in fingerprints
+            }
+        result.append(chat_data)
+    return result
+
+
+def _serialize_chat_for_user(chat, user_id, include_key_fingerprints=False):
     """
     Helper: Trả về tên chat và thông tin đã được tùy chỉnh
     cho người dùng (user_id) đang xem.
     """
-    members_ids = [m.account_id for m in chat.members]
-    chat_name = chat.name
-    
-    if not chat.is_group:
-        # Tìm người còn lại trong chat 1-1
-        other_member_id = next((mid for mid in members_ids if mid != user_id), None)
-        
-        if other_member_id:
-            other_user = Account.query.get(other_member_id)
-            if other_user and other_user.profile:
-                # SỬA: Sử dụng full_name làm tên chat
-                chat_name = other_user.profile.full_name or other_user.username
-            elif other_user:
-                chat_name = other_user.username
-        else:
-            chat_name = "My Notes"
-
-    # SỬA: Logic đếm tin chưa đọc
-    unread_count = db.session.query(func.count(MessageRecipient.id)).join(Message).filter(
-        Message.chat_id == chat.id,
-        MessageRecipient.receiver_id == user_id,
-        MessageRecipient.read_at == None,
-        Message.sender_id != user_id # Chỉ đếm tin của người khác
-    ).scalar()
-
-    return {
-        "chat_id": chat.id,
-        "name": chat_name,
-        "is_group": chat.is_group,
-        "members": members_ids,
-        "created_at": chat.created_at.isoformat(),
-        "unread_count": unread_count # Trả về count
-    }
+    return _serialize_chats_for_user([chat], user_id, include_key_fingerprints)[0]
 
 
 @chats_bp.route("", methods=["POST"])
@@ -97,12 +145,20 @@ def create_chat():
 
     # Thêm người tạo
     db.session.add(ChatMember(chat_id=chat.id, account_id=creator_id))
+    added_ids = [creator_id]
     # Thêm các thành viên khác
     for m_id in members_ids:
         if m_id != creator_id and Account.query.get(m_id):
             db.session.add(ChatMember(chat_id=chat.id, account_id=m_id))
+            added_ids.append(m_id)
+    record_user_events(added_ids, chat.id, "chat_joined", {"is_group": is_group})
     
     db.session.commit()
+    # Cache thành viên nằm ở socket server (process khác)
+    if socket_notify.uses_pubsub():
+        for uid in added_ids:
+            socketio.emit("chat_members_changed", {"chat_id": chat.id}, to=f"user_{uid}")
+    socket_notify.notify("chat_members_changed", {"chat_id": chat.id, "member_ids": added_ids, "nonce": uuid.uuid4().hex})
 
     # Trả về chat mới (HTTP 201)
     return jsonify(_serialize_chat_for_user(chat, creator_id)), 201
@@ -112,15 +168,12 @@ def create_chat():
 @jwt_required()
 def get_chats():
     user_id = int(get_jwt_identity())
-    memberships = ChatMember.query.filter_by(account_id=user_id).all()
-    
-    chats_data = []
-    for m in memberships:
-        chat = m.chat
-        # SỬA: Sử dụng helper để lấy tên chính xác và unread_count
-        chats_data.append(_serialize_chat_for_user(chat, user_id))
-        
-    return jsonify(chats_data)
+    chats = db.session.query(Chat).join(ChatMember, ChatMember.chat_id == Chat.id).filter(
+        ChatMember.account_id == user_id
+    ).order_by(ChatMember.id.asc()).all()
+
+    # Serialize toàn bộ danh sách với số query cố định
+    return jsonify(_serialize_chats_for_user(chats, user_id))
 
 
 @chats_bp.route("/<int:chat_id>", methods=["GET"])
@@ -135,29 +188,105 @@ def get_chat_detail(chat_id):
     if not membership:
         return jsonify({"msg": "You are not a member of this chat"}), 403
 
-    # SỬA: Sử dụng helper để trả về dữ liệu
-    return jsonify(_serialize_chat_for_user(chat, user_id)), 200
+    # SỬA: Sử dụng helper để trả về dữ liệu (kèm fingerprint khóa của thành viên)
+    return jsonify(_serialize_chat_for_user(chat, user_id, include_key_fingerprints=True)), 200
 
 
 # <--- SỬA ĐỔI: THÊM ROUTE MỚI NÀY --->
 @chats_bp.route("/<int:chat_id>/mark_read", methods=["POST"])
 @jwt_required()
 def mark_chat_as_read(chat_id):
+    """
+    Đánh dấu đã đọc bằng cách dời watermark của thành viên (O(1) câu lệnh).
+    Body (tuỳ chọn): {"up_to_message_id": X} -> chỉ đánh dấu các tin có id <= X.
+    """
     user_id = int(get_jwt_identity())
+    data = request.get_json(silent=True) or {}
+    up_to_message_id = data.get("up_to_message_id")
+    if up_to_message_id is not None:
+        try:
+            up_to_message_id = parse_message_id(up_to_message_id)
+        except ValueError:
+            return jsonify({"msg": "Invalid up_to_message_id"}), 400
+    up_to_message_id = advance_read_watermark(chat_id, user_id, up_to_message_id)
+    # Bộ đếm chưa đọc / badge trên các thiết bị đang kết nối nằm ở socket server
+    socket_notify.notify("chat_read", {
+        "chat_id": chat_id, "user_id": user_id, "nonce": uuid.uuid4().hex,
+        "unread": unread_counts(user_id, [chat_id]).get(chat_id, 0),
+        "last_read_message_id": up_to_message_id
+    })
+    return jsonify({"msg": "Marked as read", "last_read_message_id": up_to_message_id}), 200
 
-    # Tìm tất cả MessageRecipient chưa đọc của user này trong chat này
-    unread_messages = db.session.query(MessageRecipient).join(Message).filter(
-        Message.chat_id == chat_id,
-        MessageRecipient.receiver_id == user_id,
-        MessageRecipient.read_at == None
-    ).all()
 
-    count = 0
-    for msg_recipient in unread_messages:
-        # Chỉ đánh dấu đã đọc tin nhắn của người khác
-        if msg_recipient.message.sender_id != user_id:
-            msg_recipient.read_at = datetime.utcnow()
-            count += 1
+# ======================================================
+# Sender keys
+# ======================================================
+@chats_bp.route("/<int:chat_id>/sender_keys", methods=["POST"])
+@jwt_required()
+def create_sender_key(chat_id):
+    """
+    Đăng ký chain key mới của người gọi cho chat này.
+    Body: {"wrapped_keys": {member_id: chain key RSA-wrapped bằng public key của member}}
+    Trả về {"key_id": id}; các tin sau đó gửi {"sk": key_id, "n": chỉ số} thay cho khóa theo từng thành viên.
+    """
+    user_id = int(get_jwt_identity())
+    chat_members = {uid for (uid,) in db.session.query(ChatMember.account_id).filter(ChatMember.chat_id == chat_id)}
+    if user_id not in chat_members:
+        return jsonify({"msg": "You are not a member of this chat"}), 403
 
+    data = request.get_json(silent=True) or {}
+    wrapped_keys = data.get("wrapped_keys")
+    if not isinstance(wrapped_keys, dict) or not wrapped_keys:
+        return jsonify({"msg": "wrapped_keys is required"}), 400
+    try:
+        wrapped_keys = {int(mid): key for mid, key in wrapped_keys.items()}
+    except ValueError:
+        return jsonify({"msg": "wrapped_keys must be keyed by member id"}), 400
+    if not set(wrapped_keys) <= chat_members:
+        return jsonify({"msg": "wrapped_keys contains non-members"}), 400
+    # Thiếu bản wrap cho ai thì người đó không đọc được mọi tin dùng key này
+    missing = sorted(chat_members - set(wrapped_keys))
+    if missing or not all(isinstance(key, str) and key for key in wrapped_keys.values()):
+        return jsonify({"msg": "wrapped_keys must cover every chat member", "missing": missing}), 409
+
+    sender_key = SenderKey(
+        chat_id=chat_id,
+        owner_id=user_id,
+        wrapped_keys=json.dumps({str(mid): key for mid, key in wrapped_keys.items()})
+    )
+    db.session.add(sender_key)
     db.session.commit()
-    return jsonify({"msg": f"Marked {count} messages as read"}), 200
\ No newline at end of file
+    return jsonify({"key_id": sender_key.id}), 201
+
+@chats_bp.route("/sender_keys", methods=["GET"])
+@jwt_required()
+def get_sender_keys():
+    """
+    Lấy nhiều sender key trong 1 query: GET /chats/sender_keys?ids=1,2,3
+    Trả về {key_id: {chat_id, owner_id, wrapped_key}} với wrapped_key là bản wrap cho người gọi;
+    key của chat người gọi không tham gia, hoặc không có bản wrap cho người gọi, bị bỏ qua.
+    """
+    user_id = int(get_jwt_identity())
+    try:
+        ids = {int(x) for x in request.args.get("ids", "").split(",") if x.strip()}
+    except ValueError:
+        return jsonify({"msg": "ids must be a comma-separated list of integers"}), 400
+    if not ids:
+        return jsonify({"msg": "ids is required"}), 400
+    if len(ids) > MAX_SENDER_KEY_IDS:
+        return jsonify({"msg": f"At most {MAX_SENDER_KEY_IDS} ids per request"}), 400
+
+    rows = db.session.query(SenderKey).join(
+        ChatMember, and_(ChatMember.chat_id == SenderKey.chat_id, ChatMember.account_id == user_id)
+    ).filter(SenderKey.id.in_(ids)).all()
+
+    result = {}
+    for sender_key in rows:
+        wrapped = json.loads(sender_key.wrapped_keys).get(str(user_id))
+        if wrapped:
+            result[str(sender_key.id)] = {
+                "chat_id": sender_key.chat_id,
+                "owner_id": sender_key.owner_id,
+                "wrapped_key": wrapped
+            }
+    return jsonify(result)
@@ -1,10 +1,15 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app import db
 from models import Message, MessageRecipient, ChatMember
+from services.message_service import create_message
+from services import socket_notify, wire_format
 
 messages_bp = Blueprint("messages", __name__)
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
 @messages_bp.route("/chats/<int:chat_id>/messages", methods=["POST"])
 @jwt_required()
 def send_message(chat_id):
@@ -14,43 +19,87 @@ def send_message(chat_id):
         if f not in data:
             return jsonify({"msg": f"Missing {f}"}), 400
 
+    # Chế độ write-behind: id do socket server cấp, không ghi song song từ REST
+    if current_app.config.get("SOCKET_WRITE_BEHIND"):
+        return jsonify({"msg": "Write-behind mode: send messages through the socket server"}), 503
+
+    try:
+        content, aes_key_encrypted, iv, tag = wire_format.normalize_payload(
+            data["content"], data["aes_key_encrypted"], data["iv"], data["tag"]
+        )
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
     sender_id = int(get_jwt_identity())
     chat_members = ChatMember.query.filter_by(chat_id=chat_id).all()
     if sender_id not in [m.account_id for m in chat_members]:
         return jsonify({"msg": "Not in chat"}), 403
 
-    message = Message(
-        chat_id=chat_id,
-        sender_id=sender_id,
-        content=data["content"],
-        aes_key_encrypted=data["aes_key_encrypted"],
-        iv=data["iv"],
-        tag=data["tag"]
+    message = create_message(
+        chat_id,
+        sender_id,
+        content,
+        aes_key_encrypted,
+        iv,
+        tag,
+        member_ids=[m.account_id for m in chat_members]
     )
-    db.session.add(message)
-    db.session.commit()
-
-    # tạo recipients cho tất cả thành viên
-    for m in chat_members:
-        db.session.add(MessageRecipient(message_id=message.id, receiver_id=m.account_id))
-    db.session.commit()
+    # Bộ đếm chưa đọc nằm ở socket server
+    socket_notify.notify("message_created", {
+        "chat_id": chat_id, "sender_id": sender_id, "message_id": message.id,
+        "member_ids": [m.account_id for m in chat_members]
+    })
 
     return jsonify({"msg": "Sent", "message_id": message.id}), 201
 
 @messages_bp.route("/chats/<int:chat_id>/messages", methods=["GET"])
 @jwt_required()
 def get_messages(chat_id):
-    messages = Message.query.filter_by(chat_id=chat_id).order_by(Message.timestamp.asc()).all()
+    """
+    Lấy lịch sử tin nhắn theo trang (keyset pagination trên (chat_id, id)).
+    - before_id: lấy các tin cũ hơn id này (cuộn lên)
+    - after_id: lấy các tin mới hơn id này (đồng bộ phần còn thiếu)
+    - không truyền: lấy trang mới nhất
+    Kết quả luôn sắp xếp tăng dần theo id.
+    """
+    before_id = request.args.get("before_id", type=int)
+    after_id = request.args.get("after_id", type=int)
+    limit = request.args.get("limit", DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    query = Message.query.filter(Message.chat_id == chat_id)
+    if after_id is not None:
+        query = query.filter(Message.id > after_id)
+        if before_id is not None:
+            query = query.filter(Message.id < before_id)
+        messages = query.order_by(Message.id.asc()).limit(limit).all()
+    else:
+        if before_id is not None:
+            query = query.filter(Message.id < before_id)
+        messages = query.order_by(Message.id.desc()).limit(limit).all()
+        messages.reverse()
+
+    # Lấy recipients cho cả trang bằng 1 query thay vì lazy load từng tin
+    recipients = {m.id: [] for m in messages}
+    if recipients:
+        rows = db.session.query(MessageRecipient.message_id, MessageRecipient.receiver_id).filter(
+            MessageRecipient.message_id.in_(list(recipients.keys()))
+        ).all()
+        for message_id, receiver_id in rows:
+            recipients[message_id].append(receiver_id)
+
     result = []
     for m in messages:
+        content, aes_key_encrypted, iv, tag = wire_format.message_fields(m)
         result.append({
             "id": m.id,
+            "chat_id": m.chat_id,
             "sender_id": m.sender_id,
-            "content": m.content,
-            "aes_key_encrypted": m.aes_key_encrypted,
-            "iv": m.iv,
-            "tag": m.tag,
+            "content": content,
+            "aes_key_encrypted": aes_key_encrypted,
+            "iv": iv,
+            "tag": tag,
             "timestamp": m.timestamp.isoformat(),
-            "recipients": [r.receiver_id for r in m.recipients]
+            "recipients": recipients[m.id]
         })
     return jsonify(result)
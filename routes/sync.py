@@ -0,0 +1,168 @@
+# routes/sync.py
+# Đồng bộ delta khi client kết nối lại: mọi thay đổi từ 1 cursor, stream dạng NDJSON.
+import base64
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import func
+
+from app import db
+from models import ChatMember, Message, UserEvent
+from services.message_service import unread_counts
+from services import wire_format
+
+sync_bp = Blueprint("sync", __name__)
+
+PAGE_SIZE = 200
+MAX_MESSAGES = 2000
+MAX_EVENTS = 1000
+# Tin mới hơn mốc này vẫn được gửi nhưng cursor dừng trước nó: id AUTO_INCREMENT có thể
+# commit không theo thứ tự (hoặc nằm trong hàng đợi write-behind), lần sync sau gửi lại.
+SETTLE_SECONDS = 2
+
+
+def encode_cursor(message_id, event_id, issued_at=None):
+    """issued_at (unix giây): mốc để từ chối cursor cũ hơn hạn giữ user_events."""
+    issued_at = int(time.time() if issued_at is None else issued_at)
+    raw = f"{message_id}:{event_id}:{issued_at}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("utf-8").rstrip("=")
+
+def decode_cursor(cursor):
+    """(message_id, event_id, issued_at); ValueError nếu cursor không hợp lệ. Cursor cũ 2 phần: issued_at = 0."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        parts = [int(part) for part in raw.split(":")]
+    except (TypeError, UnicodeDecodeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+    if len(parts) == 2:
+        parts.append(0)
+    if len(parts) != 3 or min(parts) < 0:
+        raise ValueError("Invalid cursor")
+    return tuple(parts)
+
+def cursor_expired(issued_at):
+    """Event sau cursor có thể đã bị prune_user_events xóa -> client phải tải lại toàn bộ."""
+    retention_days = current_app.config.get("USER_EVENT_RETENTION_DAYS") or 0
+    return retention_days > 0 and issued_at < time.time() - retention_days * 86400
+
+
+def _line(obj):
+    return json.dumps(obj) + "\n"
+
+
+@sync_bp.route("", methods=["GET"])
+@jwt_required()
+def sync():
+    """
+    GET /sync?since=<cursor> -> NDJSON, mỗi dòng 1 object:
+      {"type": "event", "id", "chat_id", "kind", "data"}   (chat_joined, read)
+      {"type": "message", "id", "chat_id", "sender_id", "content", ...}  (tăng dần theo id)
+      {"type": "chat", "chat_id", "unread", "last_message_id"}  (các chat có thay đổi)
+      {"type": "cursor", "cursor", "has_more"}             (luôn là dòng cuối)
+    Không có since: chỉ trả cursor hiện tại. has_more = true -> gọi lại với cursor mới.
+    Cursor cũ hơn USER_EVENT_RETENTION_DAYS -> 410 (event đã bị xóa, client tải lại từ đầu).
+    Chi phí tỉ lệ với số thay đổi: keyset theo (account_id, id) và (chat_id, id).
+    """
+    user_id = int(get_jwt_identity())
+    since = request.args.get("since")
+
+    if not since:
+        head_message = db.session.query(func.max(Message.id)).scalar() or 0
+        head_event = db.session.query(func.max(UserEvent.id)).filter(
+            UserEvent.account_id == user_id
+        ).scalar() or 0
+        cursor = encode_cursor(head_message, head_event)
+        return Response(_line({"type": "cursor", "cursor": cursor, "has_more": False}), mimetype="application/x-ndjson")
+
+    try:
+        after_message, after_event, issued_at = decode_cursor(since)
+    except ValueError:
+        return jsonify({"msg": "Invalid cursor"}), 400
+    if cursor_expired(issued_at):
+        return jsonify({"msg": "Cursor expired"}), 410
+
+    def generate():
+        touched = {} # chat_id -> last_message_id (None nếu chỉ có event)
+        has_more = False
+
+        # 1. Event của user (vào chat, đã đọc ở thiết bị khác...)
+        events = UserEvent.query.filter(
+            UserEvent.account_id == user_id,
+            UserEvent.id > after_event
+        ).order_by(UserEvent.id.asc()).limit(MAX_EVENTS + 1).all()
+        # Còn event chưa gửi: cursor mang thời điểm của event cuối đã gửi (các event còn lại
+        # không cũ hơn), để không được coi là còn hạn lâu hơn chính các event đó.
+        issued_at = None
+        if len(events) > MAX_EVENTS:
+            events, has_more = events[:MAX_EVENTS], True
+            if events[-1].created_at is not None:
+                issued_at = events[-1].created_at.replace(tzinfo=timezone.utc).timestamp()
+        event_cursor = after_event
+        for event in events:
+            touched.setdefault(event.chat_id, None)
+            event_cursor = event.id
+            yield _line({
+                "type": "event",
+                "id": event.id,
+                "chat_id": event.chat_id,
+                "kind": event.kind,
+                "data": json.loads(event.data) if event.data else None
+            })
+
+        # 2. Tin mới trong mọi chat của user, theo trang keyset
+        settle_before = datetime.utcnow() - timedelta(seconds=SETTLE_SECONDS)
+        message_cursor, settled, sent, last_id = after_message, True, 0, after_message
+        while sent < MAX_MESSAGES:
+            page = db.session.query(Message).join(
+                ChatMember, ChatMember.chat_id == Message.chat_id
+            ).filter(
+                ChatMember.account_id == user_id,
+                Message.id > last_id
+            ).order_by(Message.id.asc()).limit(min(PAGE_SIZE, MAX_MESSAGES - sent)).all()
+            for m in page:
+                content, aes_key_encrypted, iv, tag = wire_format.message_fields(m)
+                if settled and m.timestamp is not None and m.timestamp >= settle_before:
+                    settled = False
+                if settled:
+                    message_cursor = m.id
+                touched[m.chat_id] = m.id
+                yield _line({
+                    "type": "message",
+                    "id": m.id,
+                    "chat_id": m.chat_id,
+                    "sender_id": m.sender_id,
+                    "content": content,
+                    "aes_key_encrypted": aes_key_encrypted,
+                    "iv": iv,
+                    "tag": tag,
+                    "timestamp": m.timestamp.isoformat()
+                })
+            sent += len(page)
+            if not page:
+                break
+            last_id = page[-1].id
+            if len(page) < PAGE_SIZE:
+                break
+        else:
+            # Chỉ báo còn nữa khi cursor tin đã tiến tới hết trang (mọi tin đã settle). Nếu trang
+            # đầy mà có tin trong cửa sổ SETTLE_SECONDS, gọi lại ngay sẽ nhận đúng trang đó
+            # (cursor không tiến) -> vòng lặp; các tin sau đó đều mới hơn, lần sync sau sẽ lấy.
+            has_more = has_more or settled
+
+        # 3. Số chưa đọc của các chat có thay đổi (1 query GROUP BY)
+        if touched:
+            unread = unread_counts(user_id, list(touched))
+            for chat_id, last_message_id in touched.items():
+                yield _line({
+                    "type": "chat",
+                    "chat_id": chat_id,
+                    "unread": unread.get(chat_id, 0),
+                    "last_message_id": last_message_id
+                })
+
+        yield _line({"type": "cursor", "cursor": encode_cursor(message_cursor, event_cursor, issued_at), "has_more": has_more})
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
@@ -1,19 +1,17 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, make_response
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app import db
-from models import Account, UserProfile
+from app import db, socketio
+from services import socket_notify
+from models import Account, UserProfile, public_key_fingerprint
 from datetime import datetime
+import hashlib
 
 users_bp = Blueprint("users", __name__)
 
-@users_bp.route("/<int:user_id>", methods=["GET"])
-@jwt_required()
-def get_user(user_id):
-    user = Account.query.get(user_id)
-    if not user:
-        return jsonify({"msg": "User not found"}), 404
-    profile = user.profile
-    return jsonify({
+MAX_BATCH_IDS = 500
+
+def _serialize_user(user, profile):
+    return {
         "user_id": user.id,
         "username": user.username,
         "full_name": profile.full_name if profile else None,
@@ -23,8 +21,79 @@ def get_user(user_id):
         "bio": profile.bio if profile else None,
         "status": user.status,
         "last_seen": user.last_seen.isoformat() if user.last_seen else None,
-        "public_key": user.public_key
-    })
+        "public_key": user.public_key,
+        "key_fingerprint": user.key_fingerprint or public_key_fingerprint(user.public_key)
+    }
+
+@users_bp.route("/<int:user_id>", methods=["GET"])
+@jwt_required()
+def get_user(user_id):
+    user = Account.query.get(user_id)
+    if not user:
+        return jsonify({"msg": "User not found"}), 404
+    return jsonify(_serialize_user(user, user.profile))
+
+@users_bp.route("/batch", methods=["POST"])
+@jwt_required()
+def get_users_batch():
+    """
+    Lấy thông tin nhiều user trong 1 query: body {"ids": [1, 2, 3]}
+    Trả về {user_id: <như GET /users/<id>>}; id không tồn tại bị bỏ qua.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        ids = {int(x) for x in data.get("ids", [])}
+    except (TypeError, ValueError):
+        return jsonify({"msg": "ids must be a list of integers"}), 400
+    if len(ids) > MAX_BATCH_IDS:
+        return jsonify({"msg": f"At most {MAX_BATCH_IDS} ids per request"}), 400
+    if not ids:
+        return jsonify({})
+
+    rows = db.session.query(Account, UserProfile).outerjoin(
+        UserProfile, UserProfile.account_id == Account.id
+    ).filter(Account.id.in_(ids)).all()
+    return jsonify({str(user.id): _serialize_user(user, profile) for user, profile in rows})
+
+@users_bp.route("/keys", methods=["GET"])
+@jwt_required()
+def get_public_keys():
+    """
+    Lấy public key của nhiều user trong 1 query: GET /users/keys?ids=1,2,3
+    Trả về {user_id: {public_key, key_fingerprint, updated_at}}.
+    Hỗ trợ ETag / If-None-Match: bộ khóa không đổi -> 304.
+    """
+    try:
+        ids = {int(x) for x in request.args.get("ids", "").split(",") if x.strip()}
+    except ValueError:
+        return jsonify({"msg": "ids must be a comma-separated list of integers"}), 400
+    if not ids:
+        return jsonify({"msg": "ids is required"}), 400
+    if len(ids) > MAX_BATCH_IDS:
+        return jsonify({"msg": f"At most {MAX_BATCH_IDS} ids per request"}), 400
+
+    rows = db.session.query(Account.id, Account.public_key, Account.key_fingerprint, Account.created_at).filter(
+        Account.id.in_(ids)
+    ).order_by(Account.id.asc()).all()
+
+    # Khóa chỉ được đặt lúc đăng ký nên updated_at = created_at của account
+    keys = {}
+    for account_id, public_key, fingerprint, created_at in rows:
+        keys[str(account_id)] = {
+            "public_key": public_key,
+            "key_fingerprint": fingerprint or public_key_fingerprint(public_key),
+            "updated_at": created_at.isoformat() if created_at else None
+        }
+
+    etag = hashlib.sha256(
+        ",".join(f"{uid}:{k['key_fingerprint']}" for uid, k in keys.items()).encode("utf-8")
+    ).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        response = jsonify(keys)
+    response.set_etag(etag)
+    return response
 
 @users_bp.route("/me", methods=["PUT"])
 @jwt_required()
@@ -49,4 +118,9 @@ def update_profile():
     profile.bio = data.get("bio", profile.bio)
 
     db.session.commit()
+    # Báo các client xoá profile cache: qua socket server (services/socket_notify.py),
+    # hoặc emit thẳng qua message queue khi chạy nhiều worker
+    if socket_notify.uses_pubsub():
+        socketio.emit("profile_updated", {"user_id": user_id})
+    socket_notify.notify("profile_updated", {"user_id": user_id})
     return jsonify({"msg": "Profile updated"}), 200
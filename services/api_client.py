@@ -1,28 +1,95 @@
 # services/api_client.py
-import requests
 import json
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 BASE_URL = "http://127.0.0.1:5000"
 
+# (connect, read) timeout tính bằng giây
+CONNECT_TIMEOUT = float(os.getenv("SECURECHAT_HTTP_CONNECT_TIMEOUT", "3"))
+READ_TIMEOUT = float(os.getenv("SECURECHAT_HTTP_READ_TIMEOUT", "15"))
+# Số kết nối keep-alive giữ sẵn tới server (nên >= số thread của TaskRunner)
+POOL_SIZE = int(os.getenv("SECURECHAT_HTTP_POOL_SIZE", "8"))
+# Chỉ retry các method idempotent; POST (gửi tin, tạo chat, ...) không bao giờ bị gửi lại
+RETRY_TOTAL = int(os.getenv("SECURECHAT_HTTP_RETRIES", "3"))
+RETRY_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_lock = threading.Lock()
+
+# -----------------------------
+# Session
+# -----------------------------
+def _create_session():
+    retry = Retry(
+        total=RETRY_TOTAL,
+        backoff_factor=0.2,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=RETRY_METHODS,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # Server nén JSON lớn khi thấy header này (xem RESPONSE_GZIP trong app/config.py)
+    session.headers["Accept-Encoding"] = "gzip"
+    return session
+
+def get_session():
+    """Session dùng chung (thread-safe) để tái sử dụng kết nối TCP giữa các request."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _create_session()
+    return _session
+
+def close_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
 # -----------------------------
 # Helper
 # -----------------------------
-def _request(method, endpoint, token=None, json_data=None, params=None):
-    headers = {}
+def _send(method, endpoint, token=None, json_data=None, params=None, headers=None, stream=False):
+    """Gửi request và trả về Response (raise RequestException nếu lỗi mạng)."""
+    headers = dict(headers or {})
     if token:
         headers["Authorization"] = f"Bearer {token}"
+    start = time.perf_counter()
+    r = get_session().request(
+        method, f"{BASE_URL}{endpoint}", headers=headers, json=json_data, params=params,
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), stream=stream
+    )
+    logger.debug(
+        "%s %s -> %s (%.1f ms, %s bytes)",
+        _method_name(method), endpoint, r.status_code,
+        (time.perf_counter() - start) * 1000, "streamed" if stream else len(r.content)
+    )
+    return r
+
+def _request(method, endpoint, token=None, json_data=None, params=None, headers=None):
     try:
-        r = requests.request(method, f"{BASE_URL}{endpoint}", headers=headers, json=json_data, params=params)
-        print(f"[DEBUG] {_method_name(method)} {endpoint} -> {r.status_code}")
+        r = _send(method, endpoint, token=token, json_data=json_data, params=params, headers=headers)
         try:
             data = r.json()
         except json.JSONDecodeError:
             data = {"msg": r.text}
-        # Bỏ log response data để đỡ rối
-        # print(f"[DEBUG] Response: {data}") 
         return r.status_code, data
     except requests.exceptions.RequestException as e:
-        print(f"[ERROR] Request failed: {e}")
+        logger.warning("%s %s failed: %s", _method_name(method), endpoint, e)
         return None, {"msg": str(e)}
 
 def _method_name(method):
@@ -32,7 +99,6 @@ def _method_name(method):
 # Auth
 # -----------------------------
 def register(username, password, public_key, full_name=None, gender=None, date_of_birth=None, avatar_url=None, bio=None):
-    print(f"[DEBUG] Registering user: {username}")
     payload = {
         "username": username,
         "password": password,
@@ -46,7 +112,6 @@ def register(username, password, public_key, full_name=None, gender=None, date_o
     return _request("POST", "/auth/register", json_data=payload)
 
 def login(username, password):
-    print(f"[DEBUG] Logging in user: {username}")
     payload = {"username": username, "password": password}
     status, data = _request("POST", "/auth/login", json_data=payload)
     token = data.get("token")
@@ -54,18 +119,39 @@ def login(username, password):
     return token, user_id, status, data
 
 def logout(token):
-    print(f"[DEBUG] Logging out")
     return _request("POST", "/auth/logout", token=token)
 
 # -----------------------------
 # Users
 # -----------------------------
 def get_user_info(token, user_id):
-    print(f"[DEBUG] Getting user info for ID: {user_id}")
     return _request("GET", f"/users/{user_id}", token=token)
 
+def get_users_batch(token, user_ids):
+    return _request("POST", "/users/batch", token=token, json_data={"ids": list(user_ids)})
+
+def get_public_keys(token, user_ids, etag=None):
+    """
+    Lấy public key của nhiều user trong 1 request.
+    Trả về (status, data, etag); status 304 nghĩa là bộ khóa không đổi so với etag gửi lên.
+    """
+    params = {"ids": ",".join(str(uid) for uid in sorted(set(user_ids)))}
+    headers = {"If-None-Match": f'"{etag}"'} if etag else None
+    try:
+        r = _send("GET", "/users/keys", token=token, params=params, headers=headers)
+    except requests.exceptions.RequestException as e:
+        logger.warning("GET /users/keys failed: %s", e)
+        return None, {"msg": str(e)}, None
+    new_etag = r.headers.get("ETag", "").strip('"') or None
+    if r.status_code == 304:
+        return 304, {}, new_etag or etag
+    try:
+        data = r.json()
+    except json.JSONDecodeError:
+        data = {"msg": r.text}
+    return r.status_code, data, new_etag
+
 def update_profile(token, full_name=None, gender=None, date_of_birth=None, avatar_url=None, bio=None):
-    print(f"[DEBUG] Updating profile")
     payload = {
         "full_name": full_name,
         "gender": gender,
@@ -81,36 +167,37 @@ def update_profile(token, full_name=None, gender=None, date_of_birth=None, avata
 # -----------------------------
 def create_chat(token, name=None, is_group=False, members=None):
     members = members or []
-    print(f"[DEBUG] Creating chat: name={name}, is_group={is_group}, members={members}")
     payload = {"name": name, "is_group": is_group, "members": members}
     return _request("POST", "/chats", token=token, json_data=payload)
 
 def get_chats(token):
-    print(f"[DEBUG] Getting chats")
     return _request("GET", "/chats", token=token)
 
 def get_chat_detail(token, chat_id):
-    print(f"[DEBUG] Getting chat detail for chat_id={chat_id}")
     return _request("GET", f"/chats/{chat_id}", token=token)
 
 # <--- SỬA ĐỔI: THÊM HÀM MỚI NÀY --->
-def mark_chat_read(token, chat_id):
-    print(f"[DEBUG] Marking chat {chat_id} as read")
-    return _request("POST", f"/chats/{chat_id}/mark_read", token=token)
+def mark_chat_read(token, chat_id, up_to_message_id=None):
+    payload = {"up_to_message_id": up_to_message_id} if up_to_message_id is not None else None
+    return _request("POST", f"/chats/{chat_id}/mark_read", token=token, json_data=payload)
+
+def create_sender_key(token, chat_id, wrapped_keys):
+    return _request("POST", f"/chats/{chat_id}/sender_keys", token=token, json_data={"wrapped_keys": wrapped_keys})
+
+def get_sender_keys(token, key_ids):
+    params = {"ids": ",".join(str(kid) for kid in sorted(set(key_ids)))}
+    return _request("GET", "/chats/sender_keys", token=token, params=params)
 
 def add_member(token, chat_id, member_id):
-    print(f"[DEBUG] Adding member {member_id} to chat {chat_id}")
     return _request("POST", f"/chats/{chat_id}/add_member", token=token, json_data={"member_id": member_id})
 
 def remove_member(token, chat_id, member_id):
-    print(f"[DEBUG] Removing member {member_id} from chat {chat_id}")
     return _request("POST", f"/chats/{chat_id}/remove_member", token=token, json_data={"member_id": member_id})
 
 # -----------------------------
 # Messages
 # -----------------------------
 def send_message(token, chat_id, content, aes_key_encrypted, iv, tag):
-    print(f"[DEBUG] Sending message to chat {chat_id}")
     payload = {
         "content": content,
         "aes_key_encrypted": aes_key_encrypted,
@@ -119,18 +206,42 @@ def send_message(token, chat_id, content, aes_key_encrypted, iv, tag):
     }
     return _request("POST", f"/chats/{chat_id}/messages", token=token, json_data=payload)
 
-def get_messages(token, chat_id):
-    print(f"[DEBUG] Getting messages for chat {chat_id}")
-    return _request("GET", f"/chats/{chat_id}/messages", token=token)
+def get_messages(token, chat_id, before_id=None, after_id=None, limit=None):
+    params = {"before_id": before_id, "after_id": after_id, "limit": limit}
+    params = {k: v for k, v in params.items() if v is not None}
+    return _request("GET", f"/chats/{chat_id}/messages", token=token, params=params)
+
+# -----------------------------
+# Sync
+# -----------------------------
+def sync(token, since=None):
+    """
+    GET /sync (NDJSON). Trả về (status, iterator các dict), đọc dần trong lúc server còn stream.
+    Lỗi -> (status, iterator rỗng); mất kết nối giữa chừng -> iterator raise RequestException.
+    """
+    params = {"since": since} if since else None
+    try:
+        r = _send("GET", "/sync", token=token, params=params, stream=True)
+    except requests.exceptions.RequestException as e:
+        logger.warning("GET /sync failed: %s", e)
+        return None, iter(())
+    if r.status_code != 200:
+        r.close()
+        return r.status_code, iter(())
+
+    def items():
+        with r:
+            for line in r.iter_lines():
+                if line:
+                    yield json.loads(line)
+    return 200, items()
 
 # -----------------------------
 # Status
 # -----------------------------
 def update_status(token, status):
-    print(f"[DEBUG] Updating status to {status}")
     payload = {"status": status}
     return _request("POST", "/status", token=token, json_data=payload)
 
 def get_status(token, user_id):
-    print(f"[DEBUG] Getting status for user {user_id}")
     return _request("GET", f"/status/{user_id}", token=token)
\ No newline at end of file
@@ -0,0 +1,39 @@
+# services/async_backend.py
+# Chọn async backend cho socket server: threading (mặc định), eventlet hoặc gevent.
+# Module này KHÔNG import Flask/SQLAlchemy để có thể monkey patch trước mọi import khác.
+import os
+
+ASYNC_MODE = os.getenv("SOCKET_ASYNC_MODE", "threading")
+
+
+def monkey_patch():
+    """
+    Monkey patch thư viện chuẩn cho eventlet/gevent.
+    Phải gọi trước khi import Flask, SQLAlchemy, pymysql...
+    Driver DB nên là pure-Python (pymysql) để I/O với MySQL nhường event loop.
+    """
+    if ASYNC_MODE == "eventlet":
+        import eventlet
+        eventlet.monkey_patch()
+    elif ASYNC_MODE == "gevent":
+        from gevent import monkey
+        monkey.patch_all()
+
+
+def run_blocking(fn, *args, **kwargs):
+    """Chạy lời gọi blocking thật sự (fsync, C-extension) trong thread pool của OS, ngoài event loop."""
+    if ASYNC_MODE == "eventlet":
+        from eventlet import tpool
+        return tpool.execute(fn, *args, **kwargs)
+    if ASYNC_MODE == "gevent":
+        from gevent import get_hub
+        return get_hub().threadpool.apply(fn, args, kwargs)
+    return fn(*args, **kwargs)
+
+
+def server_options(max_connections):
+    """Tham số thêm cho socketio.run() theo backend."""
+    if ASYNC_MODE == "eventlet":
+        # eventlet.wsgi mặc định chỉ phục vụ 1024 kết nối đồng thời
+        return {"max_size": max_connections}
+    return {}
@@ -4,8 +4,12 @@ from Crypto.Cipher import PKCS1_OAEP, AES
 from Crypto.Protocol.KDF import PBKDF2
 from Crypto.Hash import SHA256
 from Crypto.Random import get_random_bytes
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
 import json
+import multiprocessing
 import os
+import threading
 from services import api_client  # Đảm bảo file api_client.py nằm trong thư mục services
 
 # -----------------------------
@@ -46,16 +50,173 @@ def decrypt_aes_gcm(ciphertext_b64, key, iv_b64, tag_b64):
 # -----------------------------
 # RSA wrap/unwrap (Mã hóa khóa AES bằng RSA)
 # -----------------------------
-def wrap_aes_key(aes_key, public_key_pem):
-    pub = RSA.import_key(public_key_pem)
+def wrap_aes_key(aes_key, public_key):
+    """public_key: PEM hoặc RSA key đã parse sẵn (vd. lấy từ PublicKeyCache)"""
+    pub = public_key if isinstance(public_key, RSA.RsaKey) else RSA.import_key(public_key)
     cipher = PKCS1_OAEP.new(pub, hashAlgo=SHA256)
     return base64.b64encode(cipher.encrypt(aes_key)).decode('utf-8')
 
-def unwrap_aes_key(wrapped_key_b64, private_key_pem):
-    priv = RSA.import_key(private_key_pem)
+def unwrap_aes_key(wrapped_key_b64, private_key):
+    """private_key: PEM hoặc RSA key đã parse sẵn (parse 1 lần rồi dùng lại sẽ nhanh hơn nhiều)"""
+    priv = private_key if isinstance(private_key, RSA.RsaKey) else RSA.import_key(private_key)
     cipher = PKCS1_OAEP.new(priv, hashAlgo=SHA256)
     return cipher.decrypt(base64.b64decode(wrapped_key_b64))
 
+def public_key_fingerprint(public_key_pem):
+    """SHA-256 (hex) của public key PEM, trùng công thức với server"""
+    return hashlib.sha256(public_key_pem.encode('utf-8')).hexdigest()
+
+# -----------------------------
+# Giải mã tin nhắn (song song)
+# -----------------------------
+def _key_dict(msg):
+    """aes_key_encrypted có thể là chuỗi JSON (REST) hoặc dict (socket)."""
+    key_dict = msg.get('aes_key_encrypted') or {}
+    if isinstance(key_dict, str):
+        try:
+            key_dict = json.loads(key_dict)
+        except ValueError:
+            key_dict = {}
+    return key_dict
+
+def _message_job(msg, key_dict, user_id):
+    """Rút gọn tin nhắn thành tuple picklable: (wrapped_key | None, content, iv, tag)."""
+    wrapped = None if "sk" in key_dict else key_dict.get(str(user_id))
+    return wrapped, msg.get('content'), msg.get('iv'), msg.get('tag')
+
+class DecryptFailure(str):
+    """
+    Thông báo hiển thị thay cho bản rõ khi không giải mã được (vẫn dùng như chuỗi).
+    Nơi lưu trữ dùng isinstance để không lưu / index thông báo này như nội dung thật.
+    """
+
+def _decrypt_job(job, private_key, aes_key=None):
+    """Trả về (aes_key | None, bản rõ hoặc DecryptFailure). Bỏ qua RSA nếu đã có aes_key."""
+    wrapped, content, iv, tag = job
+    if not wrapped and aes_key is None:
+        return None, DecryptFailure("[Không có khóa]")
+    try:
+        if aes_key is None:
+            aes_key = unwrap_aes_key(wrapped, private_key)
+        return aes_key, decrypt_aes_gcm(content, aes_key, iv, tag)
+    except Exception as e:
+        return None, DecryptFailure(f"[Lỗi giải mã: {e}]")
+
+_worker_private_key = None
+
+def _init_decrypt_worker(private_key_pem):
+    """Chạy 1 lần trong mỗi process con: parse private key và giữ lại."""
+    global _worker_private_key
+    _worker_private_key = RSA.import_key(private_key_pem)
+
+def _decrypt_in_worker(job):
+    return _decrypt_job(job, _worker_private_key)
+
+def _noop():
+    return None
+
+class DecryptionEngine:
+    """
+    Giải mã tin nhắn của 1 user đã đăng nhập.
+    - Private key chỉ được parse 1 lần (ở process chính và ở mỗi process con).
+    - map(): lô lớn chạy trong ProcessPoolExecutor (RSA-OAEP là CPU-bound, không
+      song song được bằng thread vì GIL), trả kết quả theo đúng thứ tự đầu vào,
+      từng tin ngay khi tin đó (và các tin trước nó) giải xong.
+    - Lô nhỏ (< inline_threshold) và decrypt() giải ngay trong thread gọi.
+    - message_keys (MessageKeyCache, tuỳ chọn): tin đã có khóa AES trong cache
+      không cần RSA, chỉ các tin còn thiếu mới được gửi sang pool.
+    - sender_keys (SenderKeyStore, gán sau khi đăng nhập): tin {"sk", "n"} lấy khóa
+      từ ratchet của người gửi (HMAC), không cần RSA.
+    """
+
+    def __init__(self, private_key_pem, user_id, workers=None, inline_threshold=16, message_keys=None):
+        self.user_id = user_id
+        self.message_keys = message_keys
+        self.sender_keys = None
+        self.private_key = RSA.import_key(private_key_pem)
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.inline_threshold = inline_threshold
+        self._pem = private_key_pem
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn, không fork: process cha có nhiều thread (Qt, socketio, QThreadPool),
+                # fork giữa chừng có thể sao chép lock đang bị giữ và treo process con
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_decrypt_worker,
+                    initargs=(self._pem,)
+                )
+            return self._pool
+
+    def warm_up(self):
+        """Khởi động trước các process con (không chờ) để lần mở chat đầu tiên không phải đợi."""
+        if self.workers > 1:
+            pool = self._get_pool()
+            for _ in range(self.workers):
+                pool.submit(_noop)
+
+    def _known_key(self, msg, key_dict, job):
+        """Khóa AES có sẵn không cần RSA (sender key hoặc cache), None nếu phải unwrap."""
+        if "sk" in key_dict:
+            if self.sender_keys is None:
+                return None
+            return self.sender_keys.message_key(key_dict, msg.get('sender_id'), msg.get('chat_id'))
+        if self.message_keys is None or not job[0]:
+            return None
+        return self.message_keys.get(job[0])
+
+    def _remember(self, job, aes_key):
+        if self.message_keys is not None and aes_key is not None and job[0]:
+            self.message_keys.put(job[0], aes_key)
+
+    def decrypt(self, msg):
+        """Giải mã 1 tin nhắn; aes_key_encrypted có thể là chuỗi JSON (REST) hoặc dict (socket)."""
+        key_dict = _key_dict(msg)
+        job = _message_job(msg, key_dict, self.user_id)
+        cached = self._known_key(msg, key_dict, job)
+        aes_key, text = _decrypt_job(job, self.private_key, cached)
+        if cached is None:
+            self._remember(job, aes_key)
+        return text
+
+    def map(self, msgs, chunksize=8):
+        """Iterator các bản rõ theo thứ tự của msgs. Công việc được gửi vào pool ngay khi gọi."""
+        key_dicts = [_key_dict(msg) for msg in msgs]
+        if self.sender_keys is not None:
+            # Tải mọi sender key còn thiếu của cả trang trong 1 request
+            self.sender_keys.prefetch(kd["sk"] for kd in key_dicts if "sk" in kd)
+        jobs = [_message_job(msg, key_dict, self.user_id) for msg, key_dict in zip(msgs, key_dicts)]
+        cached = [self._known_key(msg, key_dict, job) for msg, key_dict, job in zip(msgs, key_dicts, jobs)]
+        misses = [job for job, aes_key in zip(jobs, cached) if aes_key is None]
+        if self.workers <= 1 or len(misses) < self.inline_threshold:
+            unwrapped = (_decrypt_job(job, self.private_key) for job in misses)
+        else:
+            unwrapped = self._get_pool().map(_decrypt_in_worker, misses, chunksize=chunksize)
+        return self._merge(jobs, cached, unwrapped)
+
+    def _merge(self, jobs, cached, unwrapped):
+        """Ghép tin lấy khóa từ cache với kết quả từ pool, giữ đúng thứ tự ban đầu."""
+        for job, aes_key in zip(jobs, cached):
+            if aes_key is not None:
+                yield _decrypt_job(job, self.private_key, aes_key)[1]
+            else:
+                aes_key, text = next(unwrapped)
+                self._remember(job, aes_key)
+                yield text
+
+    def shutdown(self):
+        if self.message_keys is not None:
+            self.message_keys.save()
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
 # -----------------------------
 # Private key encryption (Mã hóa khóa riêng để lưu file)
 # -----------------------------
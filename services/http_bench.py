@@ -0,0 +1,61 @@
+# services/http_bench.py
+# So sánh N lần gọi get_chat_detail tuần tự: requests.request (mỗi lần 1 kết nối mới)
+# với Session dùng chung của api_client (keep-alive).
+#
+#   python -m services.http_bench --username alice --password secret --chat-id 1 -n 1000
+import argparse
+import statistics
+import time
+
+import requests
+
+from services import api_client
+
+
+def _old_get_chat_detail(token, chat_id):
+    r = requests.request(
+        "GET", f"{api_client.BASE_URL}/chats/{chat_id}",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    return r.status_code, r.json()
+
+
+def _run(name, fn, token, chat_id, n):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(n):
+        t0 = time.perf_counter()
+        status, _ = fn(token, chat_id)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if status != 200:
+            raise SystemExit(f"{name}: HTTP {status}")
+    total = time.perf_counter() - start
+    latencies.sort()
+    print(
+        f"{name:<8} total={total:.2f}s  mean={statistics.mean(latencies):.2f}ms  "
+        f"p50={latencies[len(latencies) // 2]:.2f}ms  p99={latencies[int(len(latencies) * 0.99) - 1]:.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark get_chat_detail: no pooling vs Session")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--chat-id", type=int, required=True)
+    parser.add_argument("-n", type=int, default=1000)
+    args = parser.parse_args()
+
+    token, _, status, data = api_client.login(args.username, args.password)
+    if not token:
+        raise SystemExit(f"Login failed ({status}): {data.get('msg')}")
+
+    # Làm nóng cả 2 đường (DNS, import, kết nối đầu tiên của pool)
+    _old_get_chat_detail(token, args.chat_id)
+    api_client.get_chat_detail(token, args.chat_id)
+
+    _run("old", _old_get_chat_detail, token, args.chat_id, args.n)
+    _run("session", api_client.get_chat_detail, token, args.chat_id, args.n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+# services/idle_bench.py
+# Giữ N kết nối Socket.IO nhàn rỗi tới socket server (chỉ trả lời ping của Engine.IO)
+# và đo: tốc độ mở kết nối, độ trễ presence_sync -> online_users của 1 kết nối thăm dò
+# trong lúc N kết nối đang mở, bộ nhớ server trên mỗi kết nối (nếu biết pid).
+# Client WebSocket tối giản trên asyncio (chỉ thư viện chuẩn) để 1 process giữ được hàng chục nghìn kết nối.
+#
+#   SOCKET_ASYNC_MODE=eventlet python -m services.socket_client      # terminal 1
+#   python -m services.idle_bench --username alice --password secret -n 10000 --server-pid <pid>
+import argparse
+import asyncio
+import base64
+import json
+import os
+import resource
+import statistics
+import struct
+import time
+from urllib.parse import urlparse
+
+
+# -----------------------------
+# WebSocket (RFC 6455) tối giản: frame text, ping/pong, close
+# -----------------------------
+async def _read_frame(reader):
+    """(opcode, payload) của 1 frame từ server (server không mask)."""
+    head = await reader.readexactly(2)
+    opcode, length = head[0] & 0x0F, head[1] & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", await reader.readexactly(8))[0]
+    return opcode, await reader.readexactly(length)
+
+def _frame(payload, opcode=0x1):
+    """Frame client -> server (bắt buộc mask)."""
+    mask = os.urandom(4)
+    length = len(payload)
+    if length < 126:
+        head = struct.pack("!BB", 0x80 | opcode, 0x80 | length)
+    elif length < 65536:
+        head = struct.pack("!BBH", 0x80 | opcode, 0x80 | 126, length)
+    else:
+        head = struct.pack("!BBQ", 0x80 | opcode, 0x80 | 127, length)
+    return head + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+
+class IdleClient:
+    """1 kết nối Socket.IO (Engine.IO v4, transport websocket) chỉ trả lời ping."""
+
+    def __init__(self, host, port, token):
+        self.host, self.port, self.token = host, port, token
+        self.reader = self.writer = None
+        self.waiters = {} # tên sự kiện -> Future
+        self.closed = False
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.writer.write((
+            f"GET /socket.io/?EIO=4&transport=websocket HTTP/1.1\r\n"
+            f"Host: {self.host}:{self.port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n"
+        ).encode())
+        status = await self.reader.readuntil(b"\r\n\r\n")
+        if b" 101 " not in status.split(b"\r\n", 1)[0]:
+            raise ConnectionError(status.split(b"\r\n", 1)[0].decode(errors="replace"))
+        _, packet = await _read_frame(self.reader) # "0{sid, pingInterval, ...}"
+        if not packet.startswith(b"0"):
+            raise ConnectionError(f"Unexpected Engine.IO open: {packet[:40]!r}")
+        self.send("40" + json.dumps({"token": self.token}))
+        while True:
+            _, packet = await _read_frame(self.reader)
+            if packet.startswith(b"40"):
+                return
+            if packet.startswith(b"44"):
+                raise ConnectionError(f"Socket.IO connect refused: {packet.decode(errors='replace')}")
+
+    def send(self, text):
+        self.writer.write(_frame(text.encode()))
+
+    async def run(self):
+        """Vòng đọc: trả lời ping Engine.IO ("2" -> "3") và ping WebSocket; báo sự kiện đang được chờ."""
+        try:
+            while True:
+                opcode, packet = await _read_frame(self.reader)
+                if opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    self.writer.write(_frame(packet, 0xA))
+                elif packet == b"2":
+                    self.send("3")
+                elif packet.startswith(b"42") and self.waiters:
+                    event = json.loads(packet[2:])[0]
+                    waiter = self.waiters.pop(event, None)
+                    if waiter is not None and not waiter.done():
+                        waiter.set_result(time.perf_counter())
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            self.closed = True
+
+    async def round_trip(self, event, reply, timeout=10):
+        """Thời gian (ms) từ lúc emit event tới khi nhận sự kiện reply."""
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[reply] = future
+        start = time.perf_counter()
+        self.send("42" + json.dumps([event]))
+        return (await asyncio.wait_for(future, timeout) - start) * 1000
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+# -----------------------------
+# Bench
+# -----------------------------
+def _rss_kb(pid):
+    if not pid:
+        return None
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return None
+
+def _raise_fd_limit(needed):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, needed), hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+async def _bench(args, token):
+    url = urlparse(args.url)
+    host, port = url.hostname, url.port or 80
+    rss_before = _rss_kb(args.server_pid)
+
+    clients, failures, tasks = [], 0, []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def open_one():
+        nonlocal failures
+        async with semaphore:
+            client = IdleClient(host, port, token)
+            try:
+                await client.connect()
+            except Exception:
+                failures += 1
+                client.close()
+                return
+            clients.append(client)
+            tasks.append(asyncio.ensure_future(client.run()))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(open_one() for _ in range(args.n)))
+    elapsed = time.perf_counter() - start
+    print(f"connect : {len(clients)}/{args.n} open in {elapsed:.1f}s ({len(clients) / elapsed:,.0f}/s), {failures} failed")
+
+    # Trong lúc N kết nối nhàn rỗi: 1 kết nối thăm dò đo độ trễ phục vụ
+    probe = IdleClient(host, port, token)
+    await probe.connect()
+    probe_task = asyncio.ensure_future(probe.run())
+    latencies, deadline = [], time.perf_counter() + args.hold
+    while time.perf_counter() < deadline:
+        try:
+            latencies.append(await probe.round_trip("presence_sync", "online_users"))
+        except asyncio.TimeoutError:
+            latencies.append(float("inf"))
+        await asyncio.sleep(args.probe_interval)
+
+    dropped = sum(1 for c in clients if c.closed)
+    finite = [v for v in latencies if v != float("inf")]
+    if finite:
+        print(
+            f"probe   : {len(latencies)} round trips, mean={statistics.mean(finite):.1f}ms  "
+            f"p50={_percentile(finite, 0.5):.1f}ms  p99={_percentile(finite, 0.99):.1f}ms  "
+            f"timeouts={len(latencies) - len(finite)}"
+        )
+    print(f"idle    : {dropped} of {len(clients)} connections dropped during {args.hold}s hold")
+
+    rss_after = _rss_kb(args.server_pid)
+    if rss_before is not None and rss_after is not None and clients:
+        print(f"server  : RSS {rss_before / 1024:.0f} -> {rss_after / 1024:.0f} MiB "
+              f"({(rss_after - rss_before) / len(clients):.1f} KiB/connection)")
+
+    for client in clients + [probe]:
+        client.close()
+    for task in tasks + [probe_task]:
+        task.cancel()
+    await asyncio.gather(*tasks, probe_task, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hold N idle Socket.IO connections and probe server latency")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{os.getenv('SOCKET_PORT', '5001')}")
+    parser.add_argument("--token", help="JWT; nếu không có thì đăng nhập bằng --username/--password")
+    parser.add_argument("--username")
+    parser.add_argument("--password")
+    parser.add_argument("-n", type=int, default=10_000, help="Số kết nối nhàn rỗi")
+    parser.add_argument("--concurrency", type=int, default=200, help="Số handshake chạy song song")
+    parser.add_argument("--hold", type=float, default=60, help="Giữ kết nối bao nhiêu giây")
+    parser.add_argument("--probe-interval", type=float, default=0.5)
+    parser.add_argument("--server-pid", type=int, help="pid socket server (cùng máy) để đo RSS")
+    args = parser.parse_args()
+
+    token = args.token
+    if not token:
+        if not (args.username and args.password):
+            raise SystemExit("--token or --username/--password is required")
+        from services import api_client
+        token, _, status, data = api_client.login(args.username, args.password)
+        if not token:
+            raise SystemExit(f"Login failed ({status}): {data.get('msg')}")
+
+    limit = _raise_fd_limit(args.n + 100)
+    if limit < args.n + 100:
+        print(f"warning: open file limit is {limit}, raise it (ulimit -n) for {args.n} connections")
+    asyncio.run(_bench(args, token))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# services/key_cache.py
+# Cache public key của các user phía client (bộ nhớ + file local).
+# Chỉ tải lại khóa khi server báo fingerprint khác với bản đang giữ.
+import hashlib
+import json
+import os
+import threading
+
+from Crypto.PublicKey import RSA
+
+from services import api_client, crypto_client
+
+MAX_BATCH_IDS = 500
+
+
+class PublicKeyCache:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {} # user_id -> {"pem", "fingerprint"}
+        self._parsed = {}  # user_id -> RSA key đã parse
+        self._load()
+
+    # -----------------------------
+    # Persistence
+    # -----------------------------
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._entries = {int(uid): entry for uid, entry in data.items()}
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({str(uid): entry for uid, entry in self._entries.items()}, f)
+        os.replace(tmp_path, self.path)
+
+    # -----------------------------
+    # Lookups
+    # -----------------------------
+    def get(self, user_id, fingerprint=None):
+        """Trả về RSA key đã parse, hoặc None nếu chưa có / fingerprint không khớp."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if not entry or (fingerprint and entry["fingerprint"] != fingerprint):
+                return None
+            key = self._parsed.get(user_id)
+            if key is None:
+                key = RSA.import_key(entry["pem"])
+                self._parsed[user_id] = key
+            return key
+
+    def put_many(self, pems):
+        """pems: {user_id: public_key_pem}"""
+        with self._lock:
+            for user_id, pem in pems.items():
+                self._entries[user_id] = {
+                    "pem": pem,
+                    "fingerprint": crypto_client.public_key_fingerprint(pem)
+                }
+                self._parsed[user_id] = RSA.import_key(pem)
+            self._save()
+
+    def get_keys(self, token, fingerprints):
+        """
+        fingerprints: {user_id: fingerprint hoặc None} (thường lấy từ get_chat_detail).
+        Chỉ gọi server cho các user chưa có khóa hoặc fingerprint đã đổi.
+        Trả về {user_id: RSA key}.
+        """
+        keys = {}
+        missing = []
+        for user_id, fingerprint in fingerprints.items():
+            key = self.get(user_id, fingerprint)
+            if key is None:
+                missing.append(user_id)
+            else:
+                keys[user_id] = key
+
+        fetched = self._fetch(token, missing)
+        for user_id in fetched:
+            keys[user_id] = self.get(user_id)
+        return keys
+
+    def refresh(self, token, user_ids=None):
+        """
+        Kiểm tra lại toàn bộ khóa đang giữ (hoặc user_ids) bằng ETag:
+        không có gì thay đổi -> server trả 304, không tải lại khóa nào.
+        """
+        with self._lock:
+            ids = sorted(user_ids if user_ids is not None else self._entries.keys())
+        for i in range(0, len(ids), MAX_BATCH_IDS):
+            chunk = ids[i:i + MAX_BATCH_IDS]
+            status, data, _ = api_client.get_public_keys(token, chunk, etag=self._local_etag(chunk))
+            if status == 200:
+                self._store_response(data)
+
+    def _local_etag(self, user_ids):
+        """ETag tính từ fingerprint đang giữ, cùng công thức với GET /users/keys."""
+        with self._lock:
+            if any(uid not in self._entries for uid in user_ids):
+                return None
+            joined = ",".join(f"{uid}:{self._entries[uid]['fingerprint']}" for uid in sorted(user_ids))
+        return hashlib.sha256(joined.encode("utf-8")).hexdigest()
+
+    def _fetch(self, token, user_ids):
+        """Tải khóa của user_ids qua endpoint batch, trả về {user_id: pem} đã lưu."""
+        fetched = {}
+        user_ids = list(user_ids)
+        for i in range(0, len(user_ids), MAX_BATCH_IDS):
+            status, data, _ = api_client.get_public_keys(token, user_ids[i:i + MAX_BATCH_IDS])
+            if status == 200:
+                fetched.update(self._store_response(data))
+        return fetched
+
+    def _store_response(self, data):
+        pems = {int(uid): info["public_key"] for uid, info in data.items() if info.get("public_key")}
+        if pems:
+            self.put_many(pems)
+        return pems
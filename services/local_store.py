@@ -0,0 +1,388 @@
+# services/local_store.py
+# Kho tin nhắn đã giải mã trên máy client (SQLite), mỗi dòng mã hóa AES-GCM riêng.
+# Khóa dẫn xuất từ mật khẩu đăng nhập bằng PBKDF2 (cùng tham số với crypto_client),
+# salt lưu trong bảng meta. Mở chat = đọc index (chat_id, message_id) + đồng bộ phần mới.
+# Tìm kiếm: index FTS5 trên các token "mù" (HMAC của từ / tiền tố từ), không lưu chữ rõ.
+import hashlib
+import hmac
+import json
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+
+from Crypto.Cipher import AES
+from Crypto.Hash import SHA256
+from Crypto.Protocol.KDF import PBKDF2
+from Crypto.Random import get_random_bytes
+
+from services.crypto_client import DecryptFailure
+
+PBKDF2_ITERATIONS = 100_000
+_VERIFIER = b"securechat-local-store-v1"
+# 2: bỏ các dòng lưu thông báo lỗi giải mã như nội dung thật (bản cũ)
+# 3: bỏ token nguyên từ ("w"), chỉ còn token tiền tố
+SEARCH_INDEX_VERSION = b"3"
+# Tiền tố được index: 2..MAX_PREFIX ký tự đầu của mỗi từ (gõ tới đâu tìm tới đó)
+MIN_PREFIX = 2
+MAX_PREFIX = 6
+_WORD_RE = re.compile(r"\w+")
+# Cache token theo từ (từ lặp lại rất nhiều giữa các tin)
+_WORD_CACHE_SIZE = 100_000
+# SQLITE_MAX_VARIABLE_NUMBER mặc định của SQLite < 3.32: tối đa 999 tham số mỗi câu lệnh
+_MAX_SQL_PARAMS = 999
+# Câu lệnh UNION messages / loose_messages bind mỗi id 2 lần
+_ID_CHUNK = _MAX_SQL_PARAMS // 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value BLOB NOT NULL
+);
+-- failed = 1: chưa giải mã được, payload giữ bản mã của server để giải lại sau
+CREATE TABLE IF NOT EXISTS messages (
+    chat_id    INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    payload    BLOB NOT NULL,
+    failed     INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (chat_id, message_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS messages_by_id ON messages (message_id);
+-- Tin nhận realtime, nằm ngoài dải liên tục của messages: chỉ dùng cho tìm kiếm,
+-- được chuyển sang messages khi đồng bộ delta tải lại đúng tin đó
+CREATE TABLE IF NOT EXISTS loose_messages (
+    message_id INTEGER PRIMARY KEY,
+    chat_id    INTEGER NOT NULL,
+    payload    BLOB NOT NULL
+);
+"""
+# rowid = message_id; contentless: chỉ giữ posting list của token, không giữ văn bản
+_SEARCH_SCHEMA = "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(tokens, content='')"
+
+
+def normalize_text(text):
+    """Chữ thường, bỏ dấu tiếng Việt (tìm "tin nhan" ra "tin nhắn")."""
+    if text.isascii():
+        return text.lower()
+    text = unicodedata.normalize("NFD", text.lower()).replace("đ", "d")
+    return "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+
+def words(text):
+    return _WORD_RE.findall(normalize_text(text))
+
+
+class LocalStore:
+    """
+    - Chỉ chat_id, message_id ở dạng rõ (để làm index); sender, thời gian và nội dung nằm trong payload mã hóa.
+    - AAD của mỗi dòng là "chat_id:message_id" nên không thể tráo payload giữa các dòng.
+    - Mỗi chat được lưu thành 1 dải id liên tục (chỉ thêm trang kề với dải đã có),
+      nên "tin mới nhất đã lưu" là mốc after_id chính xác để đồng bộ delta.
+    - Mật khẩu không khớp với kho hiện có (vd. đã đổi mật khẩu) -> xoá kho, tạo lại.
+    - Tin chưa giải mã được (DecryptFailure) vẫn giữ chỗ trong dải nhưng lưu bản mã thay vì
+      chữ rõ, không được index; get_messages trả text None để người gọi giải mã lại.
+    - search(): mỗi từ được index dưới dạng HMAC của các tiền tố 2..6 ký tự, nên file DB
+      không chứa chữ rõ; kết quả (mới nhất trước) được giải mã và kiểm tra lại (loại trùng HMAC / tiền tố dài).
+      SQLite không có FTS5 -> search_available = False.
+    """
+
+    def __init__(self, path, passphrase):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(messages)")]
+        if "failed" not in columns:
+            self._conn.execute("ALTER TABLE messages ADD COLUMN failed INTEGER NOT NULL DEFAULT 0")
+        try:
+            self._conn.execute(_SEARCH_SCHEMA)
+            self.search_available = True
+        except sqlite3.OperationalError:
+            self.search_available = False
+        self._key = self._open_key(passphrase)
+        self._search_key = hmac.new(self._key, b"securechat/search-index", hashlib.sha256).digest()
+        self._word_tokens_cache = {}
+        if self.search_available:
+            self._build_search_index()
+
+    # -----------------------------
+    # Key
+    # -----------------------------
+    def _open_key(self, passphrase):
+        meta = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+        if "salt" in meta:
+            key = PBKDF2(passphrase, meta["salt"], dkLen=32, count=PBKDF2_ITERATIONS, hmac_hash_module=SHA256)
+            try:
+                if self._decrypt(key, meta["verifier"], b"meta") == _VERIFIER:
+                    return key
+            except (KeyError, ValueError):
+                pass
+
+        # Kho mới hoặc không mở được bằng mật khẩu này
+        salt = get_random_bytes(16)
+        key = PBKDF2(passphrase, salt, dkLen=32, count=PBKDF2_ITERATIONS, hmac_hash_module=SHA256)
+        with self._conn:
+            self._conn.execute("DELETE FROM messages")
+            self._conn.execute("DELETE FROM loose_messages")
+            self._conn.execute("DELETE FROM meta")
+            if self.search_available:
+                self._conn.execute("INSERT INTO search_index (search_index) VALUES ('delete-all')")
+            self._conn.executemany(
+                "INSERT INTO meta (key, value) VALUES (?, ?)",
+                [("salt", salt), ("verifier", self._encrypt(key, _VERIFIER, b"meta"))]
+            )
+        return key
+
+    @staticmethod
+    def _encrypt(key, plaintext, aad):
+        cipher = AES.new(key, AES.MODE_GCM)
+        cipher.update(aad)
+        ciphertext, tag = cipher.encrypt_and_digest(plaintext)
+        return cipher.nonce + tag + ciphertext
+
+    @staticmethod
+    def _decrypt(key, blob, aad):
+        nonce, tag, ciphertext = blob[:16], blob[16:32], blob[32:]
+        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(aad)
+        return cipher.decrypt_and_verify(ciphertext, tag)
+
+    # -----------------------------
+    # Messages
+    # -----------------------------
+    def _rows(self, chat_id, pairs):
+        rows = []
+        for msg, text in pairs:
+            record = {"sender_id": msg["sender_id"], "timestamp": msg.get("timestamp"), "text": text}
+            failed = isinstance(text, DecryptFailure)
+            if failed:
+                record["text"] = None
+                record["encrypted"] = {field: msg.get(field) for field in ("content", "aes_key_encrypted", "iv", "tag")}
+            aad = f"{chat_id}:{msg['id']}".encode("utf-8")
+            rows.append((chat_id, msg["id"], self._encrypt(self._key, json.dumps(record).encode("utf-8"), aad), int(failed)))
+        return rows
+
+    def _stored_ids(self, ids):
+        """Các id trong ids đã có (ở messages hoặc loose_messages), tức là đã được index."""
+        ids = list(ids)
+        found = set()
+        for i in range(0, len(ids), _ID_CHUNK):
+            chunk = ids[i:i + _ID_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            found.update(mid for (mid,) in self._conn.execute(
+                f"SELECT message_id FROM messages WHERE message_id IN ({marks}) AND failed = 0 "
+                f"UNION SELECT message_id FROM loose_messages WHERE message_id IN ({marks})",
+                chunk + chunk
+            ))
+        return found
+
+    def put_messages(self, chat_id, pairs):
+        """
+        pairs: [(msg, text)] với msg là dict từ GET /chats/<id>/messages.
+        Tin lỗi giải mã chỉ giữ chỗ (không ghi đè bản đã giải mã được).
+        """
+        rows = self._rows(chat_id, pairs)
+        with self._lock, self._conn:
+            new_pairs = self._unindexed(pairs)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO messages (chat_id, message_id, payload, failed) VALUES (?, ?, ?, ?)",
+                [row for row in rows if not row[3]]
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO messages (chat_id, message_id, payload, failed) VALUES (?, ?, ?, ?)",
+                [row for row in rows if row[3]]
+            )
+            self._conn.executemany("DELETE FROM loose_messages WHERE message_id = ?", [(row[1],) for row in rows])
+            self._index(new_pairs)
+
+    def put_loose_messages(self, chat_id, pairs):
+        """
+        Tin realtime đã giải mã: chỉ để tìm kiếm, không làm thay đổi dải liên tục
+        (get_messages / message_range không đọc bảng này). Tin lỗi giải mã bị bỏ qua.
+        """
+        pairs = [(msg, text) for msg, text in pairs if not isinstance(text, DecryptFailure)]
+        with self._lock, self._conn:
+            new_pairs = self._unindexed(pairs)
+            self._conn.executemany(
+                "INSERT INTO loose_messages (chat_id, message_id, payload) VALUES (?, ?, ?)",
+                [row[:3] for row in self._rows(chat_id, new_pairs)]
+            )
+            self._index(new_pairs)
+
+    def get_messages(self, chat_id, before_id=None, after_id=None, limit=50):
+        """
+        Trang tin mới nhất (hoặc cũ hơn before_id), tăng dần theo id: [(msg, text)].
+        after_id: các tin ngay sau after_id (cuộn xuống), cũng tăng dần theo id.
+        Tin chưa giải mã được: text None, msg kèm content / aes_key_encrypted / iv / tag.
+        """
+        query = "SELECT message_id, payload FROM messages WHERE chat_id = ?"
+        params = [chat_id]
+        if before_id is not None:
+            query += " AND message_id < ?"
+            params.append(before_id)
+        if after_id is not None:
+            query += " AND message_id > ?"
+            params.append(after_id)
+        query += " ORDER BY message_id " + ("ASC" if after_id is not None else "DESC") + " LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        if after_id is None:
+            rows.reverse()
+
+        result = []
+        for message_id, payload in rows:
+            try:
+                record = json.loads(self._decrypt(self._key, payload, f"{chat_id}:{message_id}".encode("utf-8")))
+            except ValueError:
+                continue # Dòng hỏng: bỏ qua, không chặn cả trang
+            msg = {"id": message_id, "chat_id": chat_id, "sender_id": record["sender_id"], "timestamp": record["timestamp"]}
+            msg.update(record.get("encrypted") or {})
+            result.append((msg, record["text"]))
+        return result
+
+    def last_message_id(self, chat_id):
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(message_id) FROM messages WHERE chat_id = ?", (chat_id,)).fetchone()
+        return row[0]
+
+    def message_range(self, chat_id):
+        """(id nhỏ nhất, id lớn nhất) của dải đã lưu, (None, None) nếu chưa lưu tin nào."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT MIN(message_id), MAX(message_id) FROM messages WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+
+    # -----------------------------
+    # Search
+    # -----------------------------
+    def _token(self, kind, value):
+        digest = hmac.digest(self._search_key, f"{kind}:{value}".encode("utf-8"), "sha256")
+        return "t" + digest[:8].hex()
+
+    def _word_tokens(self, word):
+        tokens = self._word_tokens_cache.get(word)
+        if tokens is None:
+            tokens = [self._token("p", word[:n]) for n in range(MIN_PREFIX, min(len(word), MAX_PREFIX) + 1)]
+            if len(self._word_tokens_cache) >= _WORD_CACHE_SIZE:
+                self._word_tokens_cache.clear()
+            self._word_tokens_cache[word] = tokens
+        return tokens
+
+    def _tokens(self, text):
+        tokens = set()
+        for word in words(text):
+            tokens.update(self._word_tokens(word))
+        return tokens
+
+    def _unindexed(self, pairs):
+        if not self.search_available or not pairs:
+            return []
+        stored = self._stored_ids(msg["id"] for msg, _ in pairs)
+        return [(msg, text) for msg, text in pairs if msg["id"] not in stored]
+
+    def _index(self, pairs):
+        """Gọi trong transaction của put_*; pairs chỉ gồm tin chưa được index."""
+        rows = [
+            (msg["id"], " ".join(sorted(self._tokens(text))))
+            for msg, text in pairs if text and not isinstance(text, DecryptFailure)
+        ]
+        if rows:
+            self._conn.executemany("INSERT INTO search_index (rowid, tokens) VALUES (?, ?)", rows)
+
+    def _build_search_index(self):
+        """
+        Index các tin đã lưu trước khi có tìm kiếm (chạy 1 lần, lúc mở kho).
+        Chat có dòng lưu thông báo lỗi giải mã như chữ rõ (bản cũ) bị xoá khỏi kho,
+        để lần mở sau tải lại từ server và giải mã lại.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'search_index'").fetchone()
+            if row is not None and row[0] == SEARCH_INDEX_VERSION:
+                return
+            stored = self._conn.execute(
+                "SELECT chat_id, message_id, payload FROM messages WHERE failed = 0 "
+                "UNION ALL SELECT chat_id, message_id, payload FROM loose_messages"
+            ).fetchall()
+            pairs, stale_chats = [], set()
+            for chat_id, message_id, payload in stored:
+                try:
+                    record = json.loads(self._decrypt(self._key, payload, f"{chat_id}:{message_id}".encode("utf-8")))
+                except ValueError:
+                    continue
+                text = record["text"]
+                if text == "[Không có khóa]" or text.startswith("[Lỗi giải mã: "):
+                    stale_chats.add(chat_id)
+                    continue
+                pairs.append(({"id": message_id, "chat_id": chat_id}, text))
+            with self._conn:
+                self._conn.executemany("DELETE FROM messages WHERE chat_id = ?", [(cid,) for cid in stale_chats])
+                self._conn.executemany("DELETE FROM loose_messages WHERE chat_id = ?", [(cid,) for cid in stale_chats])
+                self._conn.execute("INSERT INTO search_index (search_index) VALUES ('delete-all')")
+                self._index([(msg, text) for msg, text in pairs if msg["chat_id"] not in stale_chats])
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('search_index', ?)", (SEARCH_INDEX_VERSION,)
+                )
+
+    def search(self, query, limit=50):
+        """
+        Tìm tin chứa mọi từ trong query (mỗi từ khớp như tiền tố), tin mới nhất trước.
+        Trả về [(msg, text)] (msg có id, chat_id, sender_id, timestamp).
+        Không xếp theo bm25: với tiền tố 2-3 ký tự phổ biến, ORDER BY rank phải chấm điểm mọi tin
+        khớp trước khi LIMIT (~150 ms / 85k tin khớp trên kho 200k tin), còn ORDER BY rowid DESC
+        đọc posting list từ cuối và dừng sớm (< 1 ms).
+        """
+        terms = [term for term in words(query) if len(term) >= MIN_PREFIX]
+        if not self.search_available or not terms:
+            return []
+        # Tiền tố dài hơn MAX_PREFIX: tìm theo MAX_PREFIX ký tự đầu rồi lọc lại sau khi giải mã
+        match = " AND ".join(f'"{self._token("p", term[:MAX_PREFIX])}"' for term in terms)
+
+        result = []
+        before, batch = None, limit * 2
+        while len(result) < limit:
+            # Phân trang keyset theo rowid (= message_id), không dùng OFFSET
+            with self._lock:
+                hits = self._conn.execute(
+                    "SELECT rowid FROM search_index WHERE search_index MATCH ? AND (? IS NULL OR rowid < ?) "
+                    "ORDER BY rowid DESC LIMIT ?",
+                    (match, before, before, batch)
+                ).fetchall()
+                rows = self._message_rows([rowid for (rowid,) in hits])
+            for message_id, chat_id, payload in rows:
+                try:
+                    record = json.loads(self._decrypt(self._key, payload, f"{chat_id}:{message_id}".encode("utf-8")))
+                except ValueError:
+                    continue
+                text_words = words(record["text"])
+                if all(any(word.startswith(term) for word in text_words) for term in terms):
+                    msg = {"id": message_id, "chat_id": chat_id, "sender_id": record["sender_id"], "timestamp": record["timestamp"]}
+                    result.append((msg, record["text"]))
+                    if len(result) == limit:
+                        break
+            if len(hits) < batch:
+                break
+            before = hits[-1][0]
+        return result
+
+    def _message_rows(self, message_ids):
+        """[(message_id, chat_id, payload)] theo đúng thứ tự message_ids."""
+        found = {}
+        for i in range(0, len(message_ids), _ID_CHUNK):
+            chunk = message_ids[i:i + _ID_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            for message_id, chat_id, payload in self._conn.execute(
+                f"SELECT message_id, chat_id, payload FROM messages WHERE message_id IN ({marks}) AND failed = 0 "
+                f"UNION ALL SELECT message_id, chat_id, payload FROM loose_messages WHERE message_id IN ({marks})",
+                chunk + chunk
+            ):
+                found[message_id] = (message_id, chat_id, payload)
+        return [found[mid] for mid in message_ids if mid in found]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
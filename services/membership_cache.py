@@ -0,0 +1,155 @@
+# services/membership_cache.py
+# Cache thành viên chat trong bộ nhớ (chat_id -> members, user_id -> chats), TTL + LRU.
+# Kèm tên chat / tên hiển thị user cho sự kiện chat_summary.
+import threading
+import time
+from collections import OrderedDict
+
+from app import db
+from models import Account, Chat, ChatMember, UserProfile
+
+
+class MembershipCache:
+    """
+    Dùng cho phân quyền và fan-out ở socket server.
+    Mỗi process có cache riêng: thay đổi từ REST server đến qua services/socket_notify.py
+    (invalidate_chat / invalidate_name); nếu thông báo bị mất, dữ liệu cũ tồn tại tối đa
+    `ttl` giây. Kết quả "không phải thành viên" cũng được cache tới khi hết hạn / bị invalidate,
+    nên client gửi liên tục vào chat không thuộc về mình không gây query DB mỗi lần.
+    chat_id luôn là int (socket server chuẩn hoá payload trước khi tra cứu).
+    """
+
+    def __init__(self, ttl=60, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._chats = OrderedDict()
+        self._users = OrderedDict() # user_id -> frozenset chat_id (presence: chat_peers)
+        self._info = OrderedDict()  # chat_id -> {"name", "is_group"}
+        self._names = OrderedDict() # user_id -> tên hiển thị
+        self.hits = 0
+        self.misses = 0
+
+    # -----------------------------
+    # LRU helpers
+    # -----------------------------
+    def _get(self, store, key):
+        with self._lock:
+            entry = store.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                store.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            store.pop(key, None)
+            self.misses += 1
+            return None
+
+    def _put(self, store, key, value):
+        with self._lock:
+            store[key] = (value, time.monotonic() + self.ttl)
+            store.move_to_end(key)
+            while len(store) > self.max_entries:
+                store.popitem(last=False)
+
+    # -----------------------------
+    # Lookups
+    # -----------------------------
+    def chat_members(self, chat_id):
+        members = self._get(self._chats, chat_id)
+        if members is None:
+            members = self._load_chat(chat_id)
+        return members
+
+    def is_member(self, chat_id, user_id):
+        """Kiểm tra quyền theo danh sách thành viên đã cache (kể cả khi kết quả là không)."""
+        return user_id in self.chat_members(chat_id)
+
+    def user_chats(self, user_id):
+        chats = self._get(self._users, user_id)
+        if chats is None:
+            chats = self._load_user(user_id)
+        return chats
+
+    def chat_peers(self, user_id):
+        """Những user có chung ít nhất 1 chat với user_id (phạm vi presence), không query khi cache còn."""
+        peers = set()
+        for chat_id in self.user_chats(user_id):
+            peers.update(self.chat_members(chat_id))
+        peers.discard(user_id)
+        return peers
+
+    def chat_info(self, chat_id):
+        info = self._get(self._info, chat_id)
+        if info is None:
+            row = db.session.query(Chat.name, Chat.is_group).filter(Chat.id == chat_id).first()
+            info = {"name": row[0], "is_group": bool(row[1])} if row else {"name": None, "is_group": False}
+            self._put(self._info, chat_id, info)
+        return info
+
+    def display_name(self, user_id):
+        """full_name nếu có, không thì username (giống tên chat 1-1 trong GET /chats)."""
+        name = self._get(self._names, user_id)
+        if name is None:
+            row = db.session.query(Account.username, UserProfile.full_name).outerjoin(
+                UserProfile, UserProfile.account_id == Account.id
+            ).filter(Account.id == user_id).first()
+            name = (row[1] or row[0]) if row else ""
+            self._put(self._names, user_id, name)
+        return name
+
+    def _load_user(self, user_id):
+        """1 query: mọi chat của user kèm thành viên của từng chat; nạp cả _users và _chats."""
+        mine = db.session.query(ChatMember.chat_id).filter(ChatMember.account_id == user_id)
+        rows = db.session.query(ChatMember.chat_id, ChatMember.account_id).filter(
+            ChatMember.chat_id.in_(mine)
+        ).all()
+        members = {}
+        for chat_id, account_id in rows:
+            members.setdefault(chat_id, set()).add(account_id)
+        for chat_id, ids in members.items():
+            self._put(self._chats, chat_id, frozenset(ids))
+        chats = frozenset(members)
+        self._put(self._users, user_id, chats)
+        return chats
+
+    def _load_chat(self, chat_id):
+        rows = db.session.query(ChatMember.account_id).filter(ChatMember.chat_id == chat_id).all()
+        members = frozenset(uid for (uid,) in rows)
+        self._put(self._chats, chat_id, members)
+        return members
+
+    # -----------------------------
+    # Invalidation
+    # -----------------------------
+    def invalidate_chat(self, chat_id, member_ids=()):
+        """
+        Thành viên của chat thay đổi. member_ids: các user vừa vào / rời chat (không có trong
+        entry cũ), để danh sách chat của họ cũng được nạp lại.
+        """
+        with self._lock:
+            entry = self._chats.pop(chat_id, None)
+            self._info.pop(chat_id, None)
+            affected = set(member_ids)
+            if entry is not None:
+                affected.update(entry[0])
+            for user_id in affected:
+                self._users.pop(user_id, None)
+
+    def invalidate_name(self, user_id):
+        with self._lock:
+            self._names.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "chats": len(self._chats),
+                "users": len(self._users),
+                "names": len(self._names)
+            }
+
+
+membership_cache = MembershipCache()
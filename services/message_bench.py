@@ -0,0 +1,100 @@
+# services/message_bench.py
+# Số tin gửi / giây của đường ghi dùng chung REST + socket (message_service.create_message)
+# theo số thành viên chat (mặc định 2 / 50 / 500), khi tắt và bật fan-out MessageRecipient.
+# Mặc định chạy trên 1 file SQLite tạm; --database-url để đo trên MySQL (nên dùng DB riêng).
+#
+#   python -m services.message_bench -n 2000
+#   python -m services.message_bench --database-url mysql+pymysql://root:@localhost/secure_chat_bench
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+
+def _setup(db, sizes):
+    """Tạo max(sizes) tài khoản và 1 chat cho mỗi kích thước; trả về {size: (chat_id, member_ids)}."""
+    from sqlalchemy import insert
+    from models import Account, Chat, ChatMember
+
+    start = (db.session.query(db.func.max(Account.id)).scalar() or 0) + 1
+    count = max(sizes)
+    db.session.execute(insert(Account), [
+        {"username": f"bench_{start + i}", "password_hash": "-", "public_key": "-"} for i in range(count)
+    ])
+    account_ids = [aid for (aid,) in db.session.query(Account.id).filter(Account.id >= start).order_by(Account.id)]
+
+    chats = {}
+    for size in sizes:
+        chat = Chat(name=f"bench {size}", is_group=size > 2)
+        db.session.add(chat)
+        db.session.flush()
+        members = account_ids[:size]
+        db.session.execute(insert(ChatMember), [{"chat_id": chat.id, "account_id": mid} for mid in members])
+        chats[size] = (chat.id, members)
+    db.session.commit()
+    return chats
+
+
+def _run(app, chat_id, member_ids, n, fanout, sender_key, quiet=False):
+    from services.message_service import create_message
+    from services.wire_bench import sample_message
+
+    app.config["MESSAGE_RECIPIENT_FANOUT"] = fanout
+    msg = sample_message(len(member_ids), sender_key=sender_key)
+    if not sender_key:
+        msg["aes_key_encrypted"] = {str(mid): wrapped for mid, wrapped in zip(member_ids, msg["aes_key_encrypted"].values())}
+    sender_id = member_ids[0]
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(n):
+        t0 = time.perf_counter()
+        create_message(chat_id, sender_id, msg["content"], msg["aes_key_encrypted"], msg["iv"], msg["tag"], member_ids=member_ids)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    total = time.perf_counter() - start
+    if quiet:
+        return
+    latencies.sort()
+    print(
+        f"{len(member_ids):>4} members  fanout={'on ' if fanout else 'off'}  {n / total:>8,.0f} sends/s  "
+        f"mean={statistics.mean(latencies):.2f}ms  p50={latencies[len(latencies) // 2]:.2f}ms  "
+        f"p99={latencies[int(len(latencies) * 0.99) - 1]:.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark message_service.create_message by chat size")
+    parser.add_argument("-n", type=int, default=1000, help="Số tin mỗi cấu hình")
+    parser.add_argument("--sizes", default="2,50,500", help="Số thành viên, cách nhau bởi dấu phẩy")
+    parser.add_argument("--database-url", help="Mặc định: file SQLite tạm")
+    parser.add_argument("--sender-key", action="store_true", help="Tin dạng {sk, n} thay vì khóa wrap cho từng thành viên")
+    args = parser.parse_args()
+    sizes = sorted({int(s) for s in args.sizes.split(",")})
+
+    tmp_dir = None
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        tmp_dir = tempfile.TemporaryDirectory()
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir.name, 'bench.db')}"
+
+    # Config đọc DATABASE_URL lúc import, nên chỉ import app sau khi đã đặt biến môi trường
+    from app import create_app, db
+    app = create_app()
+    with app.app_context():
+        chats = _setup(db, sizes)
+        _run(app, *chats[sizes[0]], min(args.n, 50), False, args.sender_key, quiet=True) # làm nóng
+        print(f"database: {db.engine.url.render_as_string(hide_password=True)}")
+        for size in sizes:
+            chat_id, member_ids = chats[size]
+            for fanout in (False, True):
+                _run(app, chat_id, member_ids, args.n, fanout, args.sender_key)
+        db.engine.dispose()
+
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# services/message_key_cache.py
+# Cache khóa AES đã unwrap của tin nhắn, theo SHA-256 của khóa RSA-wrapped.
+# Mở lại 1 chat đã xem không cần thêm phép RSA nào (mỗi phép ~1-2 ms).
+# Có thể lưu xuống file, mã hóa AES-GCM bằng khóa dẫn xuất lúc đăng nhập.
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from services import crypto_client
+
+logger = logging.getLogger(__name__)
+
+
+def derive_storage_key(private_key_pem):
+    """Khóa 32 byte để mã hóa file cache, dẫn xuất từ private key (chỉ có sau khi đăng nhập)."""
+    return hmac.new(private_key_pem.encode("utf-8"), b"securechat/message-key-cache", hashlib.sha256).digest()
+
+
+class MessageKeyCache:
+    """
+    LRU {sha256(wrapped_key): aes_key}, giới hạn max_entries.
+    path + storage_key: nạp lúc tạo, save() ghi lại (thường gọi khi đăng xuất / đóng app).
+    """
+
+    def __init__(self, max_entries=50000, path=None, storage_key=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.storage_key = storage_key
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    @staticmethod
+    def digest(wrapped_key_b64):
+        return hashlib.sha256(wrapped_key_b64.encode("utf-8")).hexdigest()
+
+    def get(self, wrapped_key_b64):
+        digest = self.digest(wrapped_key_b64)
+        with self._lock:
+            aes_key = self._entries.get(digest)
+            if aes_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return aes_key
+
+    def put(self, wrapped_key_b64, aes_key):
+        digest = self.digest(wrapped_key_b64)
+        with self._lock:
+            self._entries[digest] = aes_key
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dirty = True
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "entries": len(self._entries)
+            }
+
+    # -----------------------------
+    # Persistence
+    # -----------------------------
+    def _load(self):
+        if not self.path or not self.storage_key or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                enc = json.load(f)
+            plaintext = crypto_client.decrypt_aes_gcm(enc["ciphertext"], self.storage_key, enc["iv"], enc["tag"])
+            entries = json.loads(plaintext)
+        except (OSError, ValueError, KeyError) as e:
+            # File hỏng hoặc của khóa khác -> bỏ qua, cache sẽ tự đầy lại
+            logger.warning("Không đọc được message key cache %s: %s", self.path, e)
+            return
+        self._entries = OrderedDict(
+            (digest, base64.b64decode(key_b64)) for digest, key_b64 in entries[-self.max_entries:]
+        )
+
+    def save(self):
+        if not self.path or not self.storage_key:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            # Danh sách theo thứ tự LRU (cũ -> mới) để nạp lại giữ nguyên thứ tự
+            entries = [(digest, base64.b64encode(key).decode("utf-8")) for digest, key in self._entries.items()]
+            self._dirty = False
+
+        enc = crypto_client.encrypt_aes_gcm(json.dumps(entries), self.storage_key)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(enc, f)
+        os.replace(tmp_path, self.path)
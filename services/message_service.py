@@ -0,0 +1,203 @@
+# services/message_service.py
+# Ghi tin nhắn phía server (dùng chung cho REST và socket server)
+import json
+from flask import current_app
+from datetime import datetime, timedelta
+from sqlalchemy import and_, delete, func, insert, update
+from app import db
+from models import Message, MessageRecipient, ChatMember, UserEvent
+from services import wire_format
+
+
+def _fanout_enabled():
+    return bool(current_app.config.get("MESSAGE_RECIPIENT_FANOUT"))
+
+
+def _storage_columns(content, aes_key_encrypted, iv, tag):
+    """Giá trị các cột nội dung: text (mặc định) hoặc envelope msgpack."""
+    if current_app.config.get("MESSAGE_ENVELOPE_STORAGE"):
+        return {
+            "content": "", "aes_key_encrypted": "", "iv": "", "tag": "",
+            "envelope": wire_format.pack_fields(content, aes_key_encrypted, iv, tag)
+        }
+    if isinstance(aes_key_encrypted, dict):
+        aes_key_encrypted = json.dumps(aes_key_encrypted)
+    return {"content": content, "aes_key_encrypted": aes_key_encrypted, "iv": iv, "tag": tag, "envelope": None}
+
+
+def create_message(chat_id, sender_id, content, aes_key_encrypted, iv, tag, member_ids=None):
+    """
+    Lưu 1 tin nhắn trong đúng 1 transaction.
+    Nếu bật fan-out, recipients được chèn bằng 1 lệnh executemany.
+    - aes_key_encrypted: dict hoặc chuỗi JSON (dict sẽ được json.dumps)
+    - member_ids: danh sách thành viên đã biết (tránh query lại)
+    """
+    message = Message(
+        chat_id=chat_id,
+        sender_id=sender_id,
+        **_storage_columns(content, aes_key_encrypted, iv, tag)
+    )
+    try:
+        db.session.add(message)
+        db.session.flush() # Lấy message.id, chưa commit
+
+        if _fanout_enabled():
+            if member_ids is None:
+                member_ids = [mid for (mid,) in db.session.query(ChatMember.account_id).filter(
+                    ChatMember.chat_id == chat_id
+                ).all()]
+            if member_ids:
+                db.session.execute(
+                    insert(MessageRecipient),
+                    [{"message_id": message.id, "receiver_id": mid} for mid in member_ids]
+                )
+
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return message
+
+
+def insert_messages(records):
+    """
+    Chèn 1 lô tin nhắn đã có sẵn id (server cấp trước) trong 1 transaction.
+    Dùng cho write-behind queue: executemany cho messages và recipients.
+    - records: list dict gồm id, chat_id, sender_id, content,
+      aes_key_encrypted (chuỗi JSON), iv, tag, timestamp (datetime)
+    """
+    if not records:
+        return
+    rows = [{
+        "id": r["id"],
+        "chat_id": r["chat_id"],
+        "sender_id": r["sender_id"],
+        "timestamp": r["timestamp"],
+        **_storage_columns(r["content"], r["aes_key_encrypted"], r["iv"], r["tag"])
+    } for r in records]
+    try:
+        db.session.execute(insert(Message), rows)
+
+        if _fanout_enabled():
+            chat_ids = {r["chat_id"] for r in records}
+            members_by_chat = {cid: [] for cid in chat_ids}
+            for chat_id, account_id in db.session.query(ChatMember.chat_id, ChatMember.account_id).filter(
+                ChatMember.chat_id.in_(chat_ids)
+            ).all():
+                members_by_chat[chat_id].append(account_id)
+            recipient_rows = [
+                {"message_id": r["id"], "receiver_id": mid}
+                for r in records for mid in members_by_chat[r["chat_id"]]
+            ]
+            if recipient_rows:
+                db.session.execute(insert(MessageRecipient), recipient_rows)
+
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def unread_counts(user_id, chat_ids=None):
+    """
+    {chat_id: số tin chưa đọc} theo watermark của user (chỉ đếm tin của người khác).
+    Chat không có tin chưa đọc không xuất hiện trong kết quả. 1 query GROUP BY.
+    """
+    query = db.session.query(Message.chat_id, func.count(Message.id)).join(
+        ChatMember, and_(ChatMember.chat_id == Message.chat_id, ChatMember.account_id == user_id)
+    ).filter(
+        Message.id > ChatMember.last_read_message_id,
+        Message.sender_id != user_id
+    )
+    if chat_ids is not None:
+        query = query.filter(Message.chat_id.in_(chat_ids))
+    return dict(query.group_by(Message.chat_id).all())
+
+
+def record_user_events(account_ids, chat_id, kind, data=None):
+    """Thêm event cho GET /sync vào session hiện tại (người gọi commit cùng thay đổi gốc)."""
+    payload = json.dumps(data) if data is not None else None
+    rows = [{"account_id": aid, "chat_id": chat_id, "kind": kind, "data": payload} for aid in account_ids]
+    if rows:
+        db.session.execute(insert(UserEvent), rows)
+
+
+def parse_message_id(value):
+    """
+    id tin nhắn client gửi lên (số nguyên hoặc chuỗi số, >= 0) -> int.
+    ValueError nếu không hợp lệ: người gọi trả 400 (REST) hoặc emit "error" (socket).
+    """
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+        return value
+    raise ValueError(f"Invalid message id: {value!r}")
+
+
+def advance_read_watermark(chat_id, user_id, up_to_message_id=None):
+    """
+    Dời watermark đã đọc của user trong chat tới up_to_message_id (mặc định: tin mới nhất).
+    Watermark chỉ tiến, không lùi. Trả về up_to_message_id đã dùng.
+    ValueError (trước khi chạm DB) nếu up_to_message_id không hợp lệ, xem parse_message_id.
+    """
+    if up_to_message_id is None:
+        up_to_message_id = db.session.query(func.max(Message.id)).filter(
+            Message.chat_id == chat_id
+        ).scalar() or 0
+    up_to_message_id = parse_message_id(up_to_message_id)
+
+    advanced = db.session.execute(
+        update(ChatMember).where(
+            ChatMember.chat_id == chat_id,
+            ChatMember.account_id == user_id,
+            ChatMember.last_read_message_id < up_to_message_id
+        ).values(last_read_message_id=up_to_message_id)
+    ).rowcount
+    # Thiết bị khác của user nhận thay đổi này qua GET /sync. Chỉ giữ 1 event "read" mới nhất
+    # cho mỗi (user, chat): xóa dòng cũ rồi chèn dòng mới để id vượt qua cursor của các thiết bị.
+    if advanced:
+        db.session.execute(
+            delete(UserEvent).where(
+                UserEvent.account_id == user_id,
+                UserEvent.chat_id == chat_id,
+                UserEvent.kind == "read"
+            )
+        )
+        record_user_events([user_id], chat_id, "read", {"last_read_message_id": up_to_message_id})
+
+    # Giữ read_at của MessageRecipient đồng bộ khi fan-out đang bật
+    if _fanout_enabled():
+        db.session.execute(
+            update(MessageRecipient).where(
+                MessageRecipient.message_id == Message.id,
+                Message.chat_id == chat_id,
+                Message.id <= up_to_message_id,
+                MessageRecipient.receiver_id == user_id,
+                MessageRecipient.read_at == None,
+                Message.sender_id != user_id
+            ).values(read_at=datetime.utcnow())
+        )
+
+    db.session.commit()
+    return up_to_message_id
+
+
+def prune_user_events(retention_days, batch_size=1000):
+    """
+    Xóa user_events cũ hơn retention_days theo lô (từ id nhỏ nhất), trả về số dòng đã xóa.
+    id tăng theo thời gian nên dừng ngay ở dòng đầu tiên còn trong hạn, không quét cả bảng.
+    Cursor của GET /sync cũ hơn hạn này bị từ chối (410), client tải lại danh sách chat.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    removed = 0
+    while True:
+        rows = db.session.query(UserEvent.id, UserEvent.created_at).order_by(
+            UserEvent.id.asc()
+        ).limit(batch_size).all()
+        expired = [event_id for event_id, created_at in rows if created_at is not None and created_at < cutoff]
+        if expired:
+            db.session.execute(delete(UserEvent).where(UserEvent.id.in_(expired)))
+        db.session.commit()
+        removed += len(expired)
+        if len(expired) < batch_size:
+            return removed
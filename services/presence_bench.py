@@ -0,0 +1,128 @@
+# services/presence_bench.py
+# Nhiều socket worker (mỗi worker 1 process) cùng connect / disconnect các sid của
+# một nhóm user chung trên cùng 1 presence backend, đo ops/giây rồi kiểm tra trạng thái
+# cuối khớp với số sid còn mở thực tế (user còn sid <-> online).
+#
+#   python -m services.presence_bench                    # LocalBackend dùng chung qua multiprocessing.Manager
+#   python -m services.presence_bench --url redis://localhost:6379/15 --workers 4
+#
+# Với Redis: dùng DB riêng, bench ghi vào các key presence:* của user id >= 900000.
+import argparse
+import multiprocessing
+import random
+import time
+from multiprocessing.managers import BaseManager
+
+from services.socket_backend import LocalBackend, create_backend
+
+USER_ID_BASE = 900_000
+
+
+class _SharedManager(BaseManager):
+    pass
+
+_SharedManager.register("LocalBackend", LocalBackend)
+
+
+def _worker(index, url, shared, users, ops, seed, results):
+    backend = shared if shared is not None else create_backend(url, worker_id=f"presence-bench-{index}")
+    rng = random.Random(seed)
+    open_sids = {} # sid -> user_id
+    errors = 0
+    start = time.perf_counter()
+    for i in range(ops):
+        if open_sids and rng.random() < 0.5:
+            sid = rng.choice(list(open_sids))
+            user_id, _ = backend.remove_connection(sid)
+            if user_id != open_sids.pop(sid):
+                errors += 1
+        else:
+            sid = f"bench-{index}-{i}"
+            user_id = rng.choice(users)
+            backend.add_connection(user_id, sid)
+            open_sids[sid] = user_id
+    results.put((index, time.perf_counter() - start, open_sids, errors))
+
+
+def _check(backend, users, open_sids):
+    """Danh sách lỗi: user online/offline sai, sid trỏ sai user."""
+    problems = []
+    connected = set(open_sids.values())
+    for user_id in users:
+        if backend.is_online(user_id) != (user_id in connected):
+            problems.append(f"user {user_id}: online={backend.is_online(user_id)}, open sids={user_id in connected}")
+    for sid, user_id in open_sids.items():
+        if backend.user_for_sid(sid) != user_id:
+            problems.append(f"sid {sid}: user {backend.user_for_sid(sid)} != {user_id}")
+    return problems
+
+
+def _check_crash_cleanup(url, users):
+    """Worker crash để lại sid; khởi động lại với cùng worker id phải dọn sạch."""
+    crashed = create_backend(url, worker_id="presence-bench-crash")
+    for i, user_id in enumerate(users):
+        crashed.add_connection(user_id, f"crash-{i}")
+    del crashed # Không remove_connection: giả lập process chết
+    restarted = create_backend(url, worker_id="presence-bench-crash")
+    return [f"user {uid} still online after restart" for uid in users if restarted.is_online(uid)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-process presence consistency check + throughput")
+    parser.add_argument("--url", default="memory://", help="memory:// hoặc redis://...")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--ops", type=int, default=20_000, help="Số connect/disconnect mỗi worker")
+    args = parser.parse_args()
+
+    users = list(range(USER_ID_BASE, USER_ID_BASE + args.users))
+    manager = None
+    if args.url.startswith("memory://"):
+        manager = _SharedManager()
+        manager.start()
+        shared = manager.LocalBackend()
+        backend = shared
+    else:
+        shared = None
+        backend = create_backend(args.url, worker_id="presence-bench-main")
+        for user_id in users:
+            if backend.is_online(user_id):
+                raise SystemExit(f"user {user_id} already online: use an empty Redis DB")
+
+    results = multiprocessing.Queue()
+    procs = [
+        multiprocessing.Process(target=_worker, args=(i, args.url, shared, users, args.ops, i, results))
+        for i in range(args.workers)
+    ]
+    for p in procs: p.start()
+    finished = [results.get() for _ in procs]
+    for p in procs: p.join()
+
+    open_sids, errors, slowest = {}, 0, 0.0
+    for index, elapsed, sids, worker_errors in sorted(finished, key=lambda r: r[0]):
+        print(f"worker {index}: {args.ops / elapsed:,.0f} ops/s")
+        open_sids.update(sids)
+        errors += worker_errors
+        slowest = max(slowest, elapsed)
+    print(f"total   : {args.workers * args.ops / slowest:,.0f} ops/s ({args.workers} workers, {args.users} users)")
+
+    problems = _check(backend, users, open_sids)
+    if errors:
+        problems.append(f"{errors} remove_connection calls returned the wrong user")
+    # Đóng hết các sid còn mở: mọi user phải offline
+    for sid in open_sids:
+        backend.remove_connection(sid)
+    problems += _check(backend, users, {})
+    if shared is None:
+        problems += _check_crash_cleanup(args.url, users)
+
+    if manager is not None:
+        manager.shutdown()
+    if problems:
+        print("\n".join(problems[:20]))
+        raise SystemExit(f"FAILED: {len(problems)} inconsistencies")
+    print("OK: presence consistent across workers")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# services/profile_cache.py
+# Cache profile user phía client, dùng chung cho sidebar, InfoPanel và ProfilePage.
+# Hết hạn theo TTL, bị xoá khi server gửi sự kiện socket "profile_updated".
+import threading
+import time
+
+from services import api_client
+
+MAX_BATCH_IDS = 500
+
+
+class ProfileCache:
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {} # user_id -> (profile, expires_at)
+
+    def get(self, token, user_id):
+        """Trả về profile (dict) hoặc None nếu không tải được."""
+        return self.get_many(token, [user_id]).get(user_id)
+
+    def get_many(self, token, user_ids):
+        """Trả về {user_id: profile}; các user chưa có / hết hạn được tải bằng POST /users/batch."""
+        now = time.monotonic()
+        result = {}
+        missing = []
+        with self._lock:
+            for uid in user_ids:
+                entry = self._entries.get(uid)
+                if entry and entry[1] > now:
+                    result[uid] = entry[0]
+                else:
+                    missing.append(uid)
+
+        for i in range(0, len(missing), MAX_BATCH_IDS):
+            status, data = api_client.get_users_batch(token, missing[i:i + MAX_BATCH_IDS])
+            if status != 200:
+                continue
+            expires_at = time.monotonic() + self.ttl
+            with self._lock:
+                for uid, profile in data.items():
+                    self._entries[int(uid)] = (profile, expires_at)
+                    result[int(uid)] = profile
+        return result
+
+    def peek(self, user_id):
+        """Đọc cache không gọi mạng (kể cả bản đã hết hạn); None nếu chưa có."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            return entry[0] if entry else None
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+profile_cache = ProfileCache()
@@ -0,0 +1,174 @@
+# services/sender_keys.py
+# Chế độ sender key: mỗi người gửi có 1 chain key cho mỗi chat, RSA-wrap cho các
+# thành viên 1 lần duy nhất, sau đó mỗi tin chỉ cần 2 phép HMAC + AES-GCM.
+# aes_key_encrypted của tin = {"sk": key_id, "n": chỉ số} (kích thước cố định).
+#
+#   chain_{n+1} = HMAC-SHA256(chain_n, 0x02)
+#   message_key_n = HMAC-SHA256(chain_n, 0x01)
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+from Crypto.Random import get_random_bytes
+
+from services import api_client, crypto_client
+
+# off: luôn wrap theo từng thành viên | group: chỉ chat nhóm | all: mọi chat
+MODE = os.getenv("SECURECHAT_SENDER_KEYS", "group")
+# Sau số tin này người gửi tạo chain key mới (giới hạn bộ nhớ ratchet phía người nhận)
+MAX_MESSAGES_PER_KEY = 1000
+MAX_BATCH_IDS = 500
+# Key server không trả về / không unwrap được: không hỏi lại trong khoảng này (giây).
+# Ngắn, vì lý do thường là tạm thời (key vừa tạo, thành viên đang thay đổi).
+UNAVAILABLE_TTL = 30
+
+
+class _Chain:
+    """Ratchet của 1 sender key; giữ các chain key đã tính để giải tin theo thứ tự bất kỳ."""
+
+    def __init__(self, owner_id, chat_id, chain_key):
+        self.owner_id = owner_id
+        self.chat_id = chat_id
+        self.chain_keys = [chain_key]
+
+    def message_key(self, n):
+        if not 0 <= n < MAX_MESSAGES_PER_KEY:
+            raise ValueError(f"Sender key index out of range: {n}")
+        while len(self.chain_keys) <= n:
+            self.chain_keys.append(hmac.new(self.chain_keys[-1], b"\x02", hashlib.sha256).digest())
+        return hmac.new(self.chain_keys[n], b"\x01", hashlib.sha256).digest()
+
+
+class SenderKeyStore:
+    """
+    Giữ sender key của user hiện tại (để gửi) và của người khác (để nhận) trong bộ nhớ.
+    Key gửi đi không lưu xuống đĩa: sau khi mở lại app, tin đầu tiên ở mỗi chat tạo key mới.
+    Thành viên chat thay đổi -> tạo key mới (người đã rời nhóm không đọc được tin sau đó).
+    """
+
+    def __init__(self, token, user_id, private_key):
+        self.token = token
+        self.user_id = user_id
+        self.private_key = private_key # RSA key đã parse (DecryptionEngine.private_key)
+        self._lock = threading.Lock()
+        self._chains = {}   # key_id -> _Chain
+        self._unavailable = {} # key_id -> thời điểm hết hạn (server không trả về / unwrap lỗi)
+        self._outgoing = {} # chat_id -> {"key_id", "n", "members"}
+        self._creating = {} # chat_id -> threading.Event, đang tạo key mới (ngoài lock)
+
+    def enabled_for(self, chat):
+        return MODE == "all" or (MODE == "group" and bool(chat.get("is_group")))
+
+    # -----------------------------
+    # Gửi
+    # -----------------------------
+    def next_message_key(self, chat, load_public_keys):
+        """
+        Trả về (key_id, n, message_key) cho tin tiếp theo trong chat.
+        load_public_keys(): {member_id: public key}, chỉ được gọi khi cần tạo key mới.
+        Tạo key mới (HTTP + RSA-wrap cho từng thành viên) chạy ngoài self._lock, để việc giải mã
+        tin đến không phải chờ; mỗi chat chỉ 1 lượt tạo tại 1 thời điểm, các lượt gửi khác chờ kết quả.
+        """
+        chat_id = chat["chat_id"]
+        members = frozenset(chat["members"])
+        while True:
+            with self._lock:
+                state = self._outgoing.get(chat_id)
+                if state is not None and state["members"] == members and state["n"] < MAX_MESSAGES_PER_KEY:
+                    n = state["n"]
+                    state["n"] += 1
+                    return state["key_id"], n, self._chains[state["key_id"]].message_key(n)
+                creating = self._creating.get(chat_id)
+                if creating is None:
+                    creating = self._creating[chat_id] = threading.Event()
+                    break
+            creating.wait() # Lượt khác đang tạo key cho chat này (lỗi -> thử lại ở vòng sau)
+
+        try:
+            key_id, chain_key = self._create(chat_id, members, load_public_keys())
+            with self._lock:
+                self._chains[key_id] = _Chain(self.user_id, chat_id, chain_key)
+                self._outgoing[chat_id] = {"key_id": key_id, "n": 1, "members": members}
+                return key_id, 0, self._chains[key_id].message_key(0)
+        finally:
+            with self._lock:
+                del self._creating[chat_id]
+            creating.set()
+
+    def _create(self, chat_id, members, public_keys):
+        """Tạo chain key, wrap cho mọi thành viên và đăng ký lên server; trả về (key_id, chain_key)."""
+        # Server từ chối bộ khóa thiếu thành viên: người bị thiếu sẽ không đọc được tin nào
+        missing = sorted(mid for mid in members if public_keys.get(mid) is None)
+        if missing:
+            raise RuntimeError(f"Không có public key của thành viên {missing}")
+        chain_key = get_random_bytes(32)
+        wrapped_keys = {str(mid): crypto_client.wrap_aes_key(chain_key, public_keys[mid]) for mid in members}
+        status, data = api_client.create_sender_key(self.token, chat_id, wrapped_keys)
+        if status != 201:
+            raise RuntimeError(f"Không tạo được sender key: {data.get('msg')}")
+        return data["key_id"], chain_key
+
+    # -----------------------------
+    # Nhận
+    # -----------------------------
+    def _is_unavailable(self, key_id, now):
+        """Gọi khi đang giữ self._lock."""
+        expires = self._unavailable.get(key_id)
+        if expires is None:
+            return False
+        if expires <= now:
+            del self._unavailable[key_id]
+            return False
+        return True
+
+    def prefetch(self, key_ids):
+        """Tải (1 request / 500 key) và unwrap các sender key chưa có."""
+        ids = set()
+        for kid in key_ids:
+            try:
+                ids.add(int(kid))
+            except (TypeError, ValueError):
+                pass
+        now = time.monotonic()
+        with self._lock:
+            missing = sorted(kid for kid in ids - self._chains.keys() if not self._is_unavailable(kid, now))
+        for i in range(0, len(missing), MAX_BATCH_IDS):
+            chunk = missing[i:i + MAX_BATCH_IDS]
+            status, data = api_client.get_sender_keys(self.token, chunk)
+            if status != 200:
+                continue
+            failed = {kid for kid in chunk if str(kid) not in data}
+            for key_id, info in data.items():
+                try:
+                    chain_key = crypto_client.unwrap_aes_key(info["wrapped_key"], self.private_key)
+                except (KeyError, ValueError):
+                    failed.add(int(key_id))
+                    continue
+                with self._lock:
+                    self._chains.setdefault(int(key_id), _Chain(info["owner_id"], info.get("chat_id"), chain_key))
+            expires = time.monotonic() + UNAVAILABLE_TTL
+            with self._lock:
+                self._unavailable.update((kid, expires) for kid in failed)
+
+    def message_key(self, ref, sender_id, chat_id):
+        """
+        Khóa AES của tin {"sk", "n"} do sender_id gửi trong chat_id.
+        None nếu không có key, hoặc key không phải của sender_id / của chat này.
+        """
+        try:
+            key_id, n, chat_id = int(ref["sk"]), int(ref["n"]), int(chat_id)
+        except (KeyError, TypeError, ValueError):
+            return None
+        if key_id not in self._chains:
+            self.prefetch([key_id])
+        with self._lock:
+            chain = self._chains.get(key_id)
+            # Chống giả mạo: key phải thuộc đúng người gửi và đúng chat của tin
+            if chain is None or chain.owner_id != sender_id or chain.chat_id != chat_id:
+                return None
+            try:
+                return chain.message_key(n)
+            except ValueError:
+                return None
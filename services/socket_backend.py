@@ -0,0 +1,238 @@
+# services/socket_backend.py
+# Trạng thái dùng chung giữa các socket worker (presence: user_id <-> sid,
+# bộ đếm tin chưa đọc của user đang online).
+# - LocalBackend: trong bộ nhớ 1 process (mặc định, dùng cho dev/test)
+# - RedisBackend: chia sẻ giữa N worker sau load balancer (cần cài `redis`)
+import threading
+
+# Xoá 1 sid và (nếu là sid cuối của user) đánh dấu offline trong cùng 1 bước nguyên tử,
+# để add_connection của worker khác không chen vào giữa lúc đếm và lúc SREM.
+# KEYS: presence:sids, presence:worker:<id>, presence:online; ARGV: sid
+_REMOVE_CONNECTION_LUA = """
+local user_id = redis.call('HGET', KEYS[1], ARGV[1])
+if not user_id then
+    return false
+end
+local user_key = 'presence:user:' .. user_id
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('SREM', KEYS[2], ARGV[1])
+redis.call('SREM', user_key, ARGV[1])
+if redis.call('SCARD', user_key) == 0 then
+    redis.call('SREM', KEYS[3], user_id)
+    return {user_id, 1}
+end
+return {user_id, 0}
+"""
+
+
+class LocalBackend:
+    """Presence trong bộ nhớ của 1 process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sid_user = {}
+        self._user_sids = {}
+        self._seqs = {}
+        self._unread = {} # user_id -> {chat_id: số tin chưa đọc}
+
+    def add_connection(self, user_id, sid):
+        """Ghi nhận kết nối. Trả về True nếu user vừa chuyển sang online."""
+        with self._lock:
+            self._sid_user[sid] = user_id
+            sids = self._user_sids.setdefault(user_id, set())
+            sids.add(sid)
+            return len(sids) == 1
+
+    def remove_connection(self, sid):
+        """Xoá kết nối. Trả về (user_id, went_offline)."""
+        with self._lock:
+            user_id = self._sid_user.pop(sid, None)
+            if user_id is None:
+                return None, False
+            sids = self._user_sids.get(user_id, set())
+            sids.discard(sid)
+            if not sids:
+                self._user_sids.pop(user_id, None)
+                return user_id, True
+            return user_id, False
+
+    def user_for_sid(self, sid):
+        with self._lock:
+            return self._sid_user.get(sid)
+
+    def is_online(self, user_id):
+        with self._lock:
+            return user_id in self._user_sids
+
+    def online_users(self):
+        with self._lock:
+            return list(self._user_sids.keys())
+
+    def next_seq(self, user_id):
+        """Tăng và trả về số thứ tự sự kiện presence gửi tới user_id."""
+        with self._lock:
+            seq = self._seqs.get(user_id, 0) + 1
+            self._seqs[user_id] = seq
+            return seq
+
+    def current_seq(self, user_id):
+        with self._lock:
+            return self._seqs.get(user_id, 0)
+
+    # Bộ đếm chưa đọc: chỉ tồn tại từ lúc seed (connect) tới lúc user offline
+    def has_unread(self, user_id):
+        with self._lock:
+            return user_id in self._unread
+
+    def seed_unread(self, user_id, counts):
+        with self._lock:
+            self._unread.setdefault(user_id, dict(counts))
+
+    def incr_unread(self, user_id, chat_id):
+        """Tăng bộ đếm; trả về giá trị mới, hoặc None nếu user chưa được seed."""
+        with self._lock:
+            counts = self._unread.get(user_id)
+            if counts is None:
+                return None
+            counts[chat_id] = counts.get(chat_id, 0) + 1
+            return counts[chat_id]
+
+    def incr_unread_many(self, user_ids, chat_id):
+        """Tăng bộ đếm của nhiều user; trả về {user_id: giá trị mới} của các user đã được seed."""
+        result = {}
+        with self._lock:
+            for user_id in user_ids:
+                counts = self._unread.get(user_id)
+                if counts is not None:
+                    counts[chat_id] = counts.get(chat_id, 0) + 1
+                    result[user_id] = counts[chat_id]
+        return result
+
+    def set_unread(self, user_id, chat_id, count):
+        with self._lock:
+            counts = self._unread.get(user_id)
+            if counts is not None:
+                counts[chat_id] = count
+
+    def drop_unread(self, user_id):
+        with self._lock:
+            self._unread.pop(user_id, None)
+
+    def claim(self, name, ttl=60):
+        """1 process: mọi thông báo chỉ đến 1 lần, luôn được xử lý."""
+        return True
+
+
+class RedisBackend:
+    """
+    Presence lưu trên Redis để mọi worker thấy cùng một danh sách online.
+    Mỗi worker có worker_id riêng và CỐ ĐỊNH qua các lần khởi động lại (SOCKET_WORKER_ID);
+    khi khởi động, các sid cũ của chính worker (do crash trước đó) được dọn sạch.
+    """
+
+    def __init__(self, url, worker_id=None):
+        if not worker_id:
+            # Id đổi mỗi lần chạy (vd. hostname:pid) thì sid của worker đã crash không bao giờ được dọn
+            raise ValueError("RedisBackend requires a stable worker id (set SOCKET_WORKER_ID)")
+        import redis  # Phụ thuộc tuỳ chọn, chỉ cần khi chạy nhiều worker
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self.worker_id = worker_id
+        self._remove_script = self._redis.register_script(_REMOVE_CONNECTION_LUA)
+        self._cleanup_worker()
+
+    def _worker_key(self):
+        return f"presence:worker:{self.worker_id}"
+
+    def _cleanup_worker(self):
+        for sid in self._redis.smembers(self._worker_key()):
+            self.remove_connection(sid)
+        self._redis.delete(self._worker_key())
+
+    def add_connection(self, user_id, sid):
+        pipe = self._redis.pipeline()
+        pipe.hset("presence:sids", sid, user_id)
+        pipe.sadd(self._worker_key(), sid)
+        pipe.sadd(f"presence:user:{user_id}", sid)
+        pipe.scard(f"presence:user:{user_id}")
+        pipe.sadd("presence:online", user_id)
+        count = pipe.execute()[3]
+        return count == 1
+
+    def remove_connection(self, sid):
+        result = self._remove_script(keys=["presence:sids", self._worker_key(), "presence:online"], args=[sid])
+        if not result:
+            return None, False
+        user_id, went_offline = result
+        return int(user_id), bool(int(went_offline))
+
+    def user_for_sid(self, sid):
+        user_id = self._redis.hget("presence:sids", sid)
+        return int(user_id) if user_id is not None else None
+
+    def is_online(self, user_id):
+        return bool(self._redis.sismember("presence:online", user_id))
+
+    def online_users(self):
+        return [int(uid) for uid in self._redis.smembers("presence:online")]
+
+    def next_seq(self, user_id):
+        return int(self._redis.incr(f"presence:seq:{user_id}"))
+
+    def current_seq(self, user_id):
+        return int(self._redis.get(f"presence:seq:{user_id}") or 0)
+
+    # Bộ đếm chưa đọc: hash unread:<user_id> {chat_id: n}, trường "_seeded" đánh dấu đã seed
+    def has_unread(self, user_id):
+        return bool(self._redis.hexists(f"unread:{user_id}", "_seeded"))
+
+    def seed_unread(self, user_id, counts):
+        key = f"unread:{user_id}"
+        if self._redis.hsetnx(key, "_seeded", 1) and counts:
+            self._redis.hset(key, mapping={str(cid): n for cid, n in counts.items()})
+
+    def incr_unread(self, user_id, chat_id):
+        key = f"unread:{user_id}"
+        if not self._redis.hexists(key, "_seeded"):
+            return None
+        return int(self._redis.hincrby(key, str(chat_id), 1))
+
+    def incr_unread_many(self, user_ids, chat_id):
+        """
+        Như incr_unread cho cả nhóm với 2 round trip cố định (1 pipeline HEXISTS, 1 pipeline HINCRBY)
+        thay vì 2 round trip cho mỗi thành viên.
+        """
+        user_ids = list(user_ids)
+        pipe = self._redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.hexists(f"unread:{user_id}", "_seeded")
+        seeded = [uid for uid, exists in zip(user_ids, pipe.execute()) if exists]
+        if not seeded:
+            return {}
+        pipe = self._redis.pipeline(transaction=False)
+        for user_id in seeded:
+            pipe.hincrby(f"unread:{user_id}", str(chat_id), 1)
+        return {uid: int(n) for uid, n in zip(seeded, pipe.execute())}
+
+    def set_unread(self, user_id, chat_id, count):
+        key = f"unread:{user_id}"
+        if self._redis.hexists(key, "_seeded"):
+            self._redis.hset(key, str(chat_id), count)
+
+    def drop_unread(self, user_id):
+        self._redis.delete(f"unread:{user_id}")
+
+    def claim(self, name, ttl=60):
+        """
+        Thông báo qua kênh Redis đến mọi worker: chỉ worker SET NX thành công xử lý
+        (bộ đếm dùng chung, xử lý N lần sẽ tăng N lần).
+        """
+        return bool(self._redis.set(f"notify:claim:{name}", self.worker_id, nx=True, ex=ttl))
+
+
+def create_backend(url=None, worker_id=None):
+    """url rỗng hoặc 'memory://' -> LocalBackend, 'redis://...' -> RedisBackend."""
+    if not url or url.startswith("memory://"):
+        return LocalBackend()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url, worker_id=worker_id)
+    raise ValueError(f"Unsupported socket backend URL: {url}")
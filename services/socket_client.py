@@ -1,23 +1,115 @@
-from flask import Flask, request
+# Async backend phải được monkey patch trước mọi import khác
+from services.async_backend import ASYNC_MODE, monkey_patch, server_options
+monkey_patch()
+
+from flask import Flask, request, abort
 from flask_socketio import SocketIO, emit, join_room
+from services import wire_format
 from flask_jwt_extended import decode_token
 from app import create_app, db
 from models import Chat, ChatMember, Message, MessageRecipient
+from services.message_service import advance_read_watermark, create_message, parse_message_id, prune_user_events, unread_counts
+from services.write_behind import WriteBehindQueue
+from services.socket_backend import create_backend
+from services.membership_cache import membership_cache
+from services import socket_notify
+import atexit
+import hmac
 import json
 import logging
 
 flask_app = create_app()
-socketio = SocketIO(flask_app, cors_allowed_origins="*", async_mode="threading")
-connected_users = {}
+socketio = SocketIO(
+    flask_app, cors_allowed_origins="*", async_mode=ASYNC_MODE,
+    message_queue=flask_app.config["SOCKET_MESSAGE_QUEUE"]
+)
+# Presence dùng chung giữa các worker (LocalBackend khi chạy 1 process)
+presence = create_backend(flask_app.config["SOCKET_PRESENCE_URL"], flask_app.config["SOCKET_WORKER_ID"])
+
+write_behind = None
+if flask_app.config.get("SOCKET_WRITE_BEHIND"):
+    if flask_app.config["SOCKET_MESSAGE_QUEUE"]:
+        raise RuntimeError("SOCKET_WRITE_BEHIND requires a single socket worker (unset SOCKET_MESSAGE_QUEUE)")
+    write_behind = WriteBehindQueue(
+        flask_app, flask_app.config["WRITE_BEHIND_LOG"], flask_app.config["WRITE_BEHIND_DEAD_LETTER"]
+    )
+    write_behind.start()
+    atexit.register(write_behind.stop)
+
+# sid đã thoả thuận envelope nhị phân (mỗi sid chỉ sống trên 1 worker nên giữ cục bộ)
+binary_sids = set()
+
+def chat_room(chat_id, binary=False):
+    """Mỗi chat có 1 room cho mỗi định dạng, để mỗi tin chỉ encode 1 lần / định dạng."""
+    return f"chat_{chat_id}:bin" if binary else f"chat_{chat_id}"
 
 def get_user_id_from_token(token):
     try:
         return int(decode_token(token)["sub"])
     except: return None
 
-def broadcast_online_users():
-    users = list(connected_users.keys())
-    socketio.emit("online_users", users)
+def get_chat_peers(user_id):
+    """Những user có chung ít nhất 1 chat với user_id (từ membership cache, không query mỗi lần)."""
+    return membership_cache.chat_peers(user_id)
+
+def parse_chat_id(value):
+    """chat_id trong payload của client -> int (số nguyên hoặc chuỗi số, > 0); None nếu không hợp lệ."""
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, int) and not isinstance(value, bool) and value > 0:
+        return value
+    return None
+
+def send_presence_snapshot(user_id, sid):
+    """
+    Gửi danh sách online (1 lần khi connect hoặc khi client yêu cầu resync).
+    Cùng phạm vi với delta: chỉ các user có chung chat, vì người ngoài phạm vi này
+    không bao giờ nhận được presence_left tương ứng.
+    """
+    socketio.emit("online_users", {
+        "users": [uid for uid in get_chat_peers(user_id) if presence.is_online(uid)],
+        "seq": presence.current_seq(user_id)
+    }, to=sid)
+
+def refresh_presence(user_ids):
+    """
+    Gửi lại snapshot presence tới mọi kết nối của các user online trong user_ids
+    (phạm vi "có chung chat" của họ vừa đổi). Danh sách online đọc 1 lần cho cả nhóm.
+    """
+    online = set(presence.online_users())
+    for user_id in user_ids:
+        if user_id not in online:
+            continue
+        socketio.emit("online_users", {
+            "users": [uid for uid in get_chat_peers(user_id) if uid in online],
+            "seq": presence.current_seq(user_id)
+        }, to=f"user_{user_id}")
+
+def broadcast_presence_delta(event, user_id):
+    """Gửi presence_joined / presence_left chỉ tới các user online có chung chat."""
+    for peer_id in get_chat_peers(user_id):
+        if not presence.is_online(peer_id):
+            continue
+        socketio.emit(event, {
+            "user_id": user_id,
+            "seq": presence.next_seq(peer_id)
+        }, to=f"user_{peer_id}")
+
+def broadcast_chat_summaries(chat_id, sender_id, message_id, member_ids):
+    """
+    Đẩy chat_summary (chat_id, name, unread, last_message_id) tới từng thành viên online
+    (trừ người gửi), để sidebar cập nhật mà không cần gọi REST.
+    """
+    info = membership_cache.chat_info(chat_id)
+    # Thành viên offline không có trong kết quả: bộ đếm sẽ được seed lại từ DB khi connect
+    counts = presence.incr_unread_many([mid for mid in member_ids if mid != sender_id], chat_id)
+    for member_id, unread in counts.items():
+        socketio.emit("chat_summary", {
+            "chat_id": chat_id,
+            "name": info["name"] if info["is_group"] else membership_cache.display_name(sender_id),
+            "unread": unread,
+            "last_message_id": message_id
+        }, to=f"user_{member_id}")
 
 @socketio.on("connect")
 def handle_connect(auth):
@@ -25,28 +117,63 @@ def handle_connect(auth):
     if not token: return False
     user_id = get_user_id_from_token(token)
     if not user_id: return False
-    connected_users[user_id] = request.sid
-    broadcast_online_users()
+    went_online = presence.add_connection(user_id, request.sid)
+    join_room(f"user_{user_id}")
+    # Seed bộ đếm chưa đọc từ DB 1 lần; các kết nối sau của cùng user dùng lại
+    if not presence.has_unread(user_id):
+        presence.seed_unread(user_id, unread_counts(user_id))
+    # Client đề nghị định dạng qua auth {"wire": "msgpack"}; server xác nhận bằng sự kiện "wire_format"
+    binary = bool(auth) and auth.get("wire") == wire_format.BINARY and wire_format.AVAILABLE
+    if binary:
+        binary_sids.add(request.sid)
+    emit("wire_format", {"format": wire_format.BINARY if binary else "json"})
+    send_presence_snapshot(user_id, request.sid)
+    if went_online:
+        broadcast_presence_delta("presence_joined", user_id)
     return True
 
 @socketio.on("disconnect")
 def handle_disconnect():
-    sid = request.sid
-    removed = [uid for uid, u_sid in list(connected_users.items()) if u_sid == sid]
-    for uid in removed: connected_users.pop(uid, None)
-    broadcast_online_users()
+    binary_sids.discard(request.sid)
+    user_id, went_offline = presence.remove_connection(request.sid)
+    if went_offline:
+        presence.drop_unread(user_id)
+        broadcast_presence_delta("presence_left", user_id)
+
+@socketio.on("presence_sync")
+def handle_presence_sync(data=None):
+    user_id = presence.user_for_sid(request.sid)
+    if user_id:
+        send_presence_snapshot(user_id, request.sid)
 
 @socketio.on("join_chat")
 def handle_join_chat(data):
-    chat_id = data.get("chat_id")
-    user_id = data.get("user_id")
-    if chat_id and user_id:
-        join_room(f"chat_{chat_id}")
+    chat_id = parse_chat_id(data.get("chat_id"))
+    # Dùng user_id đã xác thực lúc connect, không tin user_id client gửi lên
+    user_id = presence.user_for_sid(request.sid)
+    if not user_id:
+        return
+    if chat_id is None:
+        emit("error", {"msg": "Invalid data"})
+        return
+    if not membership_cache.is_member(chat_id, user_id):
+        emit("error", {"msg": "Not in chat"})
+        return
+    join_room(chat_room(chat_id, request.sid in binary_sids))
 
 @socketio.on("send_message")
 def handle_send_message(data):
-    chat_id = data.get("chat_id")
-    sender_id = data.get("sender_id")
+    if isinstance(data, (bytes, bytearray)):
+        if not wire_format.AVAILABLE:
+            emit("error", {"msg": "Binary messages not supported"})
+            return
+        try:
+            data = wire_format.unpack_message(data)
+        except Exception:
+            emit("error", {"msg": "Invalid data"})
+            return
+    chat_id = parse_chat_id(data.get("chat_id"))
+    sender_id = presence.user_for_sid(request.sid)
     content = data.get("content")
     aes_key_encrypted = data.get("aes_key_encrypted")
     iv = data.get("iv")
@@ -55,40 +182,162 @@ def handle_send_message(data):
     if not all([chat_id, sender_id, content, iv, tag]) or not isinstance(aes_key_encrypted, dict):
         emit("error", {"msg": "Invalid data"})
         return
+    # Chuẩn hoá 1 lần trước khi lưu: dữ liệu hỏng không được vào DB / write-behind
+    # và không làm hỏng bước encode msgpack sau khi đã phát cho room JSON
+    try:
+        content, aes_key_encrypted, iv, tag = wire_format.normalize_payload(content, aes_key_encrypted, iv, tag)
+    except ValueError:
+        emit("error", {"msg": "Invalid data"})
+        return
 
-    # LƯU DB: dict → JSON string
-    message = Message(
-        chat_id=chat_id,
-        sender_id=sender_id,
-        content=content,
-        aes_key_encrypted=json.dumps(aes_key_encrypted),
-        iv=iv,
-        tag=tag
-    )
-    db.session.add(message)
-    db.session.flush()
+    # Phân quyền + danh sách thành viên lấy từ cache, không query mỗi tin
+    if not membership_cache.is_member(chat_id, sender_id):
+        emit("error", {"msg": "Not in chat"})
+        return
+    member_ids = membership_cache.chat_members(chat_id)
 
-    for m in ChatMember.query.filter_by(chat_id=chat_id).all():
-        db.session.add(MessageRecipient(message_id=message.id, receiver_id=m.account_id))
-    db.session.commit()
+    if write_behind:
+        # Ghi log + cấp id, DB được ghi theo lô ở thread nền
+        record = write_behind.append(chat_id, sender_id, content, json.dumps(aes_key_encrypted), iv, tag)
+        message_id, timestamp = record["id"], record["timestamp"]
+    else:
+        # LƯU DB: dict → JSON string, 1 transaction
+        message = create_message(chat_id, sender_id, content, aes_key_encrypted, iv, tag, member_ids=member_ids)
+        message_id, timestamp = message.id, message.timestamp.isoformat()
 
-    # EMIT: dict nguyên bản
+    # EMIT: dict nguyên bản cho room JSON, envelope msgpack cho room nhị phân
     event = {
-        "id": message.id,
+        "id": message_id,
         "chat_id": chat_id,
         "sender_id": sender_id,
         "content": content,
         "aes_key_encrypted": aes_key_encrypted,
         "iv": iv,
         "tag": tag,
-        "timestamp": message.timestamp.isoformat()
+        "timestamp": timestamp
     }
-    emit("receive_message", event, room=f"chat_{chat_id}", include_self=True)
+    emit("receive_message", event, room=chat_room(chat_id), include_self=True)
+    if wire_format.AVAILABLE:
+        emit("receive_message", wire_format.pack_message(event), room=chat_room(chat_id, True), include_self=True)
+    broadcast_chat_summaries(chat_id, sender_id, message_id, member_ids)
+
+@socketio.on("mark_read")
+def handle_mark_read(data):
+    """Dời watermark đã đọc, đặt lại bộ đếm và đồng bộ badge cho mọi kết nối của user."""
+    chat_id = parse_chat_id(data.get("chat_id"))
+    user_id = presence.user_for_sid(request.sid)
+    if not user_id:
+        return
+    if chat_id is None:
+        emit("error", {"msg": "Invalid data"})
+        return
+    if not membership_cache.is_member(chat_id, user_id):
+        emit("error", {"msg": "Not in chat"})
+        return
+    up_to_message_id = data.get("up_to_message_id")
+    if up_to_message_id is not None:
+        try:
+            up_to_message_id = parse_message_id(up_to_message_id)
+        except ValueError:
+            emit("error", {"msg": "Invalid data"})
+            return
+    up_to_message_id = advance_read_watermark(chat_id, user_id, up_to_message_id)
+    unread = unread_counts(user_id, [chat_id]).get(chat_id, 0)
+    presence.set_unread(user_id, chat_id, unread)
+    socketio.emit("chat_summary", {
+        "chat_id": chat_id,
+        "unread": unread,
+        "last_read_message_id": up_to_message_id
+    }, to=f"user_{user_id}")
+
+def handle_notify(event, data, emit_to_clients=False):
+    """
+    Thông báo từ REST server (services/socket_notify.py).
+    emit_to_clients: nhận qua endpoint nội bộ (1 socket server) -> server này phát sự kiện
+    cho client; qua kênh Redis thì REST đã tự emit qua message queue.
+    """
+    if event == "chat_members_changed":
+        chat_id = int(data["chat_id"])
+        member_ids = [int(uid) for uid in data.get("member_ids", [])]
+        membership_cache.invalidate_chat(chat_id, member_ids)
+        if emit_to_clients:
+            # Client bỏ chi tiết chat (members, fingerprint) đang cache
+            for uid in membership_cache.chat_members(chat_id):
+                socketio.emit("chat_members_changed", {"chat_id": chat_id}, to=f"user_{uid}")
+        # Thành viên đang online có thêm / bớt người cùng chat: cập nhật danh sách online của họ
+        if presence.claim(f"chat_members_changed:{data.get('nonce', chat_id)}"):
+            refresh_presence(set(membership_cache.chat_members(chat_id)) | set(member_ids))
+    elif event == "profile_updated":
+        user_id = int(data["user_id"])
+        membership_cache.invalidate_name(user_id)
+        if emit_to_clients:
+            socketio.emit("profile_updated", {"user_id": user_id})
+    elif event == "message_created":
+        # Tin gửi qua REST: tăng bộ đếm chưa đọc như tin gửi qua socket (1 worker xử lý)
+        message_id = int(data["message_id"])
+        if presence.claim(f"message_created:{message_id}"):
+            broadcast_chat_summaries(
+                int(data["chat_id"]), int(data["sender_id"]), message_id,
+                [int(uid) for uid in data.get("member_ids", [])]
+            )
+    elif event == "chat_read":
+        # mark_read qua REST: đặt lại bộ đếm và đồng bộ badge cho mọi kết nối của user
+        if presence.claim(f"chat_read:{data['nonce']}"):
+            user_id, chat_id = int(data["user_id"]), int(data["chat_id"])
+            presence.set_unread(user_id, chat_id, int(data["unread"]))
+            socketio.emit("chat_summary", {
+                "chat_id": chat_id,
+                "unread": int(data["unread"]),
+                "last_read_message_id": data["last_read_message_id"]
+            }, to=f"user_{user_id}")
+
+def handle_notify_in_context(event, data):
+    """Kênh Redis: handler chạy ở background task, cần app context để đọc DB (tên chat, ...)."""
+    with flask_app.app_context():
+        handle_notify(event, data)
+
+@flask_app.route(socket_notify.NOTIFY_PATH, methods=["POST"])
+def internal_notify():
+    token = request.headers.get("X-Internal-Token", "")
+    if not hmac.compare_digest(token, socket_notify.internal_token(flask_app.config["SECRET_KEY"])):
+        abort(403)
+    payload = request.get_json(silent=True) or {}
+    handle_notify(payload.get("event"), payload.get("data") or {}, emit_to_clients=True)
+    return {"ok": True}
+
+# Nhiều worker: thông báo đến qua kênh Redis
+socketio.start_background_task(socket_notify.listen, flask_app.config["SOCKET_MESSAGE_QUEUE"], handle_notify_in_context)
+
+def prune_events_loop():
+    """Xóa user_events quá hạn định kỳ (mỗi worker đều chạy được: DELETE lặp lại vô hại)."""
+    retention_days = flask_app.config["USER_EVENT_RETENTION_DAYS"]
+    if retention_days <= 0:
+        return
+    while True:
+        try:
+            with flask_app.app_context():
+                removed = prune_user_events(retention_days)
+            if removed:
+                logging.info("Pruned %d user events older than %d days", removed, retention_days)
+        except Exception:
+            logging.exception("Pruning user events failed")
+        socketio.sleep(flask_app.config["USER_EVENT_PRUNE_INTERVAL"])
+
+socketio.start_background_task(prune_events_loop)
 
 @flask_app.route("/_connected_users")
 def list_connected():
-    return {"connected_users": list(connected_users.keys())}
+    return {"connected_users": presence.online_users()}
+
+@flask_app.route("/_membership_cache")
+def membership_cache_stats():
+    return membership_cache.stats()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    socketio.run(flask_app, host="0.0.0.0", port=5001, debug=True)
\ No newline at end of file
+    # Reloader chạy 2 process -> 2 bộ đếm id, nên tắt khi dùng write-behind
+    socketio.run(
+        flask_app, host="0.0.0.0", port=flask_app.config["SOCKET_PORT"], debug=True,
+        use_reloader=write_behind is None,
+        **server_options(flask_app.config["SOCKET_MAX_CONNECTIONS"])
+    )
\ No newline at end of file
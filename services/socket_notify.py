@@ -0,0 +1,86 @@
+# services/socket_notify.py
+# Thông báo từ REST server (port 5000) tới socket server: các thay đổi mà cache của
+# socket server phải biết ngay (thành viên chat, tên hiển thị) thay vì chờ hết TTL.
+# - SOCKET_MESSAGE_QUEUE là redis://: publish lên 1 kênh Redis, mọi socket worker đều nhận.
+# - Không có message queue (1 socket server): POST nội bộ tới SOCKET_INTERNAL_URL.
+# Chỉ dùng thư viện chuẩn ở phía gửi (REST không cần cài thêm gì).
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import urllib.request
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "securechat:socket-notify"
+NOTIFY_PATH = "/_internal/notify"
+NOTIFY_TIMEOUT = 2
+
+
+def internal_token(secret_key):
+    """Token của endpoint nội bộ, dẫn xuất từ SECRET_KEY dùng chung của 2 process."""
+    return hmac.new(secret_key.encode("utf-8"), b"socket-notify", hashlib.sha256).hexdigest()
+
+def _uses_redis(queue_url):
+    return bool(queue_url) and queue_url.startswith(("redis://", "rediss://", "unix://"))
+
+def uses_pubsub():
+    """
+    True: thông báo đi qua kênh Redis tới mọi worker, nên sự kiện cho client phải được
+    REST tự emit qua message queue (nếu mỗi worker tự emit sẽ bị nhân N lần).
+    False: 1 socket server nhận qua NOTIFY_PATH và tự emit cho client.
+    """
+    return _uses_redis(current_app.config.get("SOCKET_MESSAGE_QUEUE"))
+
+
+def notify(event, data):
+    """
+    Gửi 1 thông báo {"event", "data"} tới socket server, không chặn request hiện tại.
+    Lỗi chỉ được log: thay đổi đã commit, cache phía socket server vẫn hết hạn theo TTL.
+    """
+    config = current_app.config
+    body = json.dumps({"event": event, "data": data})
+    queue_url = config.get("SOCKET_MESSAGE_QUEUE")
+    if _uses_redis(queue_url):
+        target = lambda: _publish(queue_url, body)
+    else:
+        target = lambda: _post(config["SOCKET_INTERNAL_URL"], internal_token(config["SECRET_KEY"]), body)
+    threading.Thread(target=target, name="socket-notify", daemon=True).start()
+
+def _publish(queue_url, body):
+    try:
+        import redis  # Chỉ cần khi chạy nhiều socket worker
+        redis.Redis.from_url(queue_url).publish(CHANNEL, body)
+    except Exception as e:
+        logger.warning("Socket notify (redis) failed: %s", e)
+
+def _post(base_url, token, body):
+    request = urllib.request.Request(
+        base_url.rstrip("/") + NOTIFY_PATH, data=body.encode("utf-8"), method="POST",
+        headers={"Content-Type": "application/json", "X-Internal-Token": token}
+    )
+    try:
+        urllib.request.urlopen(request, timeout=NOTIFY_TIMEOUT).close()
+    except Exception as e:
+        logger.warning("Socket notify (%s) failed: %s", base_url, e)
+
+
+def listen(queue_url, handler):
+    """
+    Phía socket worker: nghe kênh Redis (chạy trong background task), gọi handler(event, data).
+    Trả về ngay nếu message queue không phải Redis (khi đó thông báo đến qua NOTIFY_PATH).
+    """
+    if not _uses_redis(queue_url):
+        return
+    import redis
+    pubsub = redis.Redis.from_url(queue_url, decode_responses=True).pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(CHANNEL)
+    for message in pubsub.listen():
+        try:
+            payload = json.loads(message["data"])
+            handler(payload["event"], payload.get("data") or {})
+        except Exception:
+            logger.exception("Bad socket notify message")
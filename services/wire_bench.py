@@ -0,0 +1,64 @@
+# services/wire_bench.py
+# So sánh JSON (base64) với envelope msgpack cho payload receive_message:
+# số byte trên đường truyền và thời gian encode/decode, theo số thành viên nhóm.
+#
+#   python -m services.wire_bench -n 2000
+import argparse
+import base64
+import json
+import os
+import time
+
+from services import wire_format
+
+
+def _b64(size):
+    return base64.b64encode(os.urandom(size)).decode("utf-8")
+
+
+def sample_message(members, text_size=200, sender_key=False):
+    """Tin nhắn giả lập: khóa RSA-2048 wrap (256 byte) cho mỗi thành viên, hoặc tham chiếu sender key."""
+    keys = {"sk": 42, "n": 7} if sender_key else {str(1000 + i): _b64(256) for i in range(members)}
+    return {
+        "id": 123456,
+        "chat_id": 99,
+        "sender_id": 1000,
+        "content": _b64(text_size),
+        "aes_key_encrypted": keys,
+        "iv": _b64(16),
+        "tag": _b64(16),
+        "timestamp": "2026-01-17T16:10:57.123456"
+    }
+
+
+def _time(fn, arg, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn(arg)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON vs msgpack message envelope")
+    parser.add_argument("-n", type=int, default=2000, help="số lần lặp mỗi phép đo")
+    args = parser.parse_args()
+    if not wire_format.AVAILABLE:
+        raise SystemExit("msgpack chưa được cài (pip install msgpack)")
+
+    print(f"{'payload':<16}{'json B':>10}{'msgpack B':>11}{'saved':>8}"
+          f"{'json enc/dec µs':>20}{'mp enc/dec µs':>18}")
+    cases = [(f"{m} members", sample_message(m)) for m in (2, 10, 50, 200)]
+    cases.append(("sender key", sample_message(0, sender_key=True)))
+    for name, msg in cases:
+        as_json = json.dumps(msg).encode("utf-8")
+        as_mp = wire_format.pack_message(msg)
+        json_enc = _time(lambda m: json.dumps(m).encode("utf-8"), msg, args.n)
+        json_dec = _time(json.loads, as_json, args.n)
+        mp_enc = _time(wire_format.pack_message, msg, args.n)
+        mp_dec = _time(wire_format.unpack_message, as_mp, args.n)
+        print(f"{name:<16}{len(as_json):>10}{len(as_mp):>11}{1 - len(as_mp) / len(as_json):>8.0%}"
+              f"{json_enc:>10.1f}/{json_dec:<9.1f}{mp_enc:>8.1f}/{mp_dec:<9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# services/wire_format.py
+# Envelope nhị phân (msgpack) cho tin nhắn mã hóa, dùng chung cho client và server.
+# - Trên Socket.IO: frame nhị phân thay cho JSON (thoả thuận theo từng kết nối).
+# - Trong DB: cột LONGBLOB messages.envelope (khi bật MESSAGE_ENVELOPE_STORAGE).
+# content / iv / tag / khóa wrap được giữ ở dạng bytes thô, không base64.
+# Dạng "JSON" (chuỗi base64 + dict aes_key_encrypted) vẫn là dạng chuẩn trong code;
+# module này chỉ chuyển đổi ở biên.
+import base64
+import json
+
+try:
+    import msgpack  # Phụ thuộc tuỳ chọn: pip install msgpack
+except ImportError:
+    msgpack = None
+
+BINARY = "msgpack"
+AVAILABLE = msgpack is not None
+
+
+def _b64decode(value):
+    return base64.b64decode(value) if value else b""
+
+def _b64encode(value):
+    return base64.b64encode(value).decode("utf-8")
+
+def _pack_keys(aes_key_encrypted):
+    if isinstance(aes_key_encrypted, str):
+        aes_key_encrypted = json.loads(aes_key_encrypted)
+    if "sk" in aes_key_encrypted:
+        return {"sk": int(aes_key_encrypted["sk"]), "n": int(aes_key_encrypted["n"])}
+    return {int(mid): _b64decode(wrapped) for mid, wrapped in aes_key_encrypted.items()}
+
+def _unpack_keys(keys):
+    if "sk" in keys:
+        return {"sk": keys["sk"], "n": keys["n"]}
+    return {str(mid): _b64encode(wrapped) for mid, wrapped in keys.items()}
+
+
+def _is_b64(value):
+    if not isinstance(value, str):
+        return False
+    try:
+        base64.b64decode(value, validate=True)
+    except (ValueError, TypeError):
+        return False
+    return True
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def normalize_payload(content, aes_key_encrypted, iv, tag):
+    """
+    Kiểm tra các trường mã hóa client gửi lên, trước khi lưu / phát đi.
+    Trả về (content, aes_key_encrypted dict, iv, tag): khóa thành viên là chuỗi số,
+    khóa chuỗi sender key {"sk", "n"} là int. ValueError nếu không hợp lệ,
+    nên pack_fields / pack_message về sau không thể lỗi trên dữ liệu này.
+    """
+    if not all(_is_b64(v) for v in (content, iv, tag)):
+        raise ValueError("content, iv and tag must be base64 strings")
+    if isinstance(aes_key_encrypted, str):
+        try:
+            aes_key_encrypted = json.loads(aes_key_encrypted)
+        except ValueError:
+            raise ValueError("aes_key_encrypted must be an object")
+    if not isinstance(aes_key_encrypted, dict) or not aes_key_encrypted:
+        raise ValueError("aes_key_encrypted must be an object")
+
+    if "sk" in aes_key_encrypted:
+        sk, n = aes_key_encrypted.get("sk"), aes_key_encrypted.get("n")
+        if set(aes_key_encrypted) != {"sk", "n"} or not _is_int(sk) or not _is_int(n) or n < 0:
+            raise ValueError("Invalid sender key reference")
+        return content, {"sk": sk, "n": n}, iv, tag
+
+    keys = {}
+    for mid, wrapped in aes_key_encrypted.items():
+        if not (str(mid).isdigit() and _is_b64(wrapped)):
+            raise ValueError("Invalid wrapped key")
+        keys[str(int(mid))] = wrapped
+    return content, keys, iv, tag
+
+
+# -----------------------------
+# Trường mã hóa của 1 tin (lưu DB)
+# -----------------------------
+def pack_fields(content, aes_key_encrypted, iv, tag):
+    return msgpack.packb({
+        "b": _b64decode(content),
+        "i": _b64decode(iv),
+        "t": _b64decode(tag),
+        "k": _pack_keys(aes_key_encrypted)
+    }, use_bin_type=True)
+
+def unpack_fields(blob):
+    """Trả về (content, aes_key_encrypted dict, iv, tag) ở dạng base64 như cũ."""
+    env = msgpack.unpackb(blob, raw=False, strict_map_key=False)
+    return _b64encode(env["b"]), _unpack_keys(env["k"]), _b64encode(env["i"]), _b64encode(env["t"])
+
+def message_fields(message):
+    """(content, aes_key_encrypted chuỗi JSON, iv, tag) của 1 Message, dù lưu ở cột text hay envelope."""
+    if message.envelope:
+        content, keys, iv, tag = unpack_fields(message.envelope)
+        return content, json.dumps(keys), iv, tag
+    return message.content, message.aes_key_encrypted, message.iv, message.tag
+
+
+# -----------------------------
+# Tin nhắn trên Socket.IO
+# -----------------------------
+def pack_message(msg):
+    """Dict tin nhắn dạng JSON (send_message / receive_message) -> bytes."""
+    env = {
+        "c": msg["chat_id"],
+        "b": _b64decode(msg["content"]),
+        "i": _b64decode(msg["iv"]),
+        "t": _b64decode(msg["tag"]),
+        "k": _pack_keys(msg["aes_key_encrypted"])
+    }
+    for field, short in (("id", "id"), ("sender_id", "s"), ("timestamp", "ts")):
+        if msg.get(field) is not None:
+            env[short] = msg[field]
+    return msgpack.packb(env, use_bin_type=True)
+
+def unpack_message(data):
+    """bytes -> dict tin nhắn dạng JSON (cùng khóa với pack_message)."""
+    env = msgpack.unpackb(data, raw=False, strict_map_key=False)
+    msg = {
+        "chat_id": env["c"],
+        "content": _b64encode(env["b"]),
+        "iv": _b64encode(env["i"]),
+        "tag": _b64encode(env["t"]),
+        "aes_key_encrypted": _unpack_keys(env["k"])
+    }
+    for field, short in (("id", "id"), ("sender_id", "s"), ("timestamp", "ts")):
+        if short in env:
+            msg[field] = env[short]
+    return msg
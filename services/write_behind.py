@@ -0,0 +1,333 @@
+# services/write_behind.py
+# Hàng đợi ghi trễ (write-behind) cho socket server:
+# cấp id -> ghi log append-only (fsync) -> broadcast ngay -> thread nền ghi DB theo lô.
+import json
+import logging
+import os
+import threading
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.exc import DisconnectionError, OperationalError, TimeoutError as PoolTimeoutError
+from app import db
+from models import Message
+from services.async_backend import run_blocking
+from services.message_service import insert_messages
+
+logger = logging.getLogger(__name__)
+
+# Lỗi tạm thời (mất kết nối, lock wait, hết pool): giữ nguyên lô và thử lại.
+# Mọi lỗi khác (IntegrityError, dữ liệu không encode được...) là lỗi của record.
+TRANSIENT_ERRORS = (OperationalError, DisconnectionError, PoolTimeoutError)
+# Log được chia thành các segment <log_path>.<n>; segment mới khi segment hiện tại vượt cỡ này.
+# Segment cũ bị xoá khi mọi record trong nó đã vào DB, nên log không lớn dần khi hàng đợi không bao giờ rỗng.
+SEGMENT_BYTES = 4 * 1024 * 1024
+
+
+class WriteBehindQueue:
+    """
+    Chỉ dùng khi socket server là nơi DUY NHẤT ghi tin nhắn (1 process),
+    vì id được cấp từ bộ đếm trong bộ nhớ.
+    - append(): cấp id + ghi vào log dưới lock; fsync ngoài lock và gom nhóm
+      (1 lần fsync cho mọi append đã ghi trước đó), nên các sender không fsync nối đuôi nhau.
+    - Checkpoint theo segment: xoá segment đã ghi hết vào DB, kể cả khi hàng đợi chưa bao giờ rỗng.
+    """
+
+    def __init__(self, app, log_path, dead_letter_path=None, batch_size=200, flush_interval=0.05, fsync=True,
+                 segment_bytes=SEGMENT_BYTES):
+        self.app = app
+        self.log_path = log_path
+        self.dead_letter_path = dead_letter_path or log_path + ".dead"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.segment_bytes = segment_bytes
+
+        self._cond = threading.Condition()
+        self._pending = []
+        self._next_id = None
+        self._log = None
+        # Thứ tự lock: _sync_lock trước _cond. _sync_lock: 1 fsync tại 1 thời điểm, đổi segment.
+        self._sync_lock = threading.Lock()
+        self._written = 0 # Số record đã ghi vào log (kể từ start)
+        self._synced = 0  # Số record đầu tiên đã fsync
+        # Segment theo thứ tự ghi: [số thứ tự, path, số record chưa vào DB]; phần tử cuối đang được ghi
+        self._segments = deque()
+        self._thread = None
+        self._stopping = False
+        self._dead_letters = 0
+
+    # -----------------------------
+    # Lifecycle
+    # -----------------------------
+    def start(self):
+        """Replay log còn sót (sau crash), seed bộ đếm id rồi chạy thread ghi nền."""
+        for path in (self.log_path, self.dead_letter_path):
+            log_dir = os.path.dirname(path)
+            if log_dir:
+                os.makedirs(log_dir, exist_ok=True)
+
+        with self.app.app_context():
+            last_segment = self._recover()
+            max_id = db.session.query(func.max(Message.id)).scalar() or 0
+        self._next_id = max_id + 1
+
+        self._open_segment(last_segment + 1)
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        logger.info("Write-behind started: next_id=%s log=%s", self._next_id, self.log_path)
+
+    def stop(self):
+        """Dừng thread nền sau khi đã ghi hết các tin còn chờ."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+        if self._log:
+            self._log.close()
+            self._log = None
+
+    # -----------------------------
+    # Producer
+    # -----------------------------
+    def append(self, chat_id, sender_id, content, aes_key_encrypted, iv, tag):
+        """
+        Cấp id, ghi bền vào log và đưa vào hàng đợi. Trả về record (có id, timestamp)
+        để broadcast ngay mà không chờ DB commit.
+        """
+        with self._cond:
+            record = {
+                "id": self._next_id,
+                "chat_id": chat_id,
+                "sender_id": sender_id,
+                "content": content,
+                "aes_key_encrypted": aes_key_encrypted,
+                "iv": iv,
+                "tag": tag,
+                "timestamp": datetime.utcnow().isoformat()
+            }
+            self._next_id += 1
+            self._log.write(json.dumps(record) + "\n")
+            self._written += 1
+            written = self._written
+            self._segments[-1][2] += 1
+            self._pending.append(record)
+            self._cond.notify()
+        self._sync(written)
+        return record
+
+    def _sync(self, written):
+        """
+        Chờ tới khi record thứ `written` đã bền trên đĩa. Group commit: ai vào _sync_lock trước
+        fsync mọi thứ đã ghi tới lúc đó; những người chờ sau thấy _synced đủ thì trả về ngay.
+        """
+        with self._sync_lock:
+            if self._synced >= written:
+                return
+            with self._cond:
+                self._log.flush()
+                target = self._written
+                fd = self._log.fileno()
+            if self.fsync:
+                run_blocking(os.fsync, fd)
+            self._synced = target
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending)
+
+    def dead_letter_count(self):
+        with self._cond:
+            return self._dead_letters
+
+    # -----------------------------
+    # Background writer
+    # -----------------------------
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if not self._pending and self._stopping:
+                    return
+                batch = self._pending[:self.batch_size]
+
+            done = self._flush(batch)
+            if done < len(batch):
+                # Lỗi tạm thời: đợi rồi thử lại phần còn lại (thứ tự id được giữ nguyên)
+                with self._cond:
+                    del self._pending[:done]
+                self._checkpoint(done)
+                with self._cond:
+                    self._cond.wait(timeout=1.0)
+                continue
+
+            with self._cond:
+                del self._pending[:done]
+            self._checkpoint(done)
+
+            # Gom lô: đợi thêm một chút để các tin đến sau đi chung 1 transaction
+            if self.flush_interval and not self._stopping:
+                with self._cond:
+                    if len(self._pending) < self.batch_size:
+                        self._cond.wait(timeout=self.flush_interval)
+
+    # -----------------------------
+    # Segment
+    # -----------------------------
+    def _segment_path(self, number):
+        return f"{self.log_path}.{number}"
+
+    def _open_segment(self, number):
+        """Gọi khi giữ _sync_lock + _cond (hoặc lúc start, chưa có thread khác)."""
+        path = self._segment_path(number)
+        self._log = open(path, "a", encoding="utf-8")
+        self._segments.append([number, path, 0])
+
+    def _checkpoint(self, done):
+        """
+        Trừ `done` record đầu hàng đợi khỏi các segment cũ nhất (hàng đợi và segment cùng thứ tự),
+        xoá segment cũ đã ghi hết vào DB, sang segment mới khi segment hiện tại vượt segment_bytes.
+        """
+        finished, closed = [], None
+        with self._sync_lock:
+            with self._cond:
+                for segment in self._segments:
+                    if not done:
+                        break
+                    taken = min(done, segment[2])
+                    segment[2] -= taken
+                    done -= taken
+                while len(self._segments) > 1 and self._segments[0][2] == 0:
+                    finished.append(self._segments.popleft()[1])
+
+                if not self._pending and self._segments[-1][2] == 0:
+                    # Mọi record đều đã vào DB -> cắt segment hiện tại như trước
+                    self._log.seek(0)
+                    self._log.truncate()
+                    self._log.flush()
+                elif self._log.tell() >= self.segment_bytes:
+                    closed, closed_written = self._log, self._written
+                    closed.flush()
+                    current = self._segments[-1]
+                    self._open_segment(current[0] + 1) # append tiếp theo ghi vào segment mới
+                    if current[2] == 0:
+                        self._segments.remove(current)
+                        finished.append(current[1])
+            if closed is not None:
+                # Vẫn giữ _sync_lock: append đang chờ record trong segment cũ chỉ trả về sau fsync này
+                if self.fsync:
+                    run_blocking(os.fsync, closed.fileno())
+                closed.close()
+                self._synced = max(self._synced, closed_written)
+        for path in finished:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _flush(self, batch):
+        """
+        Ghi 1 lô vào DB. Trả về số record đầu lô đã xử lý xong (đã vào DB hoặc dead-letter).
+        - Lỗi tạm thời: dừng lại, phần còn lại được thử lại sau.
+        - Lỗi khác: chia đôi lô để tìm record hỏng, chuyển nó sang dead-letter và ghi tiếp,
+          nên 1 record hỏng không chặn các tin sau nó.
+        """
+        try:
+            with self.app.app_context():
+                insert_messages([self._to_row(r) for r in batch])
+            return len(batch)
+        except TRANSIENT_ERRORS:
+            logger.exception("Write-behind flush failed (%d messages), retrying", len(batch))
+            return 0
+        except Exception as e:
+            if len(batch) > 1:
+                mid = len(batch) // 2
+                done = self._flush(batch[:mid])
+                if done < mid:
+                    return done
+                return mid + self._flush(batch[mid:])
+            record = batch[0]
+            try:
+                with self.app.app_context():
+                    stored = db.session.query(Message.id).filter(Message.id == record["id"]).first() is not None
+            except TRANSIENT_ERRORS:
+                return 0
+            if stored:
+                # Lần ghi trước đã commit nhưng mất kết nối trước khi báo thành công
+                return 1
+            logger.error("Write-behind: moving message %s to dead-letter: %r", record.get("id"), e)
+            self._dead_letter(record, e)
+            return 1
+
+    def _dead_letter(self, record, error):
+        """Ghi record không chèn được vào file dead-letter (JSON lines) để xử lý tay."""
+        entry = {"record": record, "error": repr(error), "failed_at": datetime.utcnow().isoformat()}
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        with self._cond:
+            self._dead_letters += 1
+
+    # -----------------------------
+    # Crash recovery
+    # -----------------------------
+    def _existing_segments(self):
+        """[(số thứ tự, path)] của các segment trên đĩa, tăng dần."""
+        directory = os.path.dirname(self.log_path) or "."
+        prefix = os.path.basename(self.log_path) + "."
+        segments = []
+        for name in os.listdir(directory):
+            suffix = name[len(prefix):]
+            if name.startswith(prefix) and suffix.isdigit():
+                segments.append((int(suffix), os.path.join(directory, name)))
+        return sorted(segments)
+
+    def _recover(self):
+        """
+        Đọc lại log (file đơn của bản cũ + các segment), chèn các record chưa có trong DB
+        rồi xoá log. Trả về số thứ tự segment lớn nhất đã thấy (-1 nếu không có).
+        """
+        segments = self._existing_segments()
+        paths = ([self.log_path] if os.path.exists(self.log_path) else []) + [path for _, path in segments]
+
+        records = []
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Dòng cuối bị ghi dở khi crash -> bỏ qua
+                        logger.warning("Skipping corrupt write-behind log line in %s", path)
+
+        if records:
+            ids = [r["id"] for r in records]
+            existing = set()
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                existing.update(mid for (mid,) in db.session.query(Message.id).filter(Message.id.in_(chunk)).all())
+            missing = [r for r in records if r["id"] not in existing]
+            for i in range(0, len(missing), self.batch_size):
+                batch = missing[i:i + self.batch_size]
+                if self._flush(batch) < len(batch):
+                    # Giữ nguyên log, lần khởi động sau replay lại
+                    raise RuntimeError("Write-behind replay failed: database unavailable")
+            logger.info("Write-behind replay: %d records, %d restored", len(records), len(missing))
+
+        for path in paths:
+            os.remove(path)
+        return segments[-1][0] if segments else -1
+
+    @staticmethod
+    def _to_row(record):
+        row = dict(record)
+        row["timestamp"] = datetime.fromisoformat(record["timestamp"])
+        return row